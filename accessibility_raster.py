@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import os
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from route_geometry import METERS_PER_DEGREE
+
+# 値のないセル（候補避難所がない、到達不能、建物から遠い、OSRMが失敗した）
+NODATA = -9999.0
+
+# ESRI 形式の WGS84 (.prj)
+WGS84_PRJ = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+             'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+Tile = Tuple[int, int, int, int]
+
+
+# MARK: グリッド
+class AccessibilityGrid:
+    """
+    調査範囲に重ねる経緯度の等間隔グリッド
+
+    セルの大きさは範囲の中央の緯度で cell_size_m 四方になるよう経度・緯度の刻みを決める
+    （県程度の範囲なら南北の端でも数%の差）。行0が北端で、セルの値は中心点からの所要時間。
+    """
+
+    def __init__(self, west: float, south: float, east: float, north: float, cell_size_m: float):
+        if cell_size_m <= 0:
+            raise ValueError(f"セルサイズは正の値にしてください: {cell_size_m}")
+        self.cell_size_m = cell_size_m
+        self.cell_lat = cell_size_m / METERS_PER_DEGREE
+        self.cell_lon = cell_size_m / (METERS_PER_DEGREE * math.cos(math.radians((south + north) / 2.0)))
+        self.west = west
+        self.north = north
+        self.cols = max(1, math.ceil((east - west) / self.cell_lon))
+        self.rows = max(1, math.ceil((north - south) / self.cell_lat))
+
+    @classmethod
+    def from_points(cls, lon: np.ndarray, lat: np.ndarray, cell_size_m: float,
+                    margin_m: float = 0.0) -> "AccessibilityGrid":
+        """点群の外接矩形を margin_m だけ広げた範囲のグリッド"""
+        if len(lon) == 0:
+            raise ValueError("グリッドの範囲を決める点がありません")
+        south, north = float(np.min(lat)), float(np.max(lat))
+        margin_lat = margin_m / METERS_PER_DEGREE
+        margin_lon = margin_m / (METERS_PER_DEGREE * math.cos(math.radians((south + north) / 2.0)))
+        return cls(float(np.min(lon)) - margin_lon, south - margin_lat,
+                   float(np.max(lon)) + margin_lon, north + margin_lat, cell_size_m)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.rows, self.cols
+
+    def tiles(self, tile_cells: int) -> Iterator[Tile]:
+        """tile_cells 四方のタイル (row0, row1, col0, col1) を北西から順に返す"""
+        for row0 in range(0, self.rows, tile_cells):
+            for col0 in range(0, self.cols, tile_cells):
+                yield row0, min(row0 + tile_cells, self.rows), col0, min(col0 + tile_cells, self.cols)
+
+    def cell_centers(self, tile: Tile) -> Tuple[np.ndarray, np.ndarray]:
+        """タイル内のセル中心の (経度, 緯度)。行優先で平らにした配列"""
+        row0, row1, col0, col1 = tile
+        lon = self.west + (np.arange(col0, col1) + 0.5) * self.cell_lon
+        lat = self.north - (np.arange(row0, row1) + 0.5) * self.cell_lat
+        lon_grid, lat_grid = np.meshgrid(lon, lat)
+        return lon_grid.ravel(), lat_grid.ravel()
+
+
+# MARK: 書き出し
+class AccessibilityRasterWriter:
+    """
+    グリッドの値をタイルごとにファイルへ書き出す（全体を np.memmap にし、メモリにはタイル分だけ載せる）
+
+    - .npy: NumPy 配列（float32）と、範囲・セルの大きさを記録した同名の .json
+    - それ以外（.bil など）: ESRI BIL 形式（.hdr と .prj を同じ場所に作成し、ArcGIS でそのままラスタとして開ける）
+
+    未書き込みのセルは NODATA のまま残る。
+    """
+
+    def __init__(self, path: str, grid: AccessibilityGrid, nodata: float = NODATA):
+        self.path = path
+        self.grid = grid
+        self.nodata = nodata
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        base, ext = os.path.splitext(path)
+        if ext.lower() == ".npy":
+            self._array = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=grid.shape)
+            self._write_text(base + ".json", json.dumps(self.metadata(), ensure_ascii=False, indent=2))
+        else:
+            self._array = np.memmap(path, mode="w+", dtype="<f4", shape=grid.shape)
+            self._write_text(base + ".hdr", self._bil_header())
+            self._write_text(base + ".prj", WGS84_PRJ)
+        self._array[:] = nodata
+
+    def metadata(self):
+        """範囲とセルの大きさ（セル中心ではなく外周の座標）"""
+        grid = self.grid
+        return {
+            'crs': 'EPSG:4326',
+            'rows': grid.rows,
+            'cols': grid.cols,
+            'west': grid.west,
+            'north': grid.north,
+            'cell_lon': grid.cell_lon,
+            'cell_lat': grid.cell_lat,
+            'cell_size_m': grid.cell_size_m,
+            'nodata': self.nodata,
+            'units': 'seconds',
+        }
+
+    def _bil_header(self) -> str:
+        grid = self.grid
+        lines = [
+            "BYTEORDER I",
+            "LAYOUT BIL",
+            f"NROWS {grid.rows}",
+            f"NCOLS {grid.cols}",
+            "NBANDS 1",
+            "NBITS 32",
+            "PIXELTYPE FLOAT",
+            f"BANDROWBYTES {grid.cols * 4}",
+            f"TOTALROWBYTES {grid.cols * 4}",
+            f"ULXMAP {grid.west + grid.cell_lon / 2.0!r}",
+            f"ULYMAP {grid.north - grid.cell_lat / 2.0!r}",
+            f"XDIM {grid.cell_lon!r}",
+            f"YDIM {grid.cell_lat!r}",
+            f"NODATA {self.nodata:g}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_text(path: str, text: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def write_tile(self, tile: Tile, values: np.ndarray):
+        """タイルの値（cell_centers と同じ順に平らにした配列）を書き込む"""
+        row0, row1, col0, col1 = tile
+        self._array[row0:row1, col0:col1] = np.asarray(values, dtype=np.float32).reshape(row1 - row0, col1 - col0)
+
+    def close(self):
+        """ディスクに書き出して閉じる"""
+        if self._array is not None:
+            self._array.flush()
+            self._array = None
@@ -1,24 +1,61 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import gzip
+import hashlib
 import requests
+import struct
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
+import numpy as np
 
-def call_cpp_aggregation_server(points_dict: Dict[int, Dict[str, Any]],
+from point_set import PointSet, Points
+
+# zstd 圧縮はオプション（zstandard がなければ gzip を使用）
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# C++集約のPython拡張モジュール（cpp_aggregation_server をビルドしたもの、なければHTTPサーバーを使用）
+try:
+    import aggregation_native
+except ImportError:
+    aggregation_native = None
+
+# バイナリ形式のContent-Type（リトルエンディアンの列指向形式、サーバーの main.cpp と同じ定義）
+BINARY_CONTENT_TYPE = "application/x-aggregation-binary"
+BINARY_REQUEST_MAGIC = b"AGP1"
+BINARY_RESPONSE_MAGIC = b"AGR1"
+BINARY_MEMBERSHIP_MAGIC = b"AGM1"
+BINARY_HEADER_SIZE = 8  # マジック4バイト + 点数 uint32
+
+
+def call_cpp_aggregation_server(points_dict: Points,
                                radius_meters: float,
-                               server_url: str = "http://localhost:8080") -> Dict[int, Dict[str, Any]]:
+                               server_url: str = "http://localhost:8080",
+                               mode: str = "serial",
+                               threads: int = 0,
+                               wire_format: str = "binary",
+                               membership: bool = False,
+                               use_cache: bool = True):
     """
     C++集約サーバーを呼び出してポイント集約を実行
 
     Args:
-        points_dict: {oid: {'oid': oid, 'lon': lon, 'lat': lat}} 形式の辞書
+        points_dict: {oid: {'oid': oid, 'lon': lon, 'lat': lat}} 形式の辞書または PointSet
         radius_meters: 集約半径（メートル）
         server_url: C++サーバーのURL
+        mode: グループ化モード ("serial": 従来の逐次処理 / "tiled": タイル分割による並列処理)
+        threads: "tiled" モードのスレッド数（0 でサーバーの全コア）
+        wire_format: 通信形式 ("binary": 列指向のバイナリ形式 / "json": 従来のJSON形式)
+        membership: True なら入力点ごとの所属グループも取得する
+        use_cache: True ならサーバーのキャッシュに同じ集約結果がある場合は送信せずに取得する
 
     Returns:
-        集約結果の辞書 (元のPythonコードと同じ形式)
+        集約結果の辞書 (元のPythonコードと同じ形式)。
+        membership が True の場合は (集約結果の辞書, build_membership の辞書) のタプル
 
     Raises:
         requests.exceptions.RequestException: サーバーとの通信エラー
@@ -28,67 +65,86 @@ def call_cpp_aggregation_server(points_dict: Dict[int, Dict[str, Any]],
 
     print(f"C++集約サーバーにリクエストを送信中... ({len(points_dict)} ポイント)")
 
-    # データの検証とフィルタリング
-    valid_points = []
-    invalid_count = 0
-
-    for p in points_dict.values():
-        # None値や無効な値をチェック
-        if (p.get("lon") is not None and p.get("lat") is not None and p.get("oid") is not None and
-            isinstance(p["lon"], (int, float)) and isinstance(p["lat"], (int, float)) and
-            isinstance(p["oid"], (int, float))):
-            valid_points.append({
-                "lon": float(p["lon"]),
-                "lat": float(p["lat"]),
-                "oid": int(p["oid"])
-            })
-        else:
-            invalid_count += 1
-            print(f"無効なポイントをスキップ: {p}")
-
-    if invalid_count > 0:
-        print(f"警告: {invalid_count} 個の無効なポイントをスキップしました")
+    # データの検証とフィルタリング（列に一括変換）
+    lon, lat, oid = points_dict_to_columns(points_dict)
+    print(f"有効なポイント数: {len(oid)}")
 
-    print(f"有効なポイント数: {len(valid_points)}")
-    points_list = valid_points
-
-    request_data = {
-        "radius": radius_meters,
-        "points": points_list
-    }
+    if use_cache:
+        cached = fetch_cached_result(lon, lat, oid, radius_meters, server_url, mode=mode, membership=membership)
+        if cached is not None:
+            print(f"処理時間: {time.time() - start_time:.2f}秒")
+            return cached
 
     # デバッグ: リクエストデータの一部を表示
-    print(f"リクエストデータ: radius={radius_meters}, points数={len(points_list)}")
-    if points_list:
-        print(f"最初のポイント例: {points_list[0]}")
-        print(f"最後のポイント例: {points_list[-1]}")
+    print(f"リクエストデータ: radius={radius_meters}, mode={mode}, format={wire_format}, points数={len(oid)}")
+    if len(oid):
+        print(f"最初のポイント例: {{'lon': {lon[0]}, 'lat': {lat[0]}, 'oid': {oid[0]}}}")
+        print(f"最後のポイント例: {{'lon': {lon[-1]}, 'lat': {lat[-1]}, 'oid': {oid[-1]}}}")
 
     try:
-        # サーバーにリクエストを送信（json=パラメータを使用）
-        response = requests.post(
-            f"{server_url}/aggregate",
-            json=request_data,
-            timeout=300  # 5分でタイムアウト
-        )
-        response.raise_for_status()
-
-        result = response.json()
+        if wire_format == "binary":
+            # サーバーにリクエストを送信（点はボディ、パラメータはクエリ文字列）
+            response = requests.post(
+                f"{server_url}/aggregate",
+                params={"radius": radius_meters, "mode": mode, "threads": threads, "membership": int(membership)},
+                data=encode_binary_points(lon, lat, oid),
+                headers={"Content-Type": BINARY_CONTENT_TYPE, "Accept": BINARY_CONTENT_TYPE},
+                timeout=300  # 5分でタイムアウト
+            )
+            response.raise_for_status()
+
+            # 所属グループは集約結果の後ろに続く
+            body = memoryview(response.content)
+            centroid_size = binary_centroids_size(body)
+            aggregated_points = decode_binary_centroids(body[:centroid_size])
+            if membership:
+                cluster_ids = decode_binary_membership(body[centroid_size:])
+            input_count = response.headers.get("X-Input-Count", len(oid))
+            output_count = response.headers.get("X-Output-Count", len(aggregated_points))
+        else:
+            request_data = {
+                "radius": radius_meters,
+                "mode": mode,
+                "threads": threads,
+                "membership": membership,
+                "points": [
+                    {"lon": lo, "lat": la, "oid": o}
+                    for lo, la, o in zip(lon.tolist(), lat.tolist(), oid.tolist())
+                ]
+            }
+
+            # サーバーにリクエストを送信（json=パラメータを使用）
+            response = requests.post(
+                f"{server_url}/aggregate",
+                json=request_data,
+                timeout=300  # 5分でタイムアウト
+            )
+            response.raise_for_status()
+
+            result = response.json()
+            if result["status"] != "success":
+                raise Exception(f"集約サーバーエラー: {result.get('message', 'Unknown error')}")
 
-        if result["status"] == "success":
             # 結果をPythonコードに合わせた形式に変換
             aggregated_points = {}
             for key, point_data in result["aggregated_points"].items():
                 aggregated_points[int(key)] = point_data
+            input_count = result['input_count']
+            output_count = result['output_count']
+            if membership:
+                cluster_ids = np.asarray(result["membership"]["cluster_ids"], dtype=np.int32)
 
-            end_time = time.time()
-            processing_time = end_time - start_time
+        end_time = time.time()
+        processing_time = end_time - start_time
 
-            print(f"C++集約完了: {result['input_count']} → {result['output_count']} ポイント")
-            print(f"処理時間: {processing_time:.2f}秒")
+        print(f"C++集約完了: {input_count} → {output_count} ポイント")
+        print(f"処理時間: {processing_time:.2f}秒")
+        if "Server-Timing" in response.headers:
+            print(f"サーバー内訳 (ms): {response.headers['Server-Timing']}")
 
-            return aggregated_points
-        else:
-            raise Exception(f"集約サーバーエラー: {result.get('message', 'Unknown error')}")
+        if membership:
+            return aggregated_points, build_membership(oid, cluster_ids, len(aggregated_points))
+        return aggregated_points
 
     except requests.exceptions.ConnectionError:
         print(f"エラー: C++集約サーバー ({server_url}) に接続できません。")
@@ -108,6 +164,518 @@ def call_cpp_aggregation_server(points_dict: Dict[int, Dict[str, Any]],
         raise
 
 
+def call_cpp_aggregation_server_session(points_dict: Points,
+                                        radius_meters: float,
+                                        server_url: str = "http://localhost:8080",
+                                        mode: str = "serial",
+                                        threads: int = 0,
+                                        chunk_size: int = 250000,
+                                        compression: str = "gzip",
+                                        page_size: int = 500000,
+                                        max_retries: int = 3,
+                                        finalize_timeout: Optional[float] = 3600,
+                                        membership: bool = False,
+                                        use_cache: bool = True):
+    """
+    アップロードセッションを使ってC++集約サーバーでポイント集約を実行
+
+    ポイントを chunk_size 件ずつのバイナリ形式チャンクに分けて圧縮して送信し、
+    集約後の結果を page_size 件ずつ取得する。1リクエストが小さいため、大量の点でも
+    タイムアウトしにくく、双方ともJSON文書全体を保持する必要がない。
+    チャンクは受信済みの点数 (offset) 付きで送るため、通信エラー時はそのまま再送できる。
+
+    Args:
+        points_dict: {oid: {'oid': oid, 'lon': lon, 'lat': lat}} 形式の辞書または PointSet
+        radius_meters: 集約半径（メートル）
+        server_url: C++サーバーのURL
+        mode: グループ化モード ("serial" / "tiled")
+        threads: "tiled" モードのスレッド数（0 でサーバーの全コア）
+        chunk_size: 1チャンクあたりの点数
+        compression: チャンクの圧縮形式 ("gzip" / "zstd" / "none")
+        page_size: 結果の1ページあたりの件数
+        max_retries: チャンク送信・結果取得の再試行回数
+        finalize_timeout: 集約処理のタイムアウト（秒、None で無制限）
+        membership: True なら入力点ごとの所属グループも取得する
+        use_cache: True ならサーバーのキャッシュに同じ集約結果がある場合はアップロードせずに取得する
+
+    Returns:
+        集約結果の辞書 (call_cpp_aggregation_server と同じ形式)。
+        membership が True の場合は (集約結果の辞書, build_membership の辞書) のタプル
+    """
+    start_time = time.time()
+
+    if compression == "zstd" and zstandard is None:
+        print("警告: zstandard がインストールされていないため gzip で圧縮します")
+        compression = "gzip"
+
+    lon, lat, oid = points_dict_to_columns(points_dict)
+    total = len(oid)
+    if use_cache:
+        cached = fetch_cached_result(lon, lat, oid, radius_meters, server_url, mode=mode, page_size=page_size,
+                                     max_retries=max_retries, membership=membership)
+        if cached is not None:
+            print(f"処理時間: {time.time() - start_time:.2f}秒")
+            return cached
+    print(f"C++集約サーバーにセッションでアップロード中... ({total} ポイント, チャンク {chunk_size} 件, 圧縮 {compression})")
+
+    response = requests.post(f"{server_url}/sessions", params={"expected_count": total}, timeout=30)
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    session_url = f"{server_url}/sessions/{session_id}"
+
+    try:
+        # チャンクを順に送信
+        sent_bytes = 0
+        for offset in range(0, total, chunk_size):
+            end = min(offset + chunk_size, total)
+            body = compress_chunk(encode_binary_points(lon[offset:end], lat[offset:end], oid[offset:end]), compression)
+            sent_bytes += len(body)
+            request_with_retry(
+                "POST", f"{session_url}/chunks", max_retries,
+                params={"offset": offset, "compression": compression},
+                data=body,
+                headers={"Content-Type": BINARY_CONTENT_TYPE},
+                timeout=60
+            )
+        print(f"アップロード完了: {total} ポイント, {sent_bytes / 1024 ** 2:.1f} MB")
+
+        # 集約を実行
+        response = request_with_retry(
+            "POST", f"{session_url}/finalize", max_retries,
+            params={"radius": radius_meters, "mode": mode, "threads": threads},
+            timeout=finalize_timeout
+        )
+        result = response.json()
+        output_count = result["output_count"]
+
+        # 結果・所属グループをページ単位で取得
+        aggregated_points = fetch_centroid_pages(f"{session_url}/results", output_count, page_size, max_retries)
+        if membership:
+            cluster_ids = fetch_membership_pages(f"{session_url}/membership", total, page_size * 4, max_retries)
+
+        print(f"C++集約完了: {result['input_count']} → {output_count} ポイント")
+        print(f"処理時間: {time.time() - start_time:.2f}秒")
+        if membership:
+            return aggregated_points, build_membership(oid, cluster_ids, output_count)
+        return aggregated_points
+
+    except requests.exceptions.RequestException as e:
+        print(f"集約サーバーとの通信エラー: {e}")
+        if getattr(e, 'response', None) is not None:
+            print(f"サーバーエラーレスポンス: {e.response.text}")
+        raise
+    finally:
+        # セッションを破棄（失敗してもサーバー側で期限切れになる）
+        try:
+            requests.delete(session_url, timeout=10)
+        except requests.exceptions.RequestException:
+            pass
+
+
+def call_cpp_aggregation_server_job(points_dict: Points,
+                                    radius_meters: float,
+                                    server_url: str = "http://localhost:8080",
+                                    mode: str = "serial",
+                                    threads: int = 0,
+                                    page_size: int = 500000,
+                                    poll_interval: float = 1.0,
+                                    max_retries: int = 3,
+                                    job_timeout: Optional[float] = None,
+                                    membership: bool = False,
+                                    use_cache: bool = True):
+    """
+    非同期ジョブとしてC++集約サーバーでポイント集約を実行
+
+    ポイントをバイナリ形式で /jobs に投入するとすぐにジョブIDが返るため、集約中に
+    HTTP接続を保持し続ける必要がない。完了までは進捗（フェーズと割合）をポーリングして表示し、
+    完了後に結果を page_size 件ずつ取得する。
+
+    Args:
+        points_dict: {oid: {'oid': oid, 'lon': lon, 'lat': lat}} 形式の辞書または PointSet
+        radius_meters: 集約半径（メートル）
+        server_url: C++サーバーのURL
+        mode: グループ化モード ("serial" / "tiled")
+        threads: "tiled" モードのスレッド数（0 でサーバーの全コア）
+        page_size: 結果の1ページあたりの件数
+        poll_interval: 進捗を問い合わせる間隔（秒）
+        max_retries: 進捗問い合わせ・結果取得の再試行回数
+        job_timeout: ジョブ完了を待つ最大時間（秒、None で無制限）
+        membership: True なら入力点ごとの所属グループも取得する
+        use_cache: True ならサーバーのキャッシュに同じ集約結果がある場合は投入せずに取得する
+
+    Returns:
+        集約結果の辞書 (call_cpp_aggregation_server と同じ形式)。
+        membership が True の場合は (集約結果の辞書, build_membership の辞書) のタプル
+
+    Raises:
+        requests.exceptions.RequestException: サーバーとの通信エラー
+        TimeoutError: job_timeout までにジョブが完了しなかった
+        Exception: サーバー側の集約処理のエラー
+    """
+    start_time = time.time()
+
+    lon, lat, oid = points_dict_to_columns(points_dict)
+    total = len(oid)
+    if use_cache:
+        cached = fetch_cached_result(lon, lat, oid, radius_meters, server_url, mode=mode, page_size=page_size,
+                                     max_retries=max_retries, membership=membership)
+        if cached is not None:
+            print(f"処理時間: {time.time() - start_time:.2f}秒")
+            return cached
+    print(f"C++集約サーバーにジョブを投入中... ({total} ポイント)")
+
+    response = requests.post(
+        f"{server_url}/jobs",
+        params={"radius": radius_meters, "mode": mode, "threads": threads, "membership": int(membership)},
+        data=encode_binary_points(lon, lat, oid),
+        headers={"Content-Type": BINARY_CONTENT_TYPE},
+        timeout=300
+    )
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    job_url = f"{server_url}/jobs/{job_id}"
+
+    try:
+        # 完了まで進捗をポーリング
+        last_message = None
+        while True:
+            status = request_with_retry("GET", job_url, max_retries, timeout=30).json()
+            if status["state"] == "done":
+                break
+            if status["state"] == "failed":
+                raise Exception(f"サーバー側の集約処理でエラー: {status.get('error', '不明なエラー')}")
+
+            if status["state"] == "queued":
+                message = f"待機中（前に {status.get('queue_position', 0)} 件）"
+            else:
+                message = f"{status['phase']} {status['fraction'] * 100:.0f}%"
+            if message != last_message:
+                print(f"  ジョブ {job_id[:8]}: {message}")
+                last_message = message
+
+            if job_timeout is not None and time.time() - start_time > job_timeout:
+                raise TimeoutError(f"ジョブが {job_timeout} 秒以内に完了しませんでした")
+            time.sleep(poll_interval)
+
+        output_count = status["output_count"]
+
+        # 結果・所属グループをページ単位で取得
+        aggregated_points = fetch_centroid_pages(f"{job_url}/result", output_count, page_size, max_retries)
+        if membership:
+            cluster_ids = fetch_membership_pages(f"{job_url}/membership", total, page_size * 4, max_retries)
+
+        print(f"C++集約完了: {status['input_count']} → {output_count} ポイント")
+        print(f"処理時間: {time.time() - start_time:.2f}秒")
+        if membership:
+            return aggregated_points, build_membership(oid, cluster_ids, output_count)
+        return aggregated_points
+
+    except requests.exceptions.RequestException as e:
+        print(f"集約サーバーとの通信エラー: {e}")
+        if getattr(e, 'response', None) is not None:
+            print(f"サーバーエラーレスポンス: {e.response.text}")
+        raise
+    finally:
+        # ジョブを破棄（待機中ならキューから外され、実行中なら完了後に結果が破棄される）
+        try:
+            requests.delete(job_url, timeout=10)
+        except requests.exceptions.RequestException:
+            pass
+
+
+def request_with_retry(method: str, url: str, max_retries: int = 3, **kwargs) -> requests.Response:
+    """
+    接続エラー・タイムアウト時に指数バックオフで再試行するリクエスト
+
+    チャンク送信はサーバー側がオフセットで重複を検出し、結果取得は副作用がないため再送してよい。
+    HTTPエラー（4xx/5xx）は再試行せずにそのまま送出する。
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = requests.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == max_retries:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def fetch_centroid_pages(url: str, output_count: int, page_size: int, max_retries: int = 3,
+                         params: Optional[Dict[str, Any]] = None) -> Dict[int, Dict[str, Any]]:
+    """集約結果を offset/limit でページ単位に取得して1つの辞書にまとめる（params は各ページに付けるクエリ）"""
+    aggregated_points = {}
+    offset = 0
+    while offset < output_count:
+        response = request_with_retry(
+            "GET", url, max_retries,
+            params={**(params or {}), "offset": offset, "limit": page_size},
+            headers={"Accept": BINARY_CONTENT_TYPE},
+            timeout=60
+        )
+        page = decode_binary_centroids(response.content)
+        if not page:
+            break
+        aggregated_points.update(page)
+        offset += len(page)
+    return aggregated_points
+
+
+def fetch_membership_pages(url: str, input_count: int, page_size: int, max_retries: int = 3,
+                           params: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    """入力点ごとの所属グループ番号を入力順にページ単位で取得する（params は各ページに付けるクエリ）"""
+    cluster_ids = np.empty(input_count, dtype=np.int32)
+    offset = 0
+    while offset < input_count:
+        response = request_with_retry(
+            "GET", url, max_retries,
+            params={**(params or {}), "offset": offset, "limit": page_size},
+            headers={"Accept": BINARY_CONTENT_TYPE},
+            timeout=60
+        )
+        page = decode_binary_membership(response.content)
+        if not len(page):
+            break
+        cluster_ids[offset:offset + len(page)] = page
+        offset += len(page)
+    return cluster_ids
+
+
+def points_digest(lon: np.ndarray, lat: np.ndarray) -> str:
+    """
+    入力点の座標の SHA-256（サーバーの結果キャッシュのキー）
+
+    サーバーの pointsDigest と同じく、経度の列・緯度の列の順に float64 リトルエンディアンで連結して計算する。
+    """
+    sha = hashlib.sha256()
+    sha.update(np.ascontiguousarray(lon, dtype="<f8").data)
+    sha.update(np.ascontiguousarray(lat, dtype="<f8").data)
+    return sha.hexdigest()
+
+
+def fetch_cached_result(lon: np.ndarray, lat: np.ndarray, oid: np.ndarray,
+                        radius_meters: float,
+                        server_url: str = "http://localhost:8080",
+                        mode: str = "serial",
+                        page_size: int = 500000,
+                        max_retries: int = 3,
+                        membership: bool = False):
+    """
+    同じ入力点・半径・モードの集約結果がサーバーのキャッシュにあれば、アップロードせずに取得
+
+    Returns:
+        キャッシュにあれば call_cpp_aggregation_server と同じ形式の結果、なければ None
+    """
+    digest = points_digest(lon, lat)
+    cache_url = f"{server_url}/cache/{digest}"
+    params = {"radius": radius_meters, "mode": mode}
+    try:
+        response = requests.get(cache_url, params=params, timeout=30)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        cached = response.json()
+
+        aggregated_points = fetch_centroid_pages(f"{cache_url}/results", cached["output_count"], page_size,
+                                                 max_retries, params=params)
+        if membership:
+            cluster_ids = fetch_membership_pages(f"{cache_url}/membership", len(oid), page_size * 4,
+                                                 max_retries, params=params)
+    except requests.exceptions.HTTPError as e:
+        # 取得中に破棄された場合は通常どおりアップロードする
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+    print(f"キャッシュ済みの集約結果を取得: {cached['input_count']} → {cached['output_count']} ポイント ({digest[:16]})")
+    if membership:
+        return aggregated_points, build_membership(oid, cluster_ids, cached["output_count"])
+    return aggregated_points
+
+
+def compress_chunk(body: bytes, compression: str) -> bytes:
+    """チャンクを圧縮 ("gzip" / "zstd" / "none")"""
+    if compression == "gzip":
+        # 座標は圧縮率が低いため速度優先
+        return gzip.compress(body, compresslevel=1)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=1).compress(body)
+    if compression == "none":
+        return body
+    raise ValueError(f"未対応の圧縮形式です: {compression}")
+
+
+def aggregate_points_native(points_dict: Points,
+                            radius_meters: float,
+                            mode: str = "serial",
+                            threads: int = 0,
+                            membership: bool = False):
+    """
+    Python拡張モジュール (aggregation_native) でプロセス内でポイント集約を実行
+
+    HTTPサーバーと同じC++のコア処理を使うため、結果は call_cpp_aggregation_server と一致する。
+    座標の列はコピーせずに渡し、集約中は GIL を解放する。
+
+    Args:
+        points_dict: {oid: {'oid': oid, 'lon': lon, 'lat': lat}} 形式の辞書または PointSet
+        radius_meters: 集約半径（メートル）
+        mode: グループ化モード ("serial" / "tiled")
+        threads: "tiled" モードのスレッド数（0 で全コア）
+        membership: True なら入力点ごとの所属グループも返す
+
+    Returns:
+        集約結果 (call_cpp_aggregation_server と同じ形式。PointSet を渡した場合は PointSet)。
+        membership が True の場合は (集約結果の辞書, build_membership の辞書) のタプル
+
+    Raises:
+        ImportError: 拡張モジュールがビルドされていない場合
+    """
+    if aggregation_native is None:
+        raise ImportError("aggregation_native がインポートできません（cpp_aggregation_server の README を参照してビルドしてください）")
+
+    start_time = time.time()
+
+    lon, lat, oid = points_dict_to_columns(points_dict)
+    result = aggregation_native.aggregate(lon, lat, float(radius_meters), mode=mode, threads=threads,
+                                          return_membership=membership)
+    centroid_lon, centroid_lat = result[0], result[1]
+
+    if isinstance(points_dict, PointSet):
+        aggregated_points = PointSet(np.arange(1, len(centroid_lon) + 1), centroid_lon, centroid_lat)
+    else:
+        aggregated_points = {
+            group_id: {'oid': group_id, 'lon': lo, 'lat': la}
+            for group_id, (lo, la) in enumerate(zip(centroid_lon.tolist(), centroid_lat.tolist()), start=1)
+        }
+
+    print(f"C++集約完了 (拡張モジュール): {len(lon)} → {len(aggregated_points)} ポイント")
+    print(f"処理時間: {time.time() - start_time:.2f}秒")
+    if membership:
+        return aggregated_points, {'oids': oid, 'cluster_ids': result[2], 'counts': result[3]}
+    return aggregated_points
+
+
+def points_dict_to_columns(points_dict: Points) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ポイント辞書を (lon, lat, oid) のNumPy配列に変換し、無効なポイントを除外
+
+    通常は一括変換し、None などの値を含む場合だけ1件ずつ検証する。PointSet は列をそのまま使う（コピーしない）。
+
+    Returns:
+        lon (float64), lat (float64), oid (int64) の配列
+    """
+    count = len(points_dict)
+    if isinstance(points_dict, PointSet):
+        lon, lat, oid = points_dict.lon, points_dict.lat, points_dict.oid
+    else:
+        points = points_dict.values()
+        try:
+            lon = np.fromiter((p["lon"] for p in points), dtype=np.float64, count=count)
+            lat = np.fromiter((p["lat"] for p in points), dtype=np.float64, count=count)
+            oid = np.fromiter((p["oid"] for p in points), dtype=np.int64, count=count)
+        except (KeyError, TypeError, ValueError):
+            # None値や無効な値を含む場合は1件ずつチェック
+            valid_points = []
+            for p in points:
+                if (p.get("lon") is not None and p.get("lat") is not None and p.get("oid") is not None and
+                    isinstance(p["lon"], (int, float)) and isinstance(p["lat"], (int, float)) and
+                    isinstance(p["oid"], (int, float))):
+                    valid_points.append((float(p["lon"]), float(p["lat"]), int(p["oid"])))
+                else:
+                    print(f"無効なポイントをスキップ: {p}")
+            columns = np.array(valid_points, dtype=np.float64).reshape(-1, 3)
+            lon, lat, oid = columns[:, 0], columns[:, 1], columns[:, 2].astype(np.int64)
+
+    # NaN・無限大の座標を除外
+    valid = np.isfinite(lon) & np.isfinite(lat)
+    invalid_count = count - int(valid.sum())
+    if invalid_count > 0:
+        print(f"警告: {invalid_count} 個の無効なポイントをスキップしました")
+    if not valid.all():
+        lon, lat, oid = lon[valid], lat[valid], oid[valid]
+
+    return lon, lat, oid
+
+
+def encode_binary_points(lon: np.ndarray, lat: np.ndarray, oid: np.ndarray) -> bytes:
+    """
+    ポイントの列をバイナリ形式にエンコード
+
+    [マジック "AGP1"][点数 n: uint32][lon: float64 × n][lat: float64 × n][oid: int32 × n]（リトルエンディアン）
+    """
+    if len(oid) and (oid.min() < np.iinfo(np.int32).min or oid.max() > np.iinfo(np.int32).max):
+        raise ValueError("OIDがint32の範囲を超えています")
+
+    return b"".join([
+        BINARY_REQUEST_MAGIC,
+        struct.pack("<I", len(oid)),
+        np.ascontiguousarray(lon, dtype="<f8").tobytes(),
+        np.ascontiguousarray(lat, dtype="<f8").tobytes(),
+        np.ascontiguousarray(oid, dtype="<i4").tobytes(),
+    ])
+
+
+def decode_binary_centroids(body: bytes) -> Dict[int, Dict[str, Any]]:
+    """
+    バイナリ形式の集約結果を {oid: {'oid', 'lon', 'lat'}} 形式の辞書に変換
+
+    [マジック "AGR1"][点数 n: uint32][lon: float64 × n][lat: float64 × n][oid: int32 × n]（リトルエンディアン）
+    """
+    if len(body) < BINARY_HEADER_SIZE or bytes(body[:4]) != BINARY_RESPONSE_MAGIC:
+        raise Exception("集約サーバーエラー: バイナリ形式のレスポンスが不正です")
+
+    (count,) = struct.unpack_from("<I", body, 4)
+    expected = BINARY_HEADER_SIZE + count * 20
+    if len(body) != expected:
+        raise Exception(f"集約サーバーエラー: レスポンスのサイズが不正です (期待値 {expected}, 実際 {len(body)} バイト)")
+
+    lon = np.frombuffer(body, dtype="<f8", count=count, offset=BINARY_HEADER_SIZE)
+    lat = np.frombuffer(body, dtype="<f8", count=count, offset=BINARY_HEADER_SIZE + count * 8)
+    oid = np.frombuffer(body, dtype="<i4", count=count, offset=BINARY_HEADER_SIZE + count * 16)
+
+    return {
+        o: {'oid': o, 'lon': lo, 'lat': la}
+        for o, lo, la in zip(oid.tolist(), lon.tolist(), lat.tolist())
+    }
+
+
+def binary_centroids_size(body) -> int:
+    """バイナリ形式の集約結果 (AGR1) 部分のバイト数（後ろに所属グループが続く場合の区切り）"""
+    if len(body) < BINARY_HEADER_SIZE:
+        raise Exception("集約サーバーエラー: バイナリ形式のレスポンスが不正です")
+    (count,) = struct.unpack_from("<I", body, 4)
+    return BINARY_HEADER_SIZE + count * 20
+
+
+def decode_binary_membership(body) -> np.ndarray:
+    """
+    バイナリ形式の所属グループを入力点ごとのグループIDの配列 (int32) に変換
+
+    [マジック "AGM1"][点数 n: uint32][cluster_id: int32 × n]（リトルエンディアン）
+    """
+    if len(body) < BINARY_HEADER_SIZE or bytes(body[:4]) != BINARY_MEMBERSHIP_MAGIC:
+        raise Exception("集約サーバーエラー: 所属グループのバイナリ形式が不正です")
+
+    (count,) = struct.unpack_from("<I", body, 4)
+    expected = BINARY_HEADER_SIZE + count * 4
+    if len(body) != expected:
+        raise Exception(f"集約サーバーエラー: 所属グループのサイズが不正です (期待値 {expected}, 実際 {len(body)} バイト)")
+
+    return np.frombuffer(body, dtype="<i4", count=count, offset=BINARY_HEADER_SIZE).astype(np.int32)
+
+
+def build_membership(oid: np.ndarray, cluster_ids: np.ndarray, num_clusters: int) -> Dict[str, np.ndarray]:
+    """
+    入力点ごとの所属グループをまとめる
+
+    Returns:
+        {'oids': 入力点のOID (int64), 'cluster_ids': 各点のグループID (int32, 1から),
+         'counts': グループごとの点数 (counts[i] がグループID i + 1)}
+    """
+    counts = np.bincount(cluster_ids, minlength=num_clusters + 1)[1:].astype(np.int32)
+    return {'oids': oid, 'cluster_ids': cluster_ids, 'counts': counts}
+
+
 def check_server_health(server_url: str = "http://localhost:8080") -> bool:
     """
     C++集約サーバーのヘルスチェックを実行
@@ -127,8 +695,12 @@ def check_server_health(server_url: str = "http://localhost:8080") -> bool:
         return False
 
 
-def aggregate_points_by_cpp_server(points_dict: Dict[int, Dict[str, Any]],
-                                 radius_meters: float) -> Dict[int, Dict[str, Any]]:
+def aggregate_points_by_cpp_server(points_dict: Points,
+                                 radius_meters: float,
+                                 mode: str = "serial",
+                                 upload: str = "session",
+                                 backend: str = "server",
+                                 membership: bool = False):
     """
     notebook.pyのaggregate_points_by_grid_max_speed関数の置き換え用関数
 
@@ -136,12 +708,37 @@ def aggregate_points_by_cpp_server(points_dict: Dict[int, Dict[str, Any]],
     関数シグネチャと戻り値の形式は元の関数と互換性があります。
 
     Args:
-        points_dict: ポイント辞書
+        points_dict: ポイント辞書または PointSet
         radius_meters: 集約半径（メートル）
+        mode: グループ化モード ("serial" / "tiled")
+        upload: 送信方法 ("session": チャンク分割してアップロード / "job": 非同期ジョブとして投入し進捗を表示 /
+                "single": 1リクエストで送信)
+        backend: 実行方法 ("server": HTTPサーバー / "native": Python拡張モジュール /
+                 "auto": 拡張モジュールがインポートできれば使用し、なければHTTPサーバー)
+        membership: True なら入力点ごとの所属グループも返す
 
     Returns:
-        集約結果の辞書
+        集約結果の辞書（PointSet を渡した場合は PointSet）。
+        membership が True の場合は (集約結果, 所属グループの辞書) のタプル
     """
+    if backend == "native" or (backend == "auto" and aggregation_native is not None):
+        return aggregate_points_native(points_dict, radius_meters, mode=mode, membership=membership)
+
+    result = aggregate_points_by_http(points_dict, radius_meters, mode=mode, upload=upload, membership=membership)
+    if not isinstance(points_dict, PointSet):
+        return result
+    # HTTPの応答はページごとに辞書で受け取るため、入力に合わせて列指向にする
+    if membership:
+        return PointSet.from_dict(result[0]), result[1]
+    return PointSet.from_dict(result)
+
+
+def aggregate_points_by_http(points_dict: Points,
+                             radius_meters: float,
+                             mode: str = "serial",
+                             upload: str = "session",
+                             membership: bool = False):
+    """aggregate_points_by_cpp_server の HTTPサーバー版（結果は辞書）"""
     server_url = "http://localhost:8080"
 
     # サーバーのヘルスチェック
@@ -149,7 +746,13 @@ def aggregate_points_by_cpp_server(points_dict: Dict[int, Dict[str, Any]],
         raise Exception("C++集約サーバーが利用できません")
 
     # C++集約サーバーを呼び出して集約処理を実行
-    return call_cpp_aggregation_server(points_dict, radius_meters, server_url)
+    if upload == "session":
+        return call_cpp_aggregation_server_session(points_dict, radius_meters, server_url, mode=mode,
+                                                   membership=membership)
+    if upload == "job":
+        return call_cpp_aggregation_server_job(points_dict, radius_meters, server_url, mode=mode,
+                                               membership=membership)
+    return call_cpp_aggregation_server(points_dict, radius_meters, server_url, mode=mode, membership=membership)
 
 
 def test_aggregation_server():
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+建物ポイント集約の実装間ベンチマーク（合成データ、オフラインで実行可能）
+
+密集した市街地・郊外・まばらな農村部を模した合成建物データを生成し、
+各集約実装の処理時間とピークメモリを点数・半径ごとに計測して JSON に保存する。
+前回の JSON を --compare に渡すと、遅くなった・メモリが増えたケースを表示する。
+
+実装:
+    numpy_grid       notebook.aggregate_points_by_grid_max_speed（NumPy版）
+    native_{mode}    Python拡張モジュール aggregation_native（ビルド済みの場合）
+    server_{mode}    C++集約サーバーの POST /aggregate（バイナリ形式、起動している場合）
+
+使用例:
+    python benchmark_aggregation.py                                   # 1万・100万・500万点 × 半径 50/100/200m
+    python benchmark_aggregation.py --sizes 10k,1m --radii 100 --repeats 5
+    python benchmark_aggregation.py --server-binary ./cpp_aggregation_server/aggregation_server
+    python benchmark_aggregation.py --compare benchmark_results/aggregation_abc1234_20250101-120000.json
+    python benchmark_aggregation.py --sizes 1m,5m --point-format dict    # 従来の辞書形式の入力と比較
+
+計測は (実装, 点数, 半径) ごとに fork した子プロセスで行い、子プロセスの
+ピーク RSS（/proc/self/status の VmHWM）から開始時の RSS を引いた値をメモリ使用量とする。
+サーバーを --server-binary で起動した場合はサーバープロセスのピーク RSS も記録する。
+入力は main() と同じ列指向の PointSet（--point-format dict で従来の辞書）で、入力自体の大きさも記録する。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+import aggregation_client
+from notebook import aggregate_points_by_grid_max_speed
+from point_set import PointSet
+
+# C++のグループ化モード（サーバー・拡張モジュールに新しいモードを追加したらここにも追加する）
+CPP_MODES = ("serial", "tiled")
+
+DEFAULT_SIZES = "10k,1m,5m"
+DEFAULT_RADII = "50,100,200"
+
+# 合成データの構成比（市街地 / 郊外 / 農村部）
+URBAN_SHARE = 0.55
+SUBURB_SHARE = 0.35
+
+# 比較時に遅くなった・メモリが増えたと判定する比率
+DEFAULT_REGRESSION_THRESHOLD = 1.2
+
+# fork した子プロセスから参照するデータ（引数で渡すと pickle でコピーされるため）
+_bench_points = None
+
+
+# MARK: 合成データ
+def generate_buildings(num_points: int, seed: int = 42, center_lon: float = 135.5, center_lat: float = 34.7,
+                       extent_km: float = 60.0, num_cores: int = 12) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    市街地・郊外・農村部を模した合成建物ポイントを生成
+
+    - 市街地: 規模の異なる num_cores か所の中心のまわりに正規分布で密集（規模は順位に反比例）
+    - 郊外: 各中心から指数分布の距離に広がる、市街地を囲む薄い分布
+    - 農村部: 範囲全体に一様にまばらに分布
+
+    Args:
+        num_points: 生成する点数
+        seed: 乱数のシード（同じシードなら同じデータ）
+        center_lon, center_lat: 範囲の中心（既定は大阪付近）
+        extent_km: 範囲の一辺（km）
+        num_cores: 市街地の中心の数
+
+    Returns:
+        (lon, lat) の float64 配列
+    """
+    rng = np.random.default_rng(seed)
+    half_m = extent_km * 500.0
+
+    # 市街地の中心と規模（Zipf則）。大きい市街地ほど広く広がる
+    core_xy = rng.uniform(-0.7 * half_m, 0.7 * half_m, size=(num_cores, 2))
+    weights = 1.0 / np.arange(1, num_cores + 1)
+    weights /= weights.sum()
+    core_sigma_m = 600.0 + 2400.0 * weights / weights[0]
+
+    num_urban = int(num_points * URBAN_SHARE)
+    num_suburb = int(num_points * SUBURB_SHARE)
+    num_rural = num_points - num_urban - num_suburb
+
+    # 市街地
+    cores = rng.choice(num_cores, size=num_urban, p=weights)
+    urban_xy = core_xy[cores] + rng.normal(size=(num_urban, 2)) * core_sigma_m[cores, None]
+
+    # 郊外（市街地の外側に広がる）
+    cores = rng.choice(num_cores, size=num_suburb, p=weights)
+    distance = core_sigma_m[cores] * (1.0 + rng.exponential(3.0, size=num_suburb))
+    angle = rng.uniform(0.0, 2.0 * np.pi, size=num_suburb)
+    suburb_xy = core_xy[cores] + np.column_stack([np.cos(angle), np.sin(angle)]) * distance[:, None]
+
+    # 農村部
+    rural_xy = rng.uniform(-half_m, half_m, size=(num_rural, 2))
+
+    xy = np.concatenate([urban_xy, suburb_xy, rural_xy])
+    xy = xy[rng.permutation(len(xy))]
+
+    # メートル → 度（範囲が狭いため中心の緯度で近似）
+    meters_per_deg_lat = 111320.0
+    meters_per_deg_lon = meters_per_deg_lat * np.cos(np.radians(center_lat))
+    lon = center_lon + xy[:, 0] / meters_per_deg_lon
+    lat = center_lat + xy[:, 1] / meters_per_deg_lat
+    return lon, lat
+
+
+def to_points_dict(lon: np.ndarray, lat: np.ndarray) -> Dict[int, Dict[str, Any]]:
+    """従来の辞書形式 {oid: {'oid', 'lon', 'lat'}} に変換（OIDは1から）"""
+    return {
+        oid: {'oid': oid, 'lon': lo, 'lat': la}
+        for oid, (lo, la) in enumerate(zip(lon.tolist(), lat.tolist()), start=1)
+    }
+
+
+def to_point_set(lon: np.ndarray, lat: np.ndarray) -> PointSet:
+    """get_point_set_from_fc と同じ列指向の形式に変換（OIDは1から）"""
+    return PointSet(np.arange(1, len(lon) + 1), lon, lat)
+
+
+def points_size_mb(points) -> float:
+    """入力の大きさ（辞書は内側の辞書と値のオブジェクトを含めたおおよその値）"""
+    if isinstance(points, PointSet):
+        return points.nbytes / 1024 ** 2
+    if not points:
+        return 0.0
+    first = next(iter(points.values()))
+    per_point = (sys.getsizeof(first) + sum(sys.getsizeof(value) for value in first.values())
+                 + sys.getsizeof(next(iter(points))))
+    return (sys.getsizeof(points) + per_point * len(points)) / 1024 ** 2
+
+
+# MARK: 集約実装
+def build_aggregators(server_url: Optional[str]) -> Dict[str, Any]:
+    """
+    計測する実装の一覧 {名前: 関数(points, radius) -> 集約結果} を作成
+
+    拡張モジュールやサーバーが利用できない実装は (None, 理由) とする
+    """
+    aggregators = {'numpy_grid': lambda points, radius: aggregate_points_by_grid_max_speed(points, radius)}
+
+    for mode in CPP_MODES:
+        if aggregation_client.aggregation_native is None:
+            aggregators[f"native_{mode}"] = (None, "aggregation_native がインポートできません")
+        else:
+            aggregators[f"native_{mode}"] = (
+                lambda points, radius, mode=mode: aggregation_client.aggregate_points_native(points, radius, mode=mode)
+            )
+
+    for mode in CPP_MODES:
+        if server_url is None or not aggregation_client.check_server_health(server_url):
+            aggregators[f"server_{mode}"] = (None, f"C++集約サーバーに接続できません ({server_url})")
+            continue
+
+        def aggregate_by_server(points, radius, mode=mode):
+            # 起動済みのサーバーのキャッシュは消さない（--cache-mb 0 で起動したサーバーで計測する）
+            return aggregation_client.call_cpp_aggregation_server(points, radius, server_url, mode=mode,
+                                                                  use_cache=False)
+
+        aggregators[f"server_{mode}"] = aggregate_by_server
+
+    return aggregators
+
+
+# MARK: 計測
+def read_proc_status_kb(pid: str, field: str) -> Optional[int]:
+    """/proc/{pid}/status の値（kB）を読む（Linux 以外では None）"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid: str) -> bool:
+    """ピーク RSS (VmHWM) を現在の RSS にリセット（Linux 4.0 以降）"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def run_case(aggregator, radius: float, repeats: int, conn):
+    """子プロセスで1ケースを計測し、結果を conn に送る"""
+    try:
+        reset_peak_rss("self")
+        baseline_kb = read_proc_status_kb("self", "VmRSS")
+        seconds = []
+        output_count = None
+        # 実装ごとの進捗表示（C++ 側の出力を含む）は計測結果の表示の邪魔になるため捨てる
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = aggregator(_bench_points, radius)
+            seconds.append(time.perf_counter() - start)
+            output_count = len(result)
+            del result
+        peak_kb = read_proc_status_kb("self", "VmHWM")
+        peak_mb = (peak_kb - baseline_kb) / 1024.0 if peak_kb is not None and baseline_kb is not None else None
+        conn.send({'seconds': seconds, 'output_count': output_count, 'peak_memory_mb': peak_mb})
+    except Exception as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def measure(aggregator, radius: float, repeats: int, server_pid: Optional[int]) -> Dict[str, Any]:
+    """fork した子プロセスで計測する（実装ごとのメモリ使用量を分けるため）"""
+    if server_pid is not None:
+        reset_peak_rss(str(server_pid))
+
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=run_case, args=(aggregator, radius, repeats, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {'error': f"計測プロセスが異常終了しました (終了コード {process.exitcode})"}
+    process.join()
+
+    if 'seconds' in result:
+        result['min_seconds'] = min(result['seconds'])
+        result['median_seconds'] = statistics.median(result['seconds'])
+    if server_pid is not None:
+        peak_kb = read_proc_status_kb(str(server_pid), "VmHWM")
+        result['server_peak_rss_mb'] = peak_kb / 1024.0 if peak_kb is not None else None
+    return result
+
+
+# MARK: サーバー起動
+def start_server(binary: str) -> Tuple[subprocess.Popen, str]:
+    """空いているポートでキャッシュなしの集約サーバーを起動し、(プロセス, URL) を返す"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    process = subprocess.Popen([binary, "--port", str(port), "--cache-mb", "0"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if aggregation_client.check_server_health(server_url):
+            return process, server_url
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"集約サーバーを起動できません: {binary}")
+
+
+# MARK: 比較
+def case_key(case: Dict[str, Any]) -> Tuple[str, int, float]:
+    return case['implementation'], case['num_points'], case['radius_m']
+
+
+def compare_reports(current: Dict[str, Any], previous: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    前回の結果と比べ、処理時間（中央値）またはメモリが threshold 倍を超えたケースを返す
+
+    Returns:
+        悪化したケースの説明のリスト
+    """
+    previous_cases = {case_key(case): case for case in previous['cases'] if 'median_seconds' in case}
+    regressions = []
+    print(f"\n前回の結果 ({previous.get('git_commit')}, {previous.get('created_at')}) との比較:")
+    for case in current['cases']:
+        old = previous_cases.get(case_key(case))
+        if old is None or 'median_seconds' not in case:
+            continue
+        time_ratio = case['median_seconds'] / old['median_seconds'] if old['median_seconds'] > 0 else 1.0
+        line = f"  {case['implementation']:<14} {case['num_points']:>9} 点 半径 {case['radius_m']:g}m: 時間 {time_ratio:.2f}倍"
+
+        memory_ratio = None
+        if case.get('peak_memory_mb') and old.get('peak_memory_mb'):
+            memory_ratio = case['peak_memory_mb'] / old['peak_memory_mb']
+            line += f", メモリ {memory_ratio:.2f}倍"
+
+        if time_ratio > threshold or (memory_ratio is not None and memory_ratio > threshold):
+            line += "  ← 悪化"
+            regressions.append(line.strip())
+        print(line)
+    return regressions
+
+
+# MARK: 引数
+def parse_size(text: str) -> int:
+    """'10k' / '1m' / '5000000' などの点数を整数に変換"""
+    text = text.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    return int(float(text) * multiplier)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="建物ポイント集約の実装間ベンチマーク（合成データ）")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"点数のリスト (既定: {DEFAULT_SIZES})")
+    parser.add_argument("--radii", default=DEFAULT_RADII, help=f"集約半径[m]のリスト (既定: {DEFAULT_RADII})")
+    parser.add_argument("--repeats", type=int, default=3, help="各ケースの繰り返し回数 (既定: 3)")
+    parser.add_argument("--implementations", default=None,
+                        help="計測する実装のリスト (既定: 利用できるすべての実装)")
+    parser.add_argument("--seed", type=int, default=42, help="合成データの乱数シード")
+    parser.add_argument("--point-format", choices=("columnar", "dict"), default="columnar",
+                        help="入力の形式 (columnar: PointSet / dict: 従来の {oid: {'oid', 'lon', 'lat'}})")
+    parser.add_argument("--server-url", default="http://localhost:8080",
+                        help="起動済みの C++集約サーバー。キャッシュにヒットしないよう --cache-mb 0 で起動しておく"
+                             " (--server-binary を指定した場合は無視)")
+    parser.add_argument("--server-binary", default=None,
+                        help="C++集約サーバーの実行ファイル（指定するとキャッシュなしで起動し、メモリも計測する）")
+    parser.add_argument("--output", default=None,
+                        help="結果のJSON (既定: benchmark_results/aggregation_{コミット}_{日時}.json)")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help=f"悪化と判定する比率 (既定: {DEFAULT_REGRESSION_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    global _bench_points
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    radii = [float(radius) for radius in args.radii.split(",")]
+
+    server_process = None
+    server_url = args.server_url
+    if args.server_binary:
+        server_process, server_url = start_server(args.server_binary)
+        print(f"C++集約サーバーを起動しました: {server_url} (キャッシュなし)")
+
+    try:
+        aggregators = build_aggregators(server_url)
+        if args.implementations:
+            selected = [name.strip() for name in args.implementations.split(",")]
+            unknown = [name for name in selected if name not in aggregators]
+            if unknown:
+                parser.error(f"不明な実装です: {', '.join(unknown)} (利用可能: {', '.join(aggregators)})")
+            aggregators = {name: aggregators[name] for name in selected}
+
+        for name, aggregator in aggregators.items():
+            if isinstance(aggregator, tuple):
+                print(f"{name}: スキップ ({aggregator[1]})")
+
+        report = {
+            'benchmark': 'aggregation',
+            'git_commit': git_commit(),
+            'created_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'machine': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'cpu_count': os.cpu_count(),
+            },
+            'settings': {'sizes': sizes, 'radii_m': radii, 'repeats': args.repeats, 'seed': args.seed,
+                         'point_format': args.point_format,
+                         'server': 'started' if server_process else server_url},
+            'cases': [],
+        }
+
+        for num_points in sizes:
+            start = time.perf_counter()
+            lon, lat = generate_buildings(num_points, seed=args.seed)
+            _bench_points = to_point_set(lon, lat) if args.point_format == "columnar" else to_points_dict(lon, lat)
+            del lon, lat
+            input_mb = points_size_mb(_bench_points)
+            print(f"\n=== {num_points} 点 (合成データ生成 {time.perf_counter() - start:.1f}秒, "
+                  f"入力 {args.point_format} {input_mb:.0f}MB) ===")
+
+            for radius in radii:
+                for name, aggregator in aggregators.items():
+                    if isinstance(aggregator, tuple):
+                        continue
+                    result = measure(aggregator, radius, args.repeats,
+                                     server_process.pid if server_process and name.startswith("server_") else None)
+                    case = {'implementation': name, 'num_points': num_points, 'radius_m': radius,
+                            'input_mb': input_mb, **result}
+                    report['cases'].append(case)
+
+                    if 'error' in case:
+                        print(f"  {name:<14} 半径 {radius:g}m: エラー {case['error']}")
+                        continue
+                    line = (f"  {name:<14} 半径 {radius:g}m: 中央値 {case['median_seconds']:.3f}秒 "
+                            f"(最小 {case['min_seconds']:.3f}秒), 代表点 {case['output_count']}")
+                    if case['peak_memory_mb'] is not None:
+                        line += f", メモリ +{case['peak_memory_mb']:.0f}MB"
+                    if case.get('server_peak_rss_mb') is not None:
+                        line += f", サーバー {case['server_peak_rss_mb']:.0f}MB"
+                    print(line)
+
+            _bench_points = None
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    output_path = args.output or os.path.join(
+        "benchmark_results", f"aggregation_{report['git_commit'] or 'unknown'}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output_path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        regressions = compare_reports(report, previous, args.threshold)
+        if regressions:
+            print(f"\n{args.threshold:g}倍を超えて悪化したケースが {len(regressions)} 件あります")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,665 @@
+#pragma once
+
+// ポイント集約のコア処理（HTTPサーバー main.cpp と Python拡張 python_module.cpp で共有）
+
+#ifndef _USE_MATH_DEFINES
+#define _USE_MATH_DEFINES
+#endif
+#include <vector>
+#include <unordered_map>
+#include <cmath>
+#include <algorithm>
+#include <iostream>
+#include <thread>
+#include <atomic>
+#include <chrono>
+#include <string>
+#include <stdexcept>
+#include <cstdint>
+
+namespace aggregation {
+
+using namespace std;
+
+// ポイント構造体
+struct Point {
+    double lon;
+    double lat;
+    int oid;
+
+    Point() : lon(0), lat(0), oid(0) {}
+    Point(double longitude, double latitude, int object_id)
+        : lon(longitude), lat(latitude), oid(object_id) {}
+};
+
+// 2D座標構造体（デカルト座標用）
+struct Point2D {
+    double x;
+    double y;
+    int oid;
+    int original_index; // 元のインデックスを保持
+
+    Point2D() : x(0), y(0), oid(0), original_index(-1) {}
+    Point2D(double x_coord, double y_coord, int object_id, int idx = -1)
+        : x(x_coord), y(y_coord), oid(object_id), original_index(idx) {}
+};
+
+// 高性能グリッドハッシュ用の構造体
+struct GridKey {
+    int grid_x;
+    int grid_y;
+
+    GridKey() : grid_x(0), grid_y(0) {}
+    GridKey(int x, int y) : grid_x(x), grid_y(y) {}
+
+    bool operator==(const GridKey& other) const {
+        return grid_x == other.grid_x && grid_y == other.grid_y;
+    }
+
+    bool operator<(const GridKey& other) const {
+        if (grid_x != other.grid_x) return grid_x < other.grid_x;
+        return grid_y < other.grid_y;
+    }
+};
+
+// GridKeyの高速ハッシュ関数
+struct GridKeyHash {
+    size_t operator()(const GridKey& key) const {
+        // より効率的なハッシュ関数
+        return ((size_t)key.grid_x << 32) | ((size_t)key.grid_y & 0xFFFFFFFF);
+    }
+};
+
+
+
+/**
+ * 地理座標をデカルト座標に変換（参照点を原点とする正距円筒図法）
+ * get_lon(i), get_lat(i) で i 番目の点の経度・緯度を取得する
+ */
+template <typename GetLon, typename GetLat>
+vector<Point2D> convertToCartesian(size_t n, GetLon get_lon, GetLat get_lat, double ref_lon, double ref_lat) {
+    const double R = 6371000.0; // 地球半径（メートル）
+    const double ref_lat_rad = ref_lat * M_PI / 180.0;
+
+    vector<Point2D> cartesian_points;
+    cartesian_points.reserve(n);
+
+    for (size_t i = 0; i < n; i++) {
+        double x = R * (get_lon(i) - ref_lon) * M_PI / 180.0 * cos(ref_lat_rad);
+        double y = R * (get_lat(i) - ref_lat) * M_PI / 180.0;
+        cartesian_points.emplace_back(x, y, 0, static_cast<int>(i));
+    }
+
+    return cartesian_points;
+}
+
+/**
+ * 凸包を計算（Graham scan アルゴリズム）
+ */
+inline vector<Point2D> computeConvexHull(vector<Point2D> points) {
+    if (points.size() < 3) return points;
+
+    // 最下部の点を見つける（y座標が最小、同じならx座標が最小）
+    int min_idx = 0;
+    for (int i = 1; i < points.size(); i++) {
+        if (points[i].y < points[min_idx].y ||
+            (points[i].y == points[min_idx].y && points[i].x < points[min_idx].x)) {
+            min_idx = i;
+        }
+    }
+    swap(points[0], points[min_idx]);
+
+    Point2D pivot = points[0];
+
+    // 角度でソート
+    sort(points.begin() + 1, points.end(), [&pivot](const Point2D& a, const Point2D& b) {
+        double cross = (a.x - pivot.x) * (b.y - pivot.y) - (a.y - pivot.y) * (b.x - pivot.x);
+        if (abs(cross) < 1e-9) {
+            // 共線の場合、距離で比較
+            double dist_a = (a.x - pivot.x) * (a.x - pivot.x) + (a.y - pivot.y) * (a.y - pivot.y);
+            double dist_b = (b.x - pivot.x) * (b.x - pivot.x) + (b.y - pivot.y) * (b.y - pivot.y);
+            return dist_a < dist_b;
+        }
+        return cross > 0;
+    });
+
+    // Graham scan
+    vector<Point2D> hull;
+    for (const auto& point : points) {
+        while (hull.size() >= 2) {
+            Point2D& p1 = hull[hull.size() - 2];
+            Point2D& p2 = hull[hull.size() - 1];
+            double cross = (p2.x - p1.x) * (point.y - p1.y) - (p2.y - p1.y) * (point.x - p1.x);
+            if (cross <= 0) {
+                hull.pop_back();
+            } else {
+                break;
+            }
+        }
+        hull.push_back(point);
+    }
+
+    return hull;
+}
+
+/**
+ * 凸包の重心を計算
+ */
+inline Point2D computeCentroid(const vector<Point2D>& hull_points) {
+    if (hull_points.empty()) return Point2D();
+
+    double sum_x = 0, sum_y = 0;
+    for (const auto& p : hull_points) {
+        sum_x += p.x;
+        sum_y += p.y;
+    }
+
+    return Point2D(sum_x / hull_points.size(), sum_y / hull_points.size(), 0);
+}
+
+/**
+ * デカルト座標を地理座標に逆変換
+ */
+inline Point convertToGeographic(const Point2D& cartesian_point, double ref_lon, double ref_lat) {
+    const double R = 6371000.0;
+    const double ref_lat_rad = ref_lat * M_PI / 180.0;
+
+    double lon = ref_lon + (cartesian_point.x / (R * cos(ref_lat_rad))) * 180.0 / M_PI;
+    double lat = ref_lat + (cartesian_point.y / R) * 180.0 / M_PI;
+
+    return Point(lon, lat, cartesian_point.oid);
+}
+
+/**
+ * 2点間の距離の平方を計算（高速化のためsqrtを回避）
+ */
+inline double calculateDistanceSquared(const Point2D& p1, const Point2D& p2) {
+    double dx = p1.x - p2.x;
+    double dy = p1.y - p2.y;
+    return dx * dx + dy * dy;
+}
+
+/**
+ * 2点間のユークリッド距離を計算
+ */
+inline double calculateDistance(const Point2D& p1, const Point2D& p2) {
+    return sqrt(calculateDistanceSquared(p1, p2));
+}
+
+/**
+ * 高速空間インデックス（グリッドベース）
+ */
+class SpatialIndex {
+private:
+    unordered_map<GridKey, vector<int>, GridKeyHash> grid_map;
+    double grid_size;
+
+public:
+    SpatialIndex(double cell_size) : grid_size(cell_size) {}
+
+    void insert(const Point2D& point, int index) {
+        GridKey key(
+            static_cast<int>(floor(point.x / grid_size)),
+            static_cast<int>(floor(point.y / grid_size))
+        );
+        grid_map[key].push_back(index);
+    }
+
+    // 指定範囲内の候補点を高速取得
+    vector<int> getCandidates(const Point2D& center, double radius) const {
+        vector<int> candidates;
+
+        int grid_radius = static_cast<int>(ceil(radius / grid_size)) + 1;
+        GridKey center_key(
+            static_cast<int>(floor(center.x / grid_size)),
+            static_cast<int>(floor(center.y / grid_size))
+        );
+
+        for (int dx = -grid_radius; dx <= grid_radius; dx++) {
+            for (int dy = -grid_radius; dy <= grid_radius; dy++) {
+                GridKey key(center_key.grid_x + dx, center_key.grid_y + dy);
+                auto it = grid_map.find(key);
+                if (it != grid_map.end()) {
+                    candidates.insert(candidates.end(), it->second.begin(), it->second.end());
+                }
+            }
+        }
+
+        return candidates;
+    }
+
+    size_t getGridCount() const { return grid_map.size(); }
+};
+
+/**
+ * グループ化モード
+ *   Serial: 入力順に1スレッドで貪欲にグループ化（従来の処理）
+ *   Tiled : タイル分割した空間を複数スレッドで貪欲にグループ化
+ */
+enum class ClusteringMode {
+    Serial,
+    Tiled
+};
+
+inline ClusteringMode parseClusteringMode(const string& mode) {
+    if (mode == "serial") return ClusteringMode::Serial;
+    if (mode == "tiled") return ClusteringMode::Tiled;
+    throw runtime_error("不明なグループ化モードです: " + mode);
+}
+
+inline const char* clusteringModeName(ClusteringMode mode) {
+    return mode == ClusteringMode::Tiled ? "tiled" : "serial";
+}
+
+/**
+ * 集約処理のフェーズ
+ */
+enum class ClusterPhase : int {
+    Queued,
+    Projection,  // デカルト座標への変換
+    Indexing,    // 空間インデックスの構築
+    Grouping,    // グループ化
+    Centroids,   // 凸包・重心の計算
+    Done
+};
+
+inline const char* clusterPhaseName(ClusterPhase phase) {
+    switch (phase) {
+        case ClusterPhase::Queued: return "queued";
+        case ClusterPhase::Projection: return "projection";
+        case ClusterPhase::Indexing: return "indexing";
+        case ClusterPhase::Grouping: return "grouping";
+        case ClusterPhase::Centroids: return "centroids";
+        case ClusterPhase::Done: return "done";
+    }
+    return "unknown";
+}
+
+/**
+ * 集約処理の進捗（処理中のスレッドが更新し、別スレッドから読み取る）
+ */
+struct ClusterProgress {
+    atomic<int> phase{static_cast<int>(ClusterPhase::Queued)};
+    atomic<size_t> processed{0};  // 現在のフェーズで処理済みの件数
+    atomic<size_t> total{0};      // 現在のフェーズの全件数
+    atomic<double> seconds[static_cast<int>(ClusterPhase::Done) + 1] = {};  // 終了したフェーズの所要時間（秒）
+    chrono::steady_clock::time_point phase_started;  // begin を呼ぶスレッドだけが使う
+
+    void begin(ClusterPhase next, size_t phase_total) {
+        auto now = chrono::steady_clock::now();
+        ClusterPhase previous = currentPhase();
+        if (previous != ClusterPhase::Queued) {
+            seconds[static_cast<int>(previous)].store(chrono::duration<double>(now - phase_started).count());
+        }
+        phase_started = now;
+        processed.store(0);
+        total.store(phase_total);
+        phase.store(static_cast<int>(next));
+    }
+
+    double phaseSeconds(ClusterPhase target) const { return seconds[static_cast<int>(target)].load(); }
+
+    void advance(size_t count) { processed.fetch_add(count, memory_order_relaxed); }
+
+    ClusterPhase currentPhase() const { return static_cast<ClusterPhase>(phase.load()); }
+
+    // 現在のフェーズ内の進捗率
+    double phaseFraction() const {
+        size_t phase_total = total.load();
+        return phase_total == 0 ? 0.0 : min(1.0, static_cast<double>(processed.load()) / phase_total);
+    }
+
+    // 全体の進捗率（各フェーズのおおよその処理時間の割合で重み付け）
+    double overallFraction() const {
+        switch (currentPhase()) {
+            case ClusterPhase::Queued: return 0.0;
+            case ClusterPhase::Projection: return 0.05 * phaseFraction();
+            case ClusterPhase::Indexing: return 0.05 + 0.05 * phaseFraction();
+            case ClusterPhase::Grouping: return 0.10 + 0.70 * phaseFraction();
+            case ClusterPhase::Centroids: return 0.80 + 0.20 * phaseFraction();
+            case ClusterPhase::Done: return 1.0;
+        }
+        return 0.0;
+    }
+};
+
+/**
+ * グループ化の結果（グループごとの構成点を連結して保持）
+ */
+struct GroupList {
+    vector<int> members;  // 構成点のインデックス（グループ順に連結）
+    vector<int> offsets;  // グループ g の構成点は members[offsets[g] .. offsets[g + 1])
+    vector<int> seeds;    // 各グループの起点となった点のインデックス
+
+    GroupList() : offsets(1, 0) {}
+
+    size_t size() const { return seeds.size(); }
+};
+
+/**
+ * 0..n-1 の処理を num_threads 個のスレッドで分担して実行
+ */
+template <typename Func>
+void parallelFor(size_t n, int num_threads, Func func) {
+    if (num_threads <= 1 || n <= 1) {
+        for (size_t i = 0; i < n; i++) func(i);
+        return;
+    }
+
+    atomic<size_t> next(0);
+    vector<thread> workers;
+    int worker_count = static_cast<int>(min<size_t>(num_threads, n));
+    for (int t = 0; t < worker_count; t++) {
+        workers.emplace_back([&]() {
+            for (size_t i = next.fetch_add(1); i < n; i = next.fetch_add(1)) {
+                func(i);
+            }
+        });
+    }
+    for (auto& worker : workers) worker.join();
+}
+
+/**
+ * 起点 seed から半径内の未処理の点をグループに追加し、処理済みにする
+ * 距離を先に判定し、半径外の点の処理済みフラグは読まない（タイル並列時の競合を防ぐため）
+ */
+inline void growGroup(int seed, const vector<Point2D>& points, const SpatialIndex& spatial_index,
+               double radius_meters, vector<char>& processed, GroupList& groups) {
+    double radius_squared = radius_meters * radius_meters;
+    vector<int> candidates = spatial_index.getCandidates(points[seed], radius_meters);
+
+    for (int j : candidates) {
+        if (calculateDistanceSquared(points[seed], points[j]) > radius_squared) continue;
+        if (processed[j]) continue;  // 既に処理済みの点は除外
+        processed[j] = 1;
+        groups.members.push_back(j);
+    }
+
+    // 起点自身は距離0なので必ず含まれる
+    groups.offsets.push_back(static_cast<int>(groups.members.size()));
+    groups.seeds.push_back(seed);
+}
+
+/**
+ * 従来の逐次グループ化（入力順に未処理の点を起点とする）
+ */
+inline GroupList groupPointsSerial(const vector<Point2D>& points, const SpatialIndex& spatial_index, double radius_meters,
+                                   ClusterProgress* tracker = nullptr) {
+    GroupList groups;
+    vector<char> processed(points.size(), 0);
+
+    // 進捗表示用
+    const int bar_width = 50;
+    int last_progress = -1;
+
+    cout << "グループ化処理開始..." << endl;
+
+    for (int i = 0; i < static_cast<int>(points.size()); i++) {
+        // 既に他のグループで処理済みの点はスキップ
+        if (processed[i]) continue;
+
+        // 進捗バー表示（処理済み点数ベース）
+        size_t processed_count = groups.members.size();
+        int progress = static_cast<int>(100.0 * processed_count / points.size());
+        if (progress != last_progress && (progress % 5 == 0)) {
+            int pos = bar_width * progress / 100;
+            cout << "\r[";
+            for (int j = 0; j < bar_width; ++j) {
+                if (j < pos) cout << "=";
+                else if (j == pos) cout << ">";
+                else cout << " ";
+            }
+            cout << "] " << progress << "% (" << processed_count << "/" << points.size() << ")";
+            cout.flush();
+            last_progress = progress;
+        }
+
+        growGroup(i, points, spatial_index, radius_meters, processed, groups);
+        if (tracker) tracker->processed.store(groups.members.size(), memory_order_relaxed);
+    }
+
+    // 100%表示
+    cout << "\r[";
+    for (int j = 0; j < bar_width; ++j) cout << "=";
+    cout << "] 100% (" << points.size() << "/" << points.size() << ")" << endl;
+
+    return groups;
+}
+
+/**
+ * タイル分割による並列グループ化
+ *
+ * 空間を一辺 tile_size (>= 2 * 半径) のタイルに分割し、(tx mod 2, ty mod 2) で4色に塗り分ける。
+ * 同じ色のタイル同士は tile_size 以上離れているため、各タイルの起点から半径内の点は重ならず、
+ * 同じ色のタイルは並列に処理できる。色ごとに順番に処理し、タイル内では入力順に起点を選ぶ。
+ * 最後にグループを起点のインデックス順に並べるため、結果はスレッド数によらず同じになる。
+ */
+inline GroupList groupPointsTiled(const vector<Point2D>& points, const SpatialIndex& spatial_index,
+                                  double radius_meters, int num_threads, ClusterProgress* progress = nullptr) {
+    double tile_size = radius_meters * 16.0;
+
+    // タイルごとに点を振り分け（各タイル内は入力順）
+    unordered_map<GridKey, vector<int>, GridKeyHash> tile_map;
+    for (int i = 0; i < static_cast<int>(points.size()); i++) {
+        GridKey key(
+            static_cast<int>(floor(points[i].x / tile_size)),
+            static_cast<int>(floor(points[i].y / tile_size))
+        );
+        tile_map[key].push_back(i);
+    }
+
+    // 色ごとにタイルを分類し、タイル座標順に並べる（処理順を決定的にするため）
+    vector<vector<pair<GridKey, const vector<int>*>>> tiles_by_color(4);
+    for (const auto& entry : tile_map) {
+        int color = ((entry.first.grid_x & 1) << 1) | (entry.first.grid_y & 1);
+        tiles_by_color[color].emplace_back(entry.first, &entry.second);
+    }
+    for (auto& tiles : tiles_by_color) {
+        sort(tiles.begin(), tiles.end(), [](const auto& a, const auto& b) { return a.first < b.first; });
+    }
+
+    cout << "タイル並列グループ化開始（タイル数: " << tile_map.size() << ", スレッド数: " << num_threads << "）" << endl;
+
+    vector<char> processed(points.size(), 0);
+    vector<GroupList> tile_groups;
+    tile_groups.reserve(tile_map.size());
+
+    for (int color = 0; color < 4; color++) {
+        const auto& tiles = tiles_by_color[color];
+        size_t base = tile_groups.size();
+        tile_groups.resize(base + tiles.size());
+
+        parallelFor(tiles.size(), num_threads, [&](size_t t) {
+            GroupList& local = tile_groups[base + t];
+            size_t before = local.members.size();
+            for (int i : *tiles[t].second) {
+                if (processed[i]) continue;
+                growGroup(i, points, spatial_index, radius_meters, processed, local);
+            }
+            if (progress) progress->advance(local.members.size() - before);
+        });
+
+        cout << "  フェーズ " << (color + 1) << "/4 完了（タイル数: " << tiles.size() << "）" << endl;
+    }
+
+    // 起点のインデックス順にグループを並べて連結
+    vector<pair<int, pair<int, int>>> order;  // (起点, (タイル, タイル内グループ))
+    for (int t = 0; t < static_cast<int>(tile_groups.size()); t++) {
+        for (int g = 0; g < static_cast<int>(tile_groups[t].size()); g++) {
+            order.push_back({tile_groups[t].seeds[g], {t, g}});
+        }
+    }
+    sort(order.begin(), order.end());
+
+    GroupList groups;
+    groups.members.reserve(points.size());
+    groups.offsets.reserve(order.size() + 1);
+    groups.seeds.reserve(order.size());
+    for (const auto& entry : order) {
+        const GroupList& local = tile_groups[entry.second.first];
+        int g = entry.second.second;
+        groups.members.insert(groups.members.end(),
+                              local.members.begin() + local.offsets[g],
+                              local.members.begin() + local.offsets[g + 1]);
+        groups.offsets.push_back(static_cast<int>(groups.members.size()));
+        groups.seeds.push_back(entry.first);
+    }
+
+    return groups;
+}
+
+/**
+ * 各グループの重心を計算して地理座標に戻す
+ * 3点以上のグループは凸包の重心、それ以外は単純な重心
+ */
+inline vector<Point> computeGroupCentroids(const GroupList& groups, const vector<Point2D>& points,
+                                           double ref_lon, double ref_lat, int num_threads,
+                                           ClusterProgress* progress = nullptr) {
+    vector<Point> centroids(groups.size());
+
+    parallelFor(groups.size(), num_threads, [&](size_t g) {
+        vector<Point2D> group_points;
+        group_points.reserve(groups.offsets[g + 1] - groups.offsets[g]);
+        for (int k = groups.offsets[g]; k < groups.offsets[g + 1]; k++) {
+            group_points.push_back(points[groups.members[k]]);
+        }
+
+        // 重心計算
+        Point2D centroid;
+        if (group_points.size() >= 3) {
+            vector<Point2D> hull = computeConvexHull(group_points);
+            if (!hull.empty()) {
+                centroid = computeCentroid(hull);
+            } else {
+                centroid = computeCentroid(group_points);
+            }
+        } else {
+            centroid = computeCentroid(group_points);
+        }
+
+        centroids[g] = convertToGeographic(centroid, ref_lon, ref_lat);
+        if (progress) progress->advance(1);
+    });
+
+    return centroids;
+}
+
+/**
+ * 入力点ごとの所属グループとグループごとの点数
+ */
+struct ClusterMembership {
+    vector<int32_t> cluster_ids;  // cluster_ids[i] は i 番目の入力点のグループID（1から）
+    vector<int32_t> counts;       // counts[g] はグループID g + 1 の点数
+};
+
+/**
+ * グループ化の結果から所属グループと点数を求める
+ */
+inline void fillMembership(const GroupList& groups, size_t n, ClusterMembership& membership) {
+    membership.cluster_ids.assign(n, 0);
+    membership.counts.resize(groups.size());
+    for (size_t g = 0; g < groups.size(); g++) {
+        membership.counts[g] = groups.offsets[g + 1] - groups.offsets[g];
+        for (int k = groups.offsets[g]; k < groups.offsets[g + 1]; k++) {
+            membership.cluster_ids[groups.members[k]] = static_cast<int32_t>(g) + 1;
+        }
+    }
+}
+
+/**
+ * 使用するスレッド数を決定（0以下ならハードウェアのスレッド数）
+ */
+inline int resolveThreadCount(int num_threads) {
+    if (num_threads > 0) return num_threads;
+    return max(1u, thread::hardware_concurrency());
+}
+
+/**
+ * ポイントをグループ化し、各グループの重心を返す
+ * get_lon(i), get_lat(i) で i 番目の点の経度・緯度を取得する（入力をコピーせずに読む）
+ * membership を指定すると入力点ごとの所属グループも返し、progress を指定すると進捗を更新する
+ */
+template <typename GetLon, typename GetLat>
+vector<Point> clusterCoordinates(size_t n, GetLon get_lon, GetLat get_lat, double radius_meters,
+                                 ClusteringMode mode, int num_threads, ClusterMembership* membership = nullptr,
+                                 ClusterProgress* progress = nullptr) {
+    if (n == 0) {
+        if (membership) *membership = ClusterMembership();
+        if (progress) progress->begin(ClusterPhase::Done, 0);
+        return {};
+    }
+
+    if (progress) progress->begin(ClusterPhase::Projection, n);
+
+    // 参照点（重心）を計算
+    double ref_lon = 0, ref_lat = 0;
+    for (size_t i = 0; i < n; i++) {
+        ref_lon += get_lon(i);
+        ref_lat += get_lat(i);
+    }
+    ref_lon /= n;
+    ref_lat /= n;
+
+    // デカルト座標に変換
+    vector<Point2D> cartesian_points = convertToCartesian(n, get_lon, get_lat, ref_lon, ref_lat);
+    if (progress) progress->begin(ClusterPhase::Indexing, n);
+
+    cout << "高速クラスタリング開始（半径: " << radius_meters << "m）" << endl;
+
+    // 空間インデックスを構築（グリッドサイズは半径と同じで最適化）
+    double grid_size = radius_meters;
+    SpatialIndex spatial_index(grid_size);
+
+    for (int i = 0; i < static_cast<int>(cartesian_points.size()); i++) {
+        spatial_index.insert(cartesian_points[i], i);
+    }
+
+    cout << "空間インデックス構築完了: " << spatial_index.getGridCount() << " グリッド" << endl;
+    if (progress) progress->begin(ClusterPhase::Grouping, n);
+
+    vector<Point> centroids;
+
+    // グループ化（逐次モードは従来どおり1スレッドで重心も計算する）
+    if (mode == ClusteringMode::Tiled) {
+        GroupList groups = groupPointsTiled(cartesian_points, spatial_index, radius_meters, num_threads, progress);
+        if (membership) fillMembership(groups, n, *membership);
+        if (progress) progress->begin(ClusterPhase::Centroids, groups.size());
+        centroids = computeGroupCentroids(groups, cartesian_points, ref_lon, ref_lat, num_threads, progress);
+    } else {
+        GroupList groups = groupPointsSerial(cartesian_points, spatial_index, radius_meters, progress);
+        if (membership) fillMembership(groups, n, *membership);
+        if (progress) progress->begin(ClusterPhase::Centroids, groups.size());
+        centroids = computeGroupCentroids(groups, cartesian_points, ref_lon, ref_lat, 1, progress);
+    }
+
+    if (progress) progress->begin(ClusterPhase::Done, centroids.size());
+    return centroids;
+}
+
+/**
+ * ポイントの配列をグループ化し、各グループの重心を返す
+ */
+inline vector<Point> clusterPoints(const vector<Point>& input_points, double radius_meters,
+                                   ClusteringMode mode, int num_threads, ClusterMembership* membership = nullptr,
+                                   ClusterProgress* progress = nullptr) {
+    return clusterCoordinates(
+        input_points.size(),
+        [&input_points](size_t i) { return input_points[i].lon; },
+        [&input_points](size_t i) { return input_points[i].lat; },
+        radius_meters, mode, num_threads, membership, progress);
+}
+
+/**
+ * 経度・緯度の列（連続した float64 配列）をグループ化し、各グループの重心を返す
+ */
+inline vector<Point> clusterColumns(const double* lon, const double* lat, size_t n, double radius_meters,
+                                    ClusteringMode mode, int num_threads, ClusterMembership* membership = nullptr,
+                                    ClusterProgress* progress = nullptr) {
+    return clusterCoordinates(
+        n,
+        [lon](size_t i) { return lon[i]; },
+        [lat](size_t i) { return lat[i]; },
+        radius_meters, mode, num_threads, membership, progress);
+}
+
+}  // namespace aggregation
@@ -10,435 +10,1429 @@
 #include <thread>
 #include <mutex>
 #include <future>
+#include <condition_variable>
+#include <deque>
+#include <list>
+#include <map>
+#include <set>
+#include <tuple>
+#include <cctype>
+#include <cstdlib>
 #include <memory>
 #include <atomic>
+#include <random>
+#include <string>
+#include <cstring>
+#include <cstdint>
+#include "aggregation_core.hpp"
+#include <zlib.h>
+#ifdef AGGREGATION_WITH_ZSTD
+#include <zstd.h>
+#endif
 
 using json = nlohmann::json;
 using namespace std;
+using namespace aggregation;
 
-// ポイント構造体
-struct Point {
-    double lon;
-    double lat;
-    int oid;
-
-    Point() : lon(0), lat(0), oid(0) {}
-    Point(double longitude, double latitude, int object_id)
-        : lon(longitude), lat(latitude), oid(object_id) {}
-};
+/**
+ * 集約結果の [offset, offset + count) の範囲を {グループID: {oid, lon, lat}} 形式のJSONに変換
+ * グループIDは全体での通し番号（1から）
+ */
+json centroidsToJson(const vector<Point>& centroids, size_t offset, size_t count) {
+    json result = json::object();
+    for (size_t g = offset; g < offset + count; g++) {
+        int group_id = static_cast<int>(g) + 1;
+        result[to_string(group_id)] = {
+            {"oid", group_id},
+            {"lon", centroids[g].lon},
+            {"lat", centroids[g].lat}
+        };
+    }
+    return result;
+}
 
-// 2D座標構造体（デカルト座標用）
-struct Point2D {
-    double x;
-    double y;
-    int oid;
-    int original_index; // 元のインデックスを保持
+/**
+ * 所属グループを {"cluster_ids": [...], "counts": [...]} 形式のJSONに変換
+ * グループごとの点数は cluster_ids から求める
+ */
+json membershipToJson(const vector<int32_t>& cluster_ids, size_t num_clusters) {
+    vector<int32_t> counts(num_clusters, 0);
+    for (int32_t cluster_id : cluster_ids) {
+        counts[cluster_id - 1]++;
+    }
+    return {
+        {"cluster_ids", cluster_ids},
+        {"counts", counts}
+    };
+}
 
-    Point2D() : x(0), y(0), oid(0), original_index(-1) {}
-    Point2D(double x_coord, double y_coord, int object_id, int idx = -1)
-        : x(x_coord), y(y_coord), oid(object_id), original_index(idx) {}
-};
+// バイナリ形式のContent-Type（リトルエンディアンの列指向形式）
+const string BINARY_CONTENT_TYPE = "application/x-aggregation-binary";
+const char BINARY_REQUEST_MAGIC[4] = {'A', 'G', 'P', '1'};
+const char BINARY_RESPONSE_MAGIC[4] = {'A', 'G', 'R', '1'};
+const char BINARY_MEMBERSHIP_MAGIC[4] = {'A', 'G', 'M', '1'};
+const size_t BINARY_HEADER_SIZE = 8;  // マジック4バイト + 点数 uint32
 
-// 高性能グリッドハッシュ用の構造体
-struct GridKey {
-    int grid_x;
-    int grid_y;
+/**
+ * Content-Type がバイナリ形式かどうか
+ */
+bool isBinaryRequest(const httplib::Request& req) {
+    return req.get_header_value("Content-Type").rfind(BINARY_CONTENT_TYPE, 0) == 0;
+}
 
-    GridKey() : grid_x(0), grid_y(0) {}
-    GridKey(int x, int y) : grid_x(x), grid_y(y) {}
+/**
+ * Accept ヘッダーでバイナリ形式のレスポンスが要求されているか
+ */
+bool acceptsBinary(const httplib::Request& req) {
+    return req.get_header_value("Accept").find(BINARY_CONTENT_TYPE) != string::npos;
+}
 
-    bool operator==(const GridKey& other) const {
-        return grid_x == other.grid_x && grid_y == other.grid_y;
+/**
+ * バイナリ形式のポイント列を解析して out の末尾に追加
+ *   [マジック "AGP1"][点数 n: uint32][lon: float64 × n][lat: float64 × n][oid: int32 × n]
+ * 数値はすべてリトルエンディアン
+ *
+ * @return 追加したポイント数
+ */
+size_t appendBinaryPoints(const char* data, size_t size, vector<Point>& out) {
+    if (size < BINARY_HEADER_SIZE || memcmp(data, BINARY_REQUEST_MAGIC, 4) != 0) {
+        throw runtime_error("バイナリ形式のヘッダーが不正です: 受信 " + to_string(size) + " バイト");
     }
 
-    bool operator<(const GridKey& other) const {
-        if (grid_x != other.grid_x) return grid_x < other.grid_x;
-        return grid_y < other.grid_y;
+    uint32_t n;
+    memcpy(&n, data + 4, sizeof(n));
+    size_t expected = BINARY_HEADER_SIZE + static_cast<size_t>(n) * (sizeof(double) * 2 + sizeof(int32_t));
+    if (size != expected) {
+        throw runtime_error("バイナリ形式のサイズが不正です: 期待値 " + to_string(expected) +
+                            " バイト, 実際 " + to_string(size) + " バイト");
     }
-};
 
-// GridKeyの高速ハッシュ関数
-struct GridKeyHash {
-    size_t operator()(const GridKey& key) const {
-        // より効率的なハッシュ関数
-        return ((size_t)key.grid_x << 32) | ((size_t)key.grid_y & 0xFFFFFFFF);
+    const char* lon_ptr = data + BINARY_HEADER_SIZE;
+    const char* lat_ptr = lon_ptr + static_cast<size_t>(n) * sizeof(double);
+    const char* oid_ptr = lat_ptr + static_cast<size_t>(n) * sizeof(double);
+
+    size_t base = out.size();
+    out.resize(base + n);
+    for (uint32_t i = 0; i < n; i++) {
+        Point& p = out[base + i];
+        int32_t oid;
+        memcpy(&p.lon, lon_ptr + i * sizeof(double), sizeof(double));
+        memcpy(&p.lat, lat_ptr + i * sizeof(double), sizeof(double));
+        memcpy(&oid, oid_ptr + i * sizeof(int32_t), sizeof(int32_t));
+        p.oid = oid;
     }
-};
-
-
+    return n;
+}
 
 /**
- * 地理座標をデカルト座標に変換
+ * バイナリ形式のリクエストボディを解析
  */
-vector<Point2D> convertToCartesian(const vector<Point>& points) {
-    if (points.empty()) return {};
+vector<Point> decodeBinaryPoints(const string& body) {
+    vector<Point> points;
+    appendBinaryPoints(body.data(), body.size(), points);
+    return points;
+}
 
-    // 参照点（重心）を計算
-    double ref_lon = 0, ref_lat = 0;
-    for (const auto& p : points) {
-        ref_lon += p.lon;
-        ref_lat += p.lat;
+/**
+ * 集約結果の [offset, offset + count) の範囲をバイナリ形式にエンコード
+ *   [マジック "AGR1"][点数 n: uint32][lon: float64 × n][lat: float64 × n][oid: int32 × n]
+ * oid は全体での通し番号のグループID（1から）
+ */
+string encodeBinaryCentroids(const vector<Point>& centroids, size_t offset = 0, size_t count = string::npos) {
+    count = min(count, centroids.size() - min(offset, centroids.size()));
+    uint32_t n = static_cast<uint32_t>(count);
+    string body(BINARY_HEADER_SIZE + static_cast<size_t>(n) * (sizeof(double) * 2 + sizeof(int32_t)), '\0');
+
+    memcpy(&body[0], BINARY_RESPONSE_MAGIC, 4);
+    memcpy(&body[4], &n, sizeof(n));
+
+    char* lon_ptr = &body[BINARY_HEADER_SIZE];
+    char* lat_ptr = lon_ptr + static_cast<size_t>(n) * sizeof(double);
+    char* oid_ptr = lat_ptr + static_cast<size_t>(n) * sizeof(double);
+    for (uint32_t i = 0; i < n; i++) {
+        const Point& c = centroids[offset + i];
+        int32_t group_id = static_cast<int32_t>(offset + i) + 1;
+        memcpy(lon_ptr + i * sizeof(double), &c.lon, sizeof(double));
+        memcpy(lat_ptr + i * sizeof(double), &c.lat, sizeof(double));
+        memcpy(oid_ptr + i * sizeof(int32_t), &group_id, sizeof(int32_t));
     }
-    ref_lon /= points.size();
-    ref_lat /= points.size();
-
-    const double R = 6371000.0; // 地球半径（メートル）
-    const double ref_lat_rad = ref_lat * M_PI / 180.0;
-
-    vector<Point2D> cartesian_points;
-    cartesian_points.reserve(points.size());
+    return body;
+}
 
-    for (int i = 0; i < points.size(); i++) {
-        const auto& p = points[i];
-        double x = R * (p.lon - ref_lon) * M_PI / 180.0 * cos(ref_lat_rad);
-        double y = R * (p.lat - ref_lat) * M_PI / 180.0;
-        cartesian_points.emplace_back(x, y, p.oid, i);
+/**
+ * 所属グループの [offset, offset + count) の範囲をバイナリ形式にエンコード
+ *   [マジック "AGM1"][点数 n: uint32][cluster_id: int32 × n]
+ * グループごとの点数は cluster_id から求められるため送らない
+ */
+string encodeBinaryMembership(const vector<int32_t>& cluster_ids, size_t offset = 0, size_t count = string::npos) {
+    count = min(count, cluster_ids.size() - min(offset, cluster_ids.size()));
+    uint32_t n = static_cast<uint32_t>(count);
+    string body(BINARY_HEADER_SIZE + static_cast<size_t>(n) * sizeof(int32_t), '\0');
+
+    memcpy(&body[0], BINARY_MEMBERSHIP_MAGIC, 4);
+    memcpy(&body[4], &n, sizeof(n));
+    if (n > 0) {
+        memcpy(&body[BINARY_HEADER_SIZE], cluster_ids.data() + offset, static_cast<size_t>(n) * sizeof(int32_t));
     }
+    return body;
+}
 
-    return cartesian_points;
+/**
+ * クエリ文字列の真偽値パラメータを取得（"1" / "true" で真）
+ */
+bool getBoolParam(const httplib::Request& req, const string& name) {
+    if (!req.has_param(name)) return false;
+    string value = req.get_param_value(name);
+    return value == "1" || value == "true";
 }
 
+// MARK: 結果キャッシュ
+
 /**
- * 凸包を計算（Graham scan アルゴリズム）
+ * SHA-256（入力点の内容からキャッシュのキーを求める）
  */
-vector<Point2D> computeConvexHull(vector<Point2D> points) {
-    if (points.size() < 3) return points;
+class Sha256 {
+private:
+    uint32_t state_[8] = {0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19};
+    uint8_t buffer_[64];
+    size_t buffer_size_ = 0;
+    uint64_t total_bytes_ = 0;
+
+    static uint32_t rotr(uint32_t x, int n) { return (x >> n) | (x << (32 - n)); }
+
+    void transform(const uint8_t* block) {
+        static const uint32_t k[64] = {
+            0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+            0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+            0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+            0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+            0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+            0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+            0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+            0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+        };
 
-    // 最下部の点を見つける（y座標が最小、同じならx座標が最小）
-    int min_idx = 0;
-    for (int i = 1; i < points.size(); i++) {
-        if (points[i].y < points[min_idx].y ||
-            (points[i].y == points[min_idx].y && points[i].x < points[min_idx].x)) {
-            min_idx = i;
+        uint32_t w[64];
+        for (int i = 0; i < 16; i++) {
+            w[i] = (static_cast<uint32_t>(block[4 * i]) << 24) | (static_cast<uint32_t>(block[4 * i + 1]) << 16) |
+                   (static_cast<uint32_t>(block[4 * i + 2]) << 8) | static_cast<uint32_t>(block[4 * i + 3]);
+        }
+        for (int i = 16; i < 64; i++) {
+            uint32_t s0 = rotr(w[i - 15], 7) ^ rotr(w[i - 15], 18) ^ (w[i - 15] >> 3);
+            uint32_t s1 = rotr(w[i - 2], 17) ^ rotr(w[i - 2], 19) ^ (w[i - 2] >> 10);
+            w[i] = w[i - 16] + s0 + w[i - 7] + s1;
         }
+
+        uint32_t a = state_[0], b = state_[1], c = state_[2], d = state_[3];
+        uint32_t e = state_[4], f = state_[5], g = state_[6], h = state_[7];
+        for (int i = 0; i < 64; i++) {
+            uint32_t t1 = h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + k[i] + w[i];
+            uint32_t t2 = (rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c));
+            h = g; g = f; f = e; e = d + t1;
+            d = c; c = b; b = a; a = t1 + t2;
+        }
+        state_[0] += a; state_[1] += b; state_[2] += c; state_[3] += d;
+        state_[4] += e; state_[5] += f; state_[6] += g; state_[7] += h;
     }
-    swap(points[0], points[min_idx]);
 
-    Point2D pivot = points[0];
+public:
+    void update(const void* data, size_t size) {
+        const uint8_t* bytes = static_cast<const uint8_t*>(data);
+        total_bytes_ += size;
+        if (buffer_size_ > 0) {
+            size_t take = min(size, sizeof(buffer_) - buffer_size_);
+            memcpy(buffer_ + buffer_size_, bytes, take);
+            buffer_size_ += take;
+            bytes += take;
+            size -= take;
+            if (buffer_size_ < sizeof(buffer_)) return;
+            transform(buffer_);
+            buffer_size_ = 0;
+        }
+        for (; size >= sizeof(buffer_); bytes += sizeof(buffer_), size -= sizeof(buffer_)) {
+            transform(bytes);
+        }
+        memcpy(buffer_, bytes, size);
+        buffer_size_ = size;
+    }
 
-    // 角度でソート
-    sort(points.begin() + 1, points.end(), [&pivot](const Point2D& a, const Point2D& b) {
-        double cross = (a.x - pivot.x) * (b.y - pivot.y) - (a.y - pivot.y) * (b.x - pivot.x);
-        if (abs(cross) < 1e-9) {
-            // 共線の場合、距離で比較
-            double dist_a = (a.x - pivot.x) * (a.x - pivot.x) + (a.y - pivot.y) * (a.y - pivot.y);
-            double dist_b = (b.x - pivot.x) * (b.x - pivot.x) + (b.y - pivot.y) * (b.y - pivot.y);
-            return dist_a < dist_b;
+    // 16進数64桁のダイジェスト（呼び出し後は update できない）
+    string hexDigest() {
+        uint64_t bit_length = total_bytes_ * 8;
+        const uint8_t padding[64] = {0x80};
+        update(padding, buffer_size_ < 56 ? 56 - buffer_size_ : 120 - buffer_size_);
+        uint8_t length[8];
+        for (int i = 0; i < 8; i++) {
+            length[i] = static_cast<uint8_t>(bit_length >> (56 - 8 * i));
         }
-        return cross > 0;
-    });
+        update(length, sizeof(length));
 
-    // Graham scan
-    vector<Point2D> hull;
-    for (const auto& point : points) {
-        while (hull.size() >= 2) {
-            Point2D& p1 = hull[hull.size() - 2];
-            Point2D& p2 = hull[hull.size() - 1];
-            double cross = (p2.x - p1.x) * (point.y - p1.y) - (p2.y - p1.y) * (point.x - p1.x);
-            if (cross <= 0) {
-                hull.pop_back();
-            } else {
-                break;
-            }
+        char hex[65];
+        for (int i = 0; i < 8; i++) {
+            snprintf(hex + 8 * i, 9, "%08x", state_[i]);
         }
-        hull.push_back(point);
+        return hex;
     }
+};
 
-    return hull;
+/**
+ * 入力点の座標の SHA-256（経度の列、緯度の列の順に float64 リトルエンディアンで連結したもの）
+ * バイナリ形式の経度・緯度ブロックを続けたものと同じで、クライアントも送信前に同じ値を計算できる。
+ * oid は集約結果に影響しないため含めない
+ */
+string pointsDigest(const vector<Point>& points) {
+    Sha256 sha;
+    vector<double> column;
+    column.reserve(min(points.size(), static_cast<size_t>(8192)));
+    auto feed = [&](double Point::*field) {
+        for (const auto& point : points) {
+            column.push_back(point.*field);
+            if (column.size() == column.capacity()) {
+                sha.update(column.data(), column.size() * sizeof(double));
+                column.clear();
+            }
+        }
+        sha.update(column.data(), column.size() * sizeof(double));
+        column.clear();
+    };
+    feed(&Point::lon);
+    feed(&Point::lat);
+    return sha.hexDigest();
 }
 
+// 集約結果（キャッシュ・セッション・ジョブで共有するため作成後は変更しない）
+struct AggregationResult {
+    vector<Point> centroids;
+    vector<int32_t> cluster_ids;  // 入力点ごとの所属グループ（求めていなければ空）
+    size_t input_count = 0;
+
+    size_t memoryBytes() const {
+        return sizeof(*this) + centroids.capacity() * sizeof(Point) + cluster_ids.capacity() * sizeof(int32_t);
+    }
+};
+
 /**
- * 凸包の重心を計算
+ * 入力点の SHA-256・半径・グループ化モードをキーとする集約結果の LRU キャッシュ（スレッドセーフ）
+ * 保持する結果の合計が budget_bytes を超えると、最も長く使われていない結果から破棄する
  */
-Point2D computeCentroid(const vector<Point2D>& hull_points) {
-    if (hull_points.empty()) return Point2D();
+class ResultCache {
+private:
+    using Entry = pair<string, shared_ptr<const AggregationResult>>;
+
+    mutex mtx_;
+    list<Entry> entries_;  // 先頭ほど最近使われた結果
+    unordered_map<string, list<Entry>::iterator> index_;
+    size_t budget_bytes_;
+    size_t used_bytes_ = 0;
+    size_t hits_ = 0;
+    size_t misses_ = 0;
+    size_t evictions_ = 0;
+
+public:
+    explicit ResultCache(size_t budget_bytes) : budget_bytes_(budget_bytes) {}
 
-    double sum_x = 0, sum_y = 0;
-    for (const auto& p : hull_points) {
-        sum_x += p.x;
-        sum_y += p.y;
+    bool enabled() const { return budget_bytes_ > 0; }
+
+    static string makeKey(const string& digest, double radius, ClusteringMode mode) {
+        char radius_text[32];
+        snprintf(radius_text, sizeof(radius_text), "%.17g", radius);
+        return digest + "/" + clusteringModeName(mode) + "/" + radius_text;
     }
 
-    return Point2D(sum_x / hull_points.size(), sum_y / hull_points.size(), 0);
-}
+    // 結果を取得（なければ nullptr）。record が false ならヒット率に数えない
+    shared_ptr<const AggregationResult> find(const string& key, bool record = true) {
+        lock_guard<mutex> lock(mtx_);
+        auto it = index_.find(key);
+        if (it == index_.end()) {
+            if (record) misses_++;
+            return nullptr;
+        }
+        if (record) hits_++;
+        entries_.splice(entries_.begin(), entries_, it->second);
+        return it->second->second;
+    }
+
+    void insert(const string& key, shared_ptr<const AggregationResult> result) {
+        size_t bytes = result->memoryBytes() + key.size();
+        if (bytes > budget_bytes_) return;  // 単独で上限を超える結果は保持しない
+
+        lock_guard<mutex> lock(mtx_);
+        auto it = index_.find(key);
+        if (it != index_.end()) {
+            used_bytes_ -= it->second->second->memoryBytes() + key.size();
+            entries_.erase(it->second);
+            index_.erase(it);
+        }
+        entries_.emplace_front(key, move(result));
+        index_[key] = entries_.begin();
+        used_bytes_ += bytes;
+
+        while (used_bytes_ > budget_bytes_) {
+            const Entry& oldest = entries_.back();
+            used_bytes_ -= oldest.second->memoryBytes() + oldest.first.size();
+            index_.erase(oldest.first);
+            entries_.pop_back();
+            evictions_++;
+        }
+    }
+
+    void clear() {
+        lock_guard<mutex> lock(mtx_);
+        entries_.clear();
+        index_.clear();
+        used_bytes_ = 0;
+    }
+
+    json stats() {
+        lock_guard<mutex> lock(mtx_);
+        return {
+            {"entries", entries_.size()},
+            {"used_bytes", used_bytes_},
+            {"budget_bytes", budget_bytes_},
+            {"hits", hits_},
+            {"misses", misses_},
+            {"evictions", evictions_}
+        };
+    }
+};
+
+// キャッシュを経由した集約の結果
+struct CachedAggregation {
+    shared_ptr<const AggregationResult> result;
+    string digest;           // 入力点の SHA-256（キャッシュ無効時は空）
+    bool cache_hit = false;
+    double lookup_seconds = 0;  // ダイジェスト計算とキャッシュ参照の時間
+};
 
 /**
- * デカルト座標を地理座標に逆変換
+ * キャッシュを参照して集約（なければ集約してキャッシュに追加）
+ * キャッシュが有効な場合は後のリクエストでも使えるよう、membership によらず所属グループも求める。
+ * tiled モードの結果はスレッド数によらず同じなので、スレッド数はキーに含めない
  */
-Point convertToGeographic(const Point2D& cartesian_point, double ref_lon, double ref_lat) {
-    const double R = 6371000.0;
-    const double ref_lat_rad = ref_lat * M_PI / 180.0;
+CachedAggregation aggregateWithCache(ResultCache& cache, const vector<Point>& points, double radius,
+                                     ClusteringMode mode, int threads, bool membership,
+                                     ClusterProgress* progress = nullptr) {
+    CachedAggregation aggregation;
+    string key;
+    if (cache.enabled()) {
+        auto lookup_start = chrono::steady_clock::now();
+        aggregation.digest = pointsDigest(points);
+        key = ResultCache::makeKey(aggregation.digest, radius, mode);
+        aggregation.result = cache.find(key);
+        aggregation.lookup_seconds = chrono::duration<double>(chrono::steady_clock::now() - lookup_start).count();
+        if (aggregation.result) {
+            cout << "キャッシュヒット: " << aggregation.digest.substr(0, 16) << " ("
+                 << aggregation.result->input_count << " → " << aggregation.result->centroids.size() << " ポイント)" << endl;
+            aggregation.cache_hit = true;
+            if (progress) progress->begin(ClusterPhase::Done, 0);
+            return aggregation;
+        }
+    }
 
-    double lon = ref_lon + (cartesian_point.x / (R * cos(ref_lat_rad))) * 180.0 / M_PI;
-    double lat = ref_lat + (cartesian_point.y / R) * 180.0 / M_PI;
+    auto result = make_shared<AggregationResult>();
+    ClusterMembership cluster_membership;
+    bool with_membership = membership || cache.enabled();
+    result->centroids = clusterPoints(points, radius, mode, resolveThreadCount(threads),
+                                      with_membership ? &cluster_membership : nullptr, progress);
+    result->cluster_ids = move(cluster_membership.cluster_ids);
+    result->input_count = points.size();
 
-    return Point(lon, lat, cartesian_point.oid);
+    if (cache.enabled()) {
+        cache.insert(key, result);
+    }
+    aggregation.result = move(result);
+    return aggregation;
 }
 
+// MARK: メトリクス
+
 /**
- * 2点間の距離の平方を計算（高速化のためsqrtを回避）
+ * 開始時刻からの経過時間（秒）
  */
-double calculateDistanceSquared(const Point2D& p1, const Point2D& p2) {
-    double dx = p1.x - p2.x;
-    double dy = p1.y - p2.y;
-    return dx * dx + dy * dy;
+double secondsSince(chrono::steady_clock::time_point start) {
+    return chrono::duration<double>(chrono::steady_clock::now() - start).count();
 }
 
 /**
- * 2点間のユークリッド距離を計算
+ * 1回の集約のフェーズごとの処理時間
+ *   parse（リクエストの解析）→ cache_lookup（ダイジェスト計算とキャッシュ参照）→ projection → indexing
+ *   → grouping → centroids（凸包・重心）→ serialization（レスポンスの生成）
  */
-double calculateDistance(const Point2D& p1, const Point2D& p2) {
-    return sqrt(calculateDistanceSquared(p1, p2));
-}
+struct RequestTimings {
+    vector<pair<string, double>> phases;  // (フェーズ名, 秒) を処理順に保持
+
+    void add(const string& name, double seconds) { phases.emplace_back(name, seconds); }
+
+    // 集約処理の各フェーズを追加（キャッシュヒット時は集約していないので呼ばない）
+    void addClusterPhases(const ClusterProgress& progress) {
+        for (ClusterPhase phase : {ClusterPhase::Projection, ClusterPhase::Indexing,
+                                   ClusterPhase::Grouping, ClusterPhase::Centroids}) {
+            add(clusterPhaseName(phase), progress.phaseSeconds(phase));
+        }
+    }
+
+    // {"parse": 1.2, ..., "total": 34.5}（ミリ秒）
+    json toJson() const {
+        json result = json::object();
+        double total = 0;
+        for (const auto& phase : phases) {
+            result[phase.first] = phase.second * 1000.0;
+            total += phase.second;
+        }
+        result["total"] = total * 1000.0;
+        return result;
+    }
+
+    // Server-Timing ヘッダーの値（parse;dur=1.2, grouping;dur=30.1, ...）
+    string serverTiming() const {
+        string header;
+        char buffer[64];
+        for (const auto& phase : phases) {
+            snprintf(buffer, sizeof(buffer), "%s;dur=%.3f", phase.first.c_str(), phase.second * 1000.0);
+            if (!header.empty()) header += ", ";
+            header += buffer;
+        }
+        return header;
+    }
+};
+
+// 処理時間（秒）と点数のヒストグラムの区切り
+const vector<double> LATENCY_BUCKETS = {0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120};
+const vector<double> POINT_COUNT_BUCKETS = {10, 100, 1000, 10000, 100000, 1000000, 5000000, 10000000};
 
 /**
- * 高速空間インデックス（グリッドベース）
+ * Prometheus 形式のヒストグラム（ロックは呼び出し側で行う）
  */
-class SpatialIndex {
+class Histogram {
 private:
-    unordered_map<GridKey, vector<int>, GridKeyHash> grid_map;
-    double grid_size;
+    vector<double> bounds_;
+    vector<uint64_t> counts_;  // 区間ごとの件数（最後は +Inf）
+    double sum_ = 0;
+    uint64_t count_ = 0;
 
 public:
-    SpatialIndex(double cell_size) : grid_size(cell_size) {}
-
-    void insert(const Point2D& point, int index) {
-        GridKey key(
-            static_cast<int>(floor(point.x / grid_size)),
-            static_cast<int>(floor(point.y / grid_size))
-        );
-        grid_map[key].push_back(index);
-    }
-
-    // 指定範囲内の候補点を高速取得
-    vector<int> getCandidates(const Point2D& center, double radius) const {
-        vector<int> candidates;
-
-        int grid_radius = static_cast<int>(ceil(radius / grid_size)) + 1;
-        GridKey center_key(
-            static_cast<int>(floor(center.x / grid_size)),
-            static_cast<int>(floor(center.y / grid_size))
-        );
-
-        for (int dx = -grid_radius; dx <= grid_radius; dx++) {
-            for (int dy = -grid_radius; dy <= grid_radius; dy++) {
-                GridKey key(center_key.grid_x + dx, center_key.grid_y + dy);
-                auto it = grid_map.find(key);
-                if (it != grid_map.end()) {
-                    candidates.insert(candidates.end(), it->second.begin(), it->second.end());
-                }
-            }
-        }
+    explicit Histogram(const vector<double>& bounds) : bounds_(bounds), counts_(bounds.size() + 1, 0) {}
 
-        return candidates;
+    void observe(double value) {
+        counts_[lower_bound(bounds_.begin(), bounds_.end(), value) - bounds_.begin()]++;
+        sum_ += value;
+        count_++;
     }
 
-    size_t getGridCount() const { return grid_map.size(); }
+    // labels は "phase=\"grouping\"" のようなラベル（なければ空）
+    void render(string& out, const string& name, const string& labels) const {
+        string prefix = labels.empty() ? "" : labels + ",";
+        uint64_t cumulative = 0;
+        for (size_t i = 0; i <= bounds_.size(); i++) {
+            cumulative += counts_[i];
+            string le = i < bounds_.size() ? json(bounds_[i]).dump() : string("+Inf");
+            out += name + "_bucket{" + prefix + "le=\"" + le + "\"} " + to_string(cumulative) + "\n";
+        }
+        string suffix = labels.empty() ? "" : "{" + labels + "}";
+        out += name + "_sum" + suffix + " " + json(sum_).dump() + "\n";
+        out += name + "_count" + suffix + " " + to_string(count_) + "\n";
+    }
 };
 
 /**
- * 並列処理対応Union-Find
+ * メトリクスの1行を追加（HELP・TYPE 付き）
  */
-class ThreadSafeUnionFind {
+void appendMetric(string& out, const string& name, const string& type, const string& help, double value) {
+    out += "# HELP " + name + " " + help + "\n";
+    out += "# TYPE " + name + " " + type + "\n";
+    out += name + " " + json(value).dump() + "\n";
+}
+
+// メトリクスのラベルにするルート（main() で登録するルートと同じ並び。{digest} は64桁、{id} は任意長の16進数）
+const vector<string> METRIC_ROUTES = {
+    "/health",
+    "/cache",
+    "/cache/{digest}",
+    "/cache/{digest}/results",
+    "/cache/{digest}/membership",
+    "/aggregate",
+    "/sessions",
+    "/sessions/{id}/chunks",
+    "/sessions/{id}/finalize",
+    "/sessions/{id}/results",
+    "/sessions/{id}/membership",
+    "/sessions/{id}",
+    "/jobs",
+    "/jobs/{id}",
+    "/jobs/{id}/result",
+    "/jobs/{id}/membership",
+    "/metrics",
+};
+
+// ルートに当てはまらないパスや 404 のラベル（存在しないパスやIDごとに系列が増えないようにまとめる）
+const string OTHER_ROUTE_LABEL = "other";
+
+vector<string> splitPath(const string& path) {
+    vector<string> segments;
+    size_t start = 0;
+    while (start <= path.size()) {
+        size_t end = path.find('/', start);
+        if (end == string::npos) end = path.size();
+        if (end > start) segments.push_back(path.substr(start, end - start));
+        start = end + 1;
+    }
+    return segments;
+}
+
+bool isHexSegment(const string& segment) {
+    return !segment.empty() &&
+           all_of(segment.begin(), segment.end(), [](char c) { return isdigit(static_cast<unsigned char>(c)) || (c >= 'a' && c <= 'f'); });
+}
+
+/**
+ * リクエストのメトリクス用のラベル（メソッド, ルート）
+ *
+ * パスは METRIC_ROUTES のうち当てはまるルート、当てはまらないパスと 404 は "other" にまとめる。
+ * OPTIONS（CORS のプリフライト）はパスによらず "*"、未知のメソッドは "OTHER" にする。
+ */
+pair<string, string> requestLabels(const string& method, const string& path, int status) {
+    static const set<string> METHODS = {"GET", "POST", "DELETE", "PUT", "PATCH", "HEAD", "OPTIONS"};
+    string method_label = METHODS.count(method) ? method : "OTHER";
+    if (method == "OPTIONS") return {method_label, "*"};
+    if (status == 404) return {method_label, OTHER_ROUTE_LABEL};
+
+    const vector<string> segments = splitPath(path);
+    for (const auto& route : METRIC_ROUTES) {
+        const vector<string> pattern = splitPath(route);
+        if (pattern.size() != segments.size()) continue;
+        bool matched = true;
+        for (size_t i = 0; i < pattern.size() && matched; i++) {
+            if (pattern[i] == "{digest}") {
+                matched = segments[i].size() == 64 && isHexSegment(segments[i]);
+            } else if (pattern[i] == "{id}") {
+                matched = isHexSegment(segments[i]);
+            } else {
+                matched = pattern[i] == segments[i];
+            }
+        }
+        if (matched) return {method_label, route};
+    }
+    return {method_label, OTHER_ROUTE_LABEL};
+}
+
+/**
+ * サーバーのメトリクス（スレッドセーフ、GET /metrics で Prometheus 形式で出力）
+ */
+class ServerMetrics {
 private:
-    vector<atomic<int>> parent;
-    vector<atomic<int>> rank;
-    mutable vector<mutex> mutexes;
+    mutex mtx_;
+    map<tuple<string, string, int>, uint64_t> http_requests_;  // (メソッド, パス, ステータス) → 件数
+    map<string, pair<uint64_t, uint64_t>> http_bytes_;        // パス → (受信バイト, 送信バイト)
+    map<string, Histogram> phase_seconds_;
+    Histogram input_points_{POINT_COUNT_BUCKETS};
+    Histogram output_points_{POINT_COUNT_BUCKETS};
+    uint64_t aggregations_ = 0;
+    uint64_t cache_hits_ = 0;
+    chrono::steady_clock::time_point started_at_ = chrono::steady_clock::now();
+
+    void observePhase(const string& phase, double seconds) {
+        auto it = phase_seconds_.find(phase);
+        if (it == phase_seconds_.end()) {
+            it = phase_seconds_.emplace(phase, Histogram(LATENCY_BUCKETS)).first;
+        }
+        it->second.observe(seconds);
+    }
 
 public:
-    ThreadSafeUnionFind(int n) : parent(n), rank(n), mutexes(n) {
-        for (int i = 0; i < n; i++) {
-            parent[i].store(i);
-            rank[i].store(0);
+    void recordRequest(const httplib::Request& req, const httplib::Response& res) {
+        const auto labels = requestLabels(req.method, req.path, res.status);
+        lock_guard<mutex> lock(mtx_);
+        http_requests_[make_tuple(labels.first, labels.second, res.status)]++;
+        auto& bytes = http_bytes_[labels.second];
+        bytes.first += req.body.size();
+        bytes.second += res.body.size();
+    }
+
+    // 集約以外のリクエストのフェーズ（チャンクの展開・解析など）
+    void recordPhase(const string& phase, double seconds) {
+        lock_guard<mutex> lock(mtx_);
+        observePhase(phase, seconds);
+    }
+
+    void recordAggregation(const RequestTimings& timings, size_t input_count, size_t output_count, bool cache_hit) {
+        lock_guard<mutex> lock(mtx_);
+        for (const auto& phase : timings.phases) {
+            observePhase(phase.first, phase.second);
         }
+        input_points_.observe(static_cast<double>(input_count));
+        output_points_.observe(static_cast<double>(output_count));
+        aggregations_++;
+        if (cache_hit) cache_hits_++;
     }
 
-    int find(int x) {
-        while (true) {
-            int p = parent[x].load();
-            if (p == x) return x;
+    string render() {
+        lock_guard<mutex> lock(mtx_);
+        string out;
+        appendMetric(out, "aggregation_uptime_seconds", "gauge", "サーバーの起動からの経過時間", secondsSince(started_at_));
 
-            // パス圧縮
-            int gp = parent[p].load();
-            if (gp == p) return p;
+        out += "# HELP aggregation_http_requests_total HTTPリクエスト数\n";
+        out += "# TYPE aggregation_http_requests_total counter\n";
+        for (const auto& entry : http_requests_) {
+            out += "aggregation_http_requests_total{method=\"" + get<0>(entry.first) + "\",path=\"" + get<1>(entry.first) +
+                   "\",status=\"" + to_string(get<2>(entry.first)) + "\"} " + to_string(entry.second) + "\n";
+        }
+        out += "# HELP aggregation_http_request_bytes_total 受信したリクエストボディの合計バイト数\n";
+        out += "# TYPE aggregation_http_request_bytes_total counter\n";
+        for (const auto& entry : http_bytes_) {
+            out += "aggregation_http_request_bytes_total{path=\"" + entry.first + "\"} " + to_string(entry.second.first) + "\n";
+        }
+        out += "# HELP aggregation_http_response_bytes_total 送信したレスポンスボディの合計バイト数\n";
+        out += "# TYPE aggregation_http_response_bytes_total counter\n";
+        for (const auto& entry : http_bytes_) {
+            out += "aggregation_http_response_bytes_total{path=\"" + entry.first + "\"} " + to_string(entry.second.second) + "\n";
+        }
+
+        appendMetric(out, "aggregation_runs_total", "counter", "集約の実行回数（キャッシュヒットを含む）",
+                     static_cast<double>(aggregations_));
+        appendMetric(out, "aggregation_cache_served_total", "counter", "キャッシュから返した集約の回数",
+                     static_cast<double>(cache_hits_));
 
-            parent[x].compare_exchange_weak(p, gp);
-            x = p;
+        out += "# HELP aggregation_phase_duration_seconds フェーズごとの処理時間\n";
+        out += "# TYPE aggregation_phase_duration_seconds histogram\n";
+        for (const auto& entry : phase_seconds_) {
+            entry.second.render(out, "aggregation_phase_duration_seconds", "phase=\"" + entry.first + "\"");
         }
+        out += "# HELP aggregation_input_points 1回の集約の入力点数\n";
+        out += "# TYPE aggregation_input_points histogram\n";
+        input_points_.render(out, "aggregation_input_points", "");
+        out += "# HELP aggregation_output_points 1回の集約の出力点数\n";
+        out += "# TYPE aggregation_output_points histogram\n";
+        output_points_.render(out, "aggregation_output_points", "");
+        return out;
     }
+};
 
-    bool unite(int x, int y) {
-        while (true) {
-            int px = find(x);
-            int py = find(y);
-            if (px == py) return false;
+// MARK: アップロードセッション
+
+// チャンク1つあたりの展開後の最大サイズ（圧縮爆弾対策）
+const size_t MAX_CHUNK_DECODED_BYTES = 256 * 1024 * 1024;
+
+// 最終アクセスからこの時間が過ぎたセッションは破棄する
+const chrono::seconds SESSION_TTL(3600);
+
+/**
+ * gzip 形式のチャンクを展開
+ */
+string inflateGzip(const string& compressed) {
+    z_stream stream;
+    memset(&stream, 0, sizeof(stream));
+    // 16 + MAX_WBITS で gzip ヘッダーを解釈
+    if (inflateInit2(&stream, 16 + MAX_WBITS) != Z_OK) {
+        throw runtime_error("gzip の展開を開始できません");
+    }
+
+    string out;
+    char buffer[1 << 16];
+    stream.next_in = reinterpret_cast<Bytef*>(const_cast<char*>(compressed.data()));
+    stream.avail_in = static_cast<uInt>(compressed.size());
+    int ret = Z_OK;
+    while (ret != Z_STREAM_END) {
+        stream.next_out = reinterpret_cast<Bytef*>(buffer);
+        stream.avail_out = sizeof(buffer);
+        ret = inflate(&stream, Z_NO_FLUSH);
+        if (ret != Z_OK && ret != Z_STREAM_END) {
+            size_t consumed = compressed.size() - stream.avail_in;
+            inflateEnd(&stream);
+            throw runtime_error("gzip の展開に失敗しました: 圧縮データ " + to_string(compressed.size()) +
+                                " バイト中 " + to_string(consumed) + " バイト目");
+        }
+        out.append(buffer, sizeof(buffer) - stream.avail_out);
+        if (out.size() > MAX_CHUNK_DECODED_BYTES) {
+            inflateEnd(&stream);
+            throw runtime_error("展開後のチャンクが上限 " + to_string(MAX_CHUNK_DECODED_BYTES) + " バイトを超えました");
+        }
+    }
+    inflateEnd(&stream);
+    return out;
+}
 
-            if (px > py) swap(px, py);
+#ifdef AGGREGATION_WITH_ZSTD
+/**
+ * zstd 形式のチャンクを展開
+ */
+string decompressZstd(const string& compressed) {
+    ZSTD_DStream* stream = ZSTD_createDStream();
+    ZSTD_initDStream(stream);
+
+    string out;
+    vector<char> buffer(ZSTD_DStreamOutSize());
+    ZSTD_inBuffer input = {compressed.data(), compressed.size(), 0};
+    size_t ret = 1;
+    while (input.pos < input.size) {
+        ZSTD_outBuffer output = {buffer.data(), buffer.size(), 0};
+        ret = ZSTD_decompressStream(stream, &output, &input);
+        if (ZSTD_isError(ret)) {
+            size_t consumed = input.pos;
+            ZSTD_freeDStream(stream);
+            throw runtime_error(string("zstd の展開に失敗しました: ") + ZSTD_getErrorName(ret) + ", 圧縮データ " +
+                                to_string(compressed.size()) + " バイト中 " + to_string(consumed) + " バイト目");
+        }
+        out.append(buffer.data(), output.pos);
+        if (out.size() > MAX_CHUNK_DECODED_BYTES) {
+            ZSTD_freeDStream(stream);
+            throw runtime_error("展開後のチャンクが上限 " + to_string(MAX_CHUNK_DECODED_BYTES) + " バイトを超えました");
+        }
+    }
+    ZSTD_freeDStream(stream);
+    if (ret != 0) {
+        throw runtime_error("zstd のフレームが途中で終わっています: 圧縮データ " + to_string(compressed.size()) + " バイト");
+    }
+    return out;
+}
+#endif
 
-            lock_guard<mutex> lock1(mutexes[px]);
-            lock_guard<mutex> lock2(mutexes[py]);
+/**
+ * compression パラメータ ("none" / "gzip" / "zstd") に従ってチャンクを展開
+ * 展開が不要な場合は body をそのまま返し、展開した場合は decoded に格納してそれを返す
+ */
+const string& decompressChunk(const string& body, const string& compression, string& decoded) {
+    if (compression.empty() || compression == "none" || compression == "identity") {
+        return body;
+    }
+    if (compression == "gzip") {
+        decoded = inflateGzip(body);
+        return decoded;
+    }
+#ifdef AGGREGATION_WITH_ZSTD
+    if (compression == "zstd") {
+        decoded = decompressZstd(body);
+        return decoded;
+    }
+#endif
+    throw invalid_argument("未対応の圧縮形式です: " + compression);
+}
 
-            if (find(x) != px || find(y) != py) continue;
+/**
+ * セッション・ジョブのID（32桁の16進数）を生成
+ */
+string generateId(mt19937_64& rng) {
+    char buffer[33];
+    snprintf(buffer, sizeof(buffer), "%016llx%016llx",
+             static_cast<unsigned long long>(rng()), static_cast<unsigned long long>(rng()));
+    return buffer;
+}
 
-            int rank_px = rank[px].load();
-            int rank_py = rank[py].load();
+// アップロードセッション（チャンクごとに受け取ったポイントと集約結果を保持）
+struct UploadSession {
+    mutex mtx;
+    vector<Point> points;
+    shared_ptr<const AggregationResult> result;  // 集約結果（所属グループを含む）
+    string points_digest;  // 入力点の SHA-256（キャッシュ無効時は空）
+    bool cache_hit = false;
+    RequestTimings timings;  // 集約のフェーズごとの処理時間
+    bool finalized = false;
+    size_t input_count = 0;     // 受信済みの点数（集約後も保持）
+    size_t chunk_count = 0;
+    size_t received_bytes = 0;  // 受信したボディの合計（圧縮後）
+    chrono::steady_clock::time_point last_access = chrono::steady_clock::now();
+};
 
-            if (rank_px < rank_py) {
-                parent[px].store(py);
-            } else if (rank_px > rank_py) {
-                parent[py].store(px);
+/**
+ * アップロードセッションの管理（スレッドセーフ）
+ * 一定時間アクセスのないセッションは新規作成時にまとめて破棄する
+ */
+class SessionStore {
+private:
+    mutex mtx_;
+    unordered_map<string, shared_ptr<UploadSession>> sessions_;
+    mt19937_64 rng_;
+    chrono::seconds ttl_;
+
+    void evictExpired() {
+        auto now = chrono::steady_clock::now();
+        for (auto it = sessions_.begin(); it != sessions_.end();) {
+            // 処理中のセッションは破棄しない
+            unique_lock<mutex> session_lock(it->second->mtx, try_to_lock);
+            if (session_lock.owns_lock() && now - it->second->last_access > ttl_) {
+                session_lock.unlock();
+                it = sessions_.erase(it);
             } else {
-                parent[py].store(px);
-                rank[px].store(rank_px + 1);
+                ++it;
             }
-            return true;
         }
     }
+
+public:
+    explicit SessionStore(chrono::seconds ttl) : rng_(random_device{}()), ttl_(ttl) {}
+
+    pair<string, shared_ptr<UploadSession>> create() {
+        lock_guard<mutex> lock(mtx_);
+        evictExpired();
+
+        string id;
+        do {
+            id = generateId(rng_);
+        } while (sessions_.count(id));
+
+        auto session = make_shared<UploadSession>();
+        sessions_[id] = session;
+        return {id, session};
+    }
+
+    shared_ptr<UploadSession> find(const string& id) {
+        lock_guard<mutex> lock(mtx_);
+        auto it = sessions_.find(id);
+        return it == sessions_.end() ? nullptr : it->second;
+    }
+
+    bool remove(const string& id) {
+        lock_guard<mutex> lock(mtx_);
+        return sessions_.erase(id) > 0;
+    }
+
+    chrono::seconds ttl() const { return ttl_; }
 };
 
 /**
- * 高速並列ポイント集約処理
+ * エラー応答を返す（ペイロードは含めず、サイズやオフセットなどの details のみ）
+ */
+void sendError(httplib::Response& res, int status, const string& endpoint, const string& type,
+               const string& message, const json& details = json::object()) {
+    cerr << "[" << endpoint << "][" << type << "] " << message << " " << details.dump() << endl;
+    json error_response = {
+        {"status", "error"},
+        {"type", type},
+        {"message", message}
+    };
+    error_response.update(details);
+    res.status = status;
+    res.set_content(error_response.dump(), "application/json");
+}
+
+/**
+ * クエリ文字列の size_t パラメータを取得（省略時は default_value）
  */
-json aggregatePoints(const vector<Point>& input_points, double radius_meters) {
-    auto start_time = chrono::high_resolution_clock::now();
+size_t getSizeParam(const httplib::Request& req, const string& name, size_t default_value) {
+    return req.has_param(name) ? static_cast<size_t>(stoull(req.get_param_value(name))) : default_value;
+}
+
+// MARK: 集約リクエスト
 
-    cout << "集約対象ポイント数: " << input_points.size() << endl;
+// 集約リクエストの内容（/aggregate と /jobs で共通）
+struct AggregateRequest {
+    vector<Point> points;
+    double radius = 0;
+    ClusteringMode mode = ClusteringMode::Serial;
+    int threads = 0;
+    bool membership = false;
+};
 
-    if (input_points.empty()) {
-        return json::object();
+/**
+ * 集約リクエストを解析
+ * Content-Type がバイナリ形式なら点はボディ、パラメータはクエリ文字列。それ以外はJSON
+ */
+AggregateRequest parseAggregateRequest(const httplib::Request& req) {
+    AggregateRequest request;
+
+    if (isBinaryRequest(req)) {
+        // バイナリ形式: 点はボディ、パラメータはクエリ文字列
+        request.points = decodeBinaryPoints(req.body);
+        if (!req.has_param("radius")) {
+            throw runtime_error("radius パラメータが存在しません");
+        }
+        request.radius = stod(req.get_param_value("radius"));
+        request.mode = parseClusteringMode(req.has_param("mode") ? req.get_param_value("mode") : string("serial"));
+        request.threads = req.has_param("threads") ? stoi(req.get_param_value("threads")) : 0;
+        request.membership = getBoolParam(req, "membership");
+        return request;
     }
 
-    // 参照点（重心）を計算
-    double ref_lon = 0, ref_lat = 0;
-    for (const auto& p : input_points) {
-        ref_lon += p.lon;
-        ref_lat += p.lat;
+    // JSONデータを解析
+    json request_data = json::parse(req.body);
+
+    request.radius = request_data.at("radius"); // 半径（メートル）ない場合は例外を投げる
+
+    // ポイントデータを抽出
+    if (request_data.contains("points")) {
+        for (const auto& point_data : request_data["points"]) {
+            int oid = point_data.value("oid", 0);
+            double lon = point_data.value("lon", 0.0);
+            double lat = point_data.value("lat", 0.0);
+            request.points.emplace_back(lon, lat, oid);
+        }
+    } else {
+        throw runtime_error("ポイントデータが存在しません");
     }
-    ref_lon /= input_points.size();
-    ref_lat /= input_points.size();
 
-    // デカルト座標に変換
-    vector<Point2D> cartesian_points = convertToCartesian(input_points);
+    // グループ化モード（省略時は従来の逐次処理）とスレッド数（0 でハードウェアのスレッド数）
+    request.mode = parseClusteringMode(request_data.value("mode", string("serial")));
+    request.threads = request_data.value("threads", 0);
+    // 入力点ごとの所属グループも返すか
+    request.membership = request_data.value("membership", false);
+    return request;
+}
+
+/**
+ * 集約結果を offset, limit のページ単位で返す（Accept がバイナリ形式なら AGR1、それ以外はJSON）
+ * details はエラー応答・JSON応答に追加する項目（セッションID・ジョブIDなど）
+ */
+void sendCentroidPage(const httplib::Request& req, httplib::Response& res, const string& endpoint,
+                      const vector<Point>& centroids, const json& details) {
+    size_t total = centroids.size();
+    size_t offset = getSizeParam(req, "offset", 0);
+    size_t limit = getSizeParam(req, "limit", 100000);
+    if (offset > total) {
+        json error_details = details;
+        error_details.update({{"offset", offset}, {"total_count", total}});
+        sendError(res, 416, endpoint, "offset_out_of_range", "offset が集約結果の件数を超えています", error_details);
+        return;
+    }
+    size_t count = min(limit, total - offset);
+    size_t next_offset = offset + count;
 
-    cout << "高速クラスタリング開始（半径: " << radius_meters << "m）" << endl;
+    if (acceptsBinary(req)) {
+        res.set_header("X-Total-Count", to_string(total));
+        res.set_header("X-Next-Offset", next_offset < total ? to_string(next_offset) : string(""));
+        res.set_content(encodeBinaryCentroids(centroids, offset, count), BINARY_CONTENT_TYPE);
+        return;
+    }
 
-    // 空間インデックスを構築（グリッドサイズは半径と同じで最適化）
-    double grid_size = radius_meters;
-    SpatialIndex spatial_index(grid_size);
+    json response = {
+        {"status", "success"},
+        {"aggregated_points", centroidsToJson(centroids, offset, count)},
+        {"offset", offset},
+        {"count", count},
+        {"total_count", total},
+        {"next_offset", next_offset < total ? json(next_offset) : json(nullptr)}
+    };
+    response.update(details);
+    res.set_content(response.dump(), "application/json");
+}
 
-    for (int i = 0; i < cartesian_points.size(); i++) {
-        spatial_index.insert(cartesian_points[i], i);
+/**
+ * 入力点ごとの所属グループを offset, limit のページ単位で返す（Accept がバイナリ形式なら AGM1、それ以外はJSON）
+ */
+void sendMembershipPage(const httplib::Request& req, httplib::Response& res, const string& endpoint,
+                        const vector<int32_t>& cluster_ids, const json& details) {
+    size_t total = cluster_ids.size();
+    size_t offset = getSizeParam(req, "offset", 0);
+    size_t limit = getSizeParam(req, "limit", 1000000);
+    if (offset > total) {
+        json error_details = details;
+        error_details.update({{"offset", offset}, {"total_count", total}});
+        sendError(res, 416, endpoint, "offset_out_of_range", "offset が入力点数を超えています", error_details);
+        return;
     }
+    size_t count = min(limit, total - offset);
+    size_t next_offset = offset + count;
 
-    cout << "空間インデックス構築完了: " << spatial_index.getGridCount() << " グリッド" << endl;
+    if (acceptsBinary(req)) {
+        res.set_header("X-Total-Count", to_string(total));
+        res.set_header("X-Next-Offset", next_offset < total ? to_string(next_offset) : string(""));
+        res.set_content(encodeBinaryMembership(cluster_ids, offset, count), BINARY_CONTENT_TYPE);
+        return;
+    }
 
-    // 高速グループ化処理
-    json result = json::object();
-    int group_id = 1;
-    vector<bool> processed(cartesian_points.size(), false);
-
-    // 進捗表示用
-    const int bar_width = 50;
-    int last_progress = -1;
-    int processed_count = 0;
-
-    cout << "グループ化処理開始..." << endl;
-
-    for (int i = 0; i < cartesian_points.size(); i++) {
-        // 既に他のグループで処理済みの点はスキップ
-        if (processed[i]) continue;
-
-        // 進捗バー表示（処理済み点数ベース）
-        int progress = static_cast<int>(100.0 * processed_count / cartesian_points.size());
-        if (progress != last_progress && (progress % 5 == 0)) {
-            int pos = bar_width * progress / 100;
-            cout << "\r[";
-            for (int j = 0; j < bar_width; ++j) {
-                if (j < pos) cout << "=";
-                else if (j == pos) cout << ">";
-                else cout << " ";
-            }
-            cout << "] " << progress << "% (" << processed_count << "/" << cartesian_points.size() << ")";
-            cout.flush();
-            last_progress = progress;
-        }
+    json response = {
+        {"status", "success"},
+        {"cluster_ids", vector<int32_t>(cluster_ids.begin() + offset, cluster_ids.begin() + offset + count)},
+        {"offset", offset},
+        {"count", count},
+        {"total_count", total},
+        {"next_offset", next_offset < total ? json(next_offset) : json(nullptr)}
+    };
+    response.update(details);
+    res.set_content(response.dump(), "application/json");
+}
+
+/**
+ * 集約リクエストの処理中の例外をエラー応答に変換（catch 節の中で呼び出すこと）
+ * エラー応答にはボディを含めず、サイズと解析に失敗した位置のみを返す
+ */
+void sendRequestError(const httplib::Request& req, httplib::Response& res, const string& endpoint) {
+    bool binary_request = isBinaryRequest(req);
+    try {
+        throw;
+    } catch (const nlohmann::json::parse_error& e) {
+        sendError(res, 400, endpoint, "json_exception", e.what(),
+                  {{"request_size", req.body.size()}, {"byte_offset", e.byte}});
+    } catch (const nlohmann::json::exception& e) {
+        sendError(res, 400, endpoint, "json_exception", e.what(),
+                  {{"request_size", req.body.size()}});
+    } catch (const std::exception& e) {
+        sendError(res, 400, endpoint, "std_exception", e.what(),
+                  {{"request_size", req.body.size()}, {"binary", binary_request}});
+    } catch (...) {
+        sendError(res, 400, endpoint, "unknown_exception", "unknown error",
+                  {{"request_size", req.body.size()}, {"binary", binary_request}});
+    }
+}
+
+// MARK: 非同期ジョブ
 
-                // 候補点取得を高速化（既に処理済みの点は除外）
-        vector<int> candidates = spatial_index.getCandidates(cartesian_points[i], radius_meters);
-        vector<Point2D> group_points;
-        vector<int> group_indices;
+// 完了してからこの時間が過ぎたジョブは破棄する
+const chrono::seconds JOB_TTL(3600);
 
-        // メモリ予約でパフォーマンス向上
-        group_points.reserve(candidates.size());
-        group_indices.reserve(candidates.size());
+enum class JobState {
+    Queued,
+    Running,
+    Done,
+    Failed
+};
 
-        // 平方距離で比較して高速化
-        double radius_squared = radius_meters * radius_meters;
+const char* jobStateName(JobState state) {
+    switch (state) {
+        case JobState::Queued: return "queued";
+        case JobState::Running: return "running";
+        case JobState::Done: return "done";
+        case JobState::Failed: return "failed";
+    }
+    return "unknown";
+}
 
-        for (int j : candidates) {
-            if (processed[j]) continue;  // 既に処理済みの点は除外
+// 集約ジョブ（進捗は処理中もロックなしで読める）
+struct AggregationJob {
+    mutex mtx;
+    JobState state = JobState::Queued;
+    AggregateRequest request;
+    ClusterProgress progress;
+    shared_ptr<const AggregationResult> result;
+    string points_digest;
+    bool cache_hit = false;
+    RequestTimings timings;  // 投入時の解析と集約のフェーズごとの処理時間
+    size_t input_count = 0;
+    bool membership = false;
+    string error;
+    chrono::steady_clock::time_point submitted_at = chrono::steady_clock::now();
+    chrono::steady_clock::time_point started_at;
+    chrono::steady_clock::time_point finished_at;
+};
 
-            double distance_squared = calculateDistanceSquared(cartesian_points[i], cartesian_points[j]);
-            if (distance_squared <= radius_squared) {
-                group_points.push_back(cartesian_points[j]);
-                group_indices.push_back(j);
+/**
+ * 集約ジョブのキューとワーカースレッド
+ * num_workers 個のジョブを同時に処理し、残りは投入順に待機する
+ */
+class JobManager {
+private:
+    mutex mtx_;
+    condition_variable cv_;
+    deque<shared_ptr<AggregationJob>> queue_;
+    unordered_map<string, shared_ptr<AggregationJob>> jobs_;
+    vector<thread> workers_;
+    bool stopping_ = false;
+    mt19937_64 rng_;
+    chrono::seconds ttl_;
+    shared_ptr<ResultCache> cache_;
+    shared_ptr<ServerMetrics> metrics_;
+
+    void evictExpired() {
+        auto now = chrono::steady_clock::now();
+        for (auto it = jobs_.begin(); it != jobs_.end();) {
+            lock_guard<mutex> job_lock(it->second->mtx);
+            bool finished = it->second->state == JobState::Done || it->second->state == JobState::Failed;
+            if (finished && now - it->second->finished_at > ttl_) {
+                it = jobs_.erase(it);
+            } else {
+                ++it;
             }
         }
+    }
 
-        if (group_points.empty()) {
-            processed[i] = true;
-            processed_count++;
-            continue;
+    void workerLoop() {
+        while (true) {
+            shared_ptr<AggregationJob> job;
+            {
+                unique_lock<mutex> lock(mtx_);
+                cv_.wait(lock, [this] { return stopping_ || !queue_.empty(); });
+                if (stopping_) return;
+                job = queue_.front();
+                queue_.pop_front();
+            }
+            run(*job);
         }
+    }
 
-        // グループ内の全ての点を処理済みとしてマーク
-        for (int idx : group_indices) {
-            processed[idx] = true;
-            processed_count++;
+    void run(AggregationJob& job) {
+        AggregateRequest request;
+        {
+            lock_guard<mutex> lock(job.mtx);
+            job.state = JobState::Running;
+            job.started_at = chrono::steady_clock::now();
+            request = move(job.request);
         }
 
-        // 重心計算
-        Point2D centroid;
-        if (group_points.size() >= 3) {
-            vector<Point2D> hull = computeConvexHull(group_points);
-            if (!hull.empty()) {
-                centroid = computeCentroid(hull);
-            } else {
-                centroid = computeCentroid(group_points);
-            }
+        cout << "ジョブ開始: " << request.points.size() << " ポイント" << endl;
+        try {
+            CachedAggregation aggregation = aggregateWithCache(*cache_, request.points, request.radius, request.mode,
+                                                               request.threads, request.membership, &job.progress);
+
+            lock_guard<mutex> lock(job.mtx);
+            if (cache_->enabled()) job.timings.add("cache_lookup", aggregation.lookup_seconds);
+            if (!aggregation.cache_hit) job.timings.addClusterPhases(job.progress);
+            metrics_->recordAggregation(job.timings, job.input_count, aggregation.result->centroids.size(),
+                                        aggregation.cache_hit);
+            job.result = move(aggregation.result);
+            job.points_digest = aggregation.digest;
+            job.cache_hit = aggregation.cache_hit;
+            job.state = JobState::Done;
+            job.finished_at = chrono::steady_clock::now();
+        } catch (const std::exception& e) {
+            lock_guard<mutex> lock(job.mtx);
+            job.error = e.what();
+            job.state = JobState::Failed;
+            job.finished_at = chrono::steady_clock::now();
+        }
+    }
+
+public:
+    JobManager(int num_workers, chrono::seconds ttl, shared_ptr<ResultCache> cache, shared_ptr<ServerMetrics> metrics)
+        : rng_(random_device{}()), ttl_(ttl), cache_(move(cache)), metrics_(move(metrics)) {
+        for (int i = 0; i < num_workers; i++) {
+            workers_.emplace_back([this] { workerLoop(); });
+        }
+    }
+
+    ~JobManager() {
+        {
+            lock_guard<mutex> lock(mtx_);
+            stopping_ = true;
+        }
+        cv_.notify_all();
+        for (auto& worker : workers_) worker.join();
+    }
+
+    pair<string, shared_ptr<AggregationJob>> submit(AggregateRequest&& request, double parse_seconds) {
+        auto job = make_shared<AggregationJob>();
+        job->timings.add("parse", parse_seconds);
+        job->input_count = request.points.size();
+        job->membership = request.membership;
+        job->request = move(request);
+
+        string id;
+        {
+            lock_guard<mutex> lock(mtx_);
+            evictExpired();
+            do {
+                id = generateId(rng_);
+            } while (jobs_.count(id));
+            jobs_[id] = job;
+            queue_.push_back(job);
+        }
+        cv_.notify_one();
+        return {id, job};
+    }
+
+    shared_ptr<AggregationJob> find(const string& id) {
+        lock_guard<mutex> lock(mtx_);
+        auto it = jobs_.find(id);
+        return it == jobs_.end() ? nullptr : it->second;
+    }
+
+    // 待機中のジョブの前に並んでいるジョブ数（待機中でなければ0）
+    size_t queuePosition(const shared_ptr<AggregationJob>& job) {
+        lock_guard<mutex> lock(mtx_);
+        auto it = find_if(queue_.begin(), queue_.end(), [&job](const auto& queued) { return queued == job; });
+        return it == queue_.end() ? 0 : static_cast<size_t>(it - queue_.begin());
+    }
+
+    // ジョブを破棄（待機中ならキューからも外す。実行中のジョブは完了後に結果を捨てる）
+    bool remove(const string& id) {
+        lock_guard<mutex> lock(mtx_);
+        auto it = jobs_.find(id);
+        if (it == jobs_.end()) return false;
+        queue_.erase(remove_if(queue_.begin(), queue_.end(), [&it](const auto& queued) { return queued == it->second; }),
+                     queue_.end());
+        jobs_.erase(it);
+        return true;
+    }
+
+    int workerCount() const { return static_cast<int>(workers_.size()); }
+
+    size_t queueDepth() {
+        lock_guard<mutex> lock(mtx_);
+        return queue_.size();
+    }
+};
+
+/**
+ * ジョブの状態をJSONに変換（ジョブのロック取得済みで呼び出すこと）
+ */
+json jobStatusToJson(const string& id, const AggregationJob& job, size_t queue_position) {
+    json status = {
+        {"status", "success"},
+        {"job_id", id},
+        {"state", jobStateName(job.state)},
+        {"phase", clusterPhaseName(job.progress.currentPhase())},
+        {"phase_fraction", job.progress.phaseFraction()},
+        {"fraction", job.progress.overallFraction()},
+        {"input_count", job.input_count}
+    };
+
+    auto now = chrono::steady_clock::now();
+    if (job.state == JobState::Queued) {
+        status["queue_position"] = queue_position;
+        status["elapsed_seconds"] = 0.0;
+    } else {
+        auto end = job.state == JobState::Running ? now : job.finished_at;
+        status["elapsed_seconds"] = chrono::duration<double>(end - job.started_at).count();
+    }
+    if (job.state == JobState::Done) {
+        status["output_count"] = job.result->centroids.size();
+        status["membership"] = job.membership;
+        status["cache_hit"] = job.cache_hit;
+        status["points_digest"] = job.points_digest;
+        status["timings_ms"] = job.timings.toJson();
+    }
+    if (job.state == JobState::Failed) {
+        status["error"] = job.error;
+    }
+    return status;
+}
+
+/**
+ * 逐次モードとタイル並列モードの速度比較（合成データ）
+ *
+ * 都市部の密集地と郊外を模した合成データを生成し、各モードの処理時間と
+ * タイル並列モードの結果がスレッド数によらず一致することを確認する。
+ */
+int runBenchmark(size_t num_points, double radius_meters, int max_threads) {
+    // 決定的な乱数で合成データを生成（10個の密集地 + 一様な郊外）
+    mt19937_64 rng(42);
+    normal_distribution<double> urban(0.0, 0.02);
+    uniform_real_distribution<double> suburb(-0.5, 0.5);
+    uniform_real_distribution<double> center(-0.4, 0.4);
+
+    vector<pair<double, double>> cores;
+    for (int c = 0; c < 10; c++) cores.emplace_back(139.7 + center(rng), 35.7 + center(rng));
+
+    vector<Point> points;
+    points.reserve(num_points);
+    for (size_t i = 0; i < num_points; i++) {
+        double lon, lat;
+        if (i % 10 < 7) {
+            const auto& core = cores[i % cores.size()];
+            lon = core.first + urban(rng);
+            lat = core.second + urban(rng);
         } else {
-            centroid = computeCentroid(group_points);
+            lon = 139.7 + suburb(rng);
+            lat = 35.7 + suburb(rng);
         }
+        points.emplace_back(lon, lat, static_cast<int>(i + 1));
+    }
 
-        Point geographic_centroid = convertToGeographic(centroid, ref_lon, ref_lat);
+    auto measure = [&](ClusteringMode mode, int num_threads, vector<Point>& out) {
+        auto start = chrono::high_resolution_clock::now();
+        out = clusterPoints(points, radius_meters, mode, num_threads);
+        auto end = chrono::high_resolution_clock::now();
+        return chrono::duration<double>(end - start).count();
+    };
+
+    vector<Point> serial_result;
+    double serial_sec = measure(ClusteringMode::Serial, 1, serial_result);
+
+    vector<pair<int, double>> tiled_times;
+    vector<Point> reference;
+    bool deterministic = true;
+    for (int num_threads = 1; ; num_threads = min(num_threads * 2, max_threads)) {
+        vector<Point> tiled_result;
+        double sec = measure(ClusteringMode::Tiled, num_threads, tiled_result);
+        tiled_times.emplace_back(num_threads, sec);
+
+        if (reference.empty()) {
+            reference = tiled_result;
+        } else if (tiled_result.size() != reference.size()) {
+            deterministic = false;
+        } else {
+            for (size_t g = 0; g < reference.size(); g++) {
+                if (tiled_result[g].lon != reference[g].lon || tiled_result[g].lat != reference[g].lat) {
+                    deterministic = false;
+                    break;
+                }
+            }
+        }
+        if (num_threads >= max_threads) break;
+    }
 
-        // 結果を格納
-        result[to_string(group_id)] = {
-            {"oid", group_id},
-            {"lon", geographic_centroid.lon},
-            {"lat", geographic_centroid.lat}
-        };
-        group_id++;
+    cout << endl << "=== ベンチマーク結果 (" << num_points << " ポイント, 半径 " << radius_meters << "m) ===" << endl;
+    cout << "serial          : " << serial_sec << " 秒, グループ数 " << serial_result.size() << endl;
+    for (const auto& entry : tiled_times) {
+        cout << "tiled (" << entry.first << " スレッド): " << entry.second << " 秒, 速度比 "
+             << serial_sec / entry.second << "x, グループ数 " << reference.size() << endl;
     }
+    cout << "tiled の結果はスレッド数によらず一致: " << (deterministic ? "はい" : "いいえ") << endl;
+
+    return deterministic ? 0 : 1;
+}
 
-    // 100%表示
-    cout << "\r[";
-    for (int j = 0; j < bar_width; ++j) cout << "=";
-    cout << "] 100% (" << cartesian_points.size() << "/" << cartesian_points.size() << ")" << endl;
+// サーバーの起動オプション
+struct ServerOptions {
+    int port = 8080;
+    int workers = 2;         // 同時に処理する集約ジョブ数
+    int http_threads = 16;   // HTTPリクエストを処理するスレッド数
+    size_t cache_mb = 512;   // 結果キャッシュの上限（MB、0 で無効）
+};
 
-    auto end_time = chrono::high_resolution_clock::now();
-    auto duration = chrono::duration_cast<chrono::milliseconds>(end_time - start_time);
+/**
+ * 環境変数の整数値を取得（未設定なら default_value）
+ */
+int getEnvInt(const char* name, int default_value) {
+    const char* value = getenv(name);
+    return (value && *value) ? stoi(value) : default_value;
+}
 
-    return result;
+/**
+ * 起動オプションを解析（環境変数 AGGREGATION_PORT / AGGREGATION_WORKERS / AGGREGATION_HTTP_THREADS /
+ * AGGREGATION_CACHE_MB、コマンドライン引数 --port / --workers / --http-threads / --cache-mb の順に上書き）
+ */
+ServerOptions parseServerOptions(int argc, char* argv[]) {
+    ServerOptions options;
+    options.port = getEnvInt("AGGREGATION_PORT", options.port);
+    options.workers = getEnvInt("AGGREGATION_WORKERS", options.workers);
+    options.http_threads = getEnvInt("AGGREGATION_HTTP_THREADS", options.http_threads);
+    options.cache_mb = static_cast<size_t>(max(0, getEnvInt("AGGREGATION_CACHE_MB", static_cast<int>(options.cache_mb))));
+
+    for (int i = 1; i < argc; i++) {
+        string arg = argv[i];
+        if (i + 1 >= argc) {
+            throw invalid_argument("オプションの値がありません: " + arg);
+        }
+        if (arg == "--port") {
+            options.port = stoi(argv[++i]);
+        } else if (arg == "--workers") {
+            options.workers = stoi(argv[++i]);
+        } else if (arg == "--http-threads") {
+            options.http_threads = stoi(argv[++i]);
+        } else if (arg == "--cache-mb") {
+            options.cache_mb = stoull(argv[++i]);
+        } else {
+            throw invalid_argument("不明なオプションです: " + arg);
+        }
+    }
+
+    options.workers = max(1, options.workers);
+    options.http_threads = max(1, options.http_threads);
+    return options;
 }
 
-int main() {
+int main(int argc, char* argv[]) {
+    // ベンチマークモード: ./aggregation_server --benchmark [ポイント数] [半径] [最大スレッド数]
+    if (argc >= 2 && string(argv[1]) == "--benchmark") {
+        size_t num_points = argc >= 3 ? stoull(argv[2]) : 5000000;
+        double radius = argc >= 4 ? stod(argv[3]) : 100.0;
+        int max_threads = resolveThreadCount(argc >= 5 ? stoi(argv[4]) : 0);
+        return runBenchmark(num_points, radius, max_threads);
+    }
+
+    // サーバーモード: ./aggregation_server [--port 8080] [--workers 2] [--http-threads 16] [--cache-mb 512]
+    ServerOptions options;
+    try {
+        options = parseServerOptions(argc, argv);
+    } catch (const std::exception& e) {
+        cerr << "起動オプションが不正です: " << e.what() << endl;
+        return 2;
+    }
+
     httplib::Server server;
 
     // CORS設定
     server.set_pre_routing_handler([](const httplib::Request& req, httplib::Response& res) {
         res.set_header("Access-Control-Allow-Origin", "*");
-        res.set_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS");
+        res.set_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS");
         res.set_header("Access-Control-Allow-Headers", "Content-Type");
         return httplib::Server::HandlerResponse::Unhandled;
     });
@@ -448,84 +1442,498 @@ int main() {
         return;
     });
 
+    // MARK: メトリクス
+    //   GET /metrics    Prometheus 形式（リクエスト数・転送量・フェーズごとの処理時間・入出力点数・キャッシュ・ジョブ）
+    auto metrics = make_shared<ServerMetrics>();
+    server.set_logger([metrics](const httplib::Request& req, const httplib::Response& res) {
+        metrics->recordRequest(req, res);
+    });
+
     // ヘルスチェックエンドポイント
     server.Get("/health", [](const httplib::Request&, httplib::Response& res) {
         res.set_content("{\"status\": \"ok\"}", "application/json");
     });
 
+    // MARK: 結果キャッシュ
+    //   GET    /cache                                       件数・使用量・ヒット率
+    //   DELETE /cache                                       キャッシュを空にする
+    //   GET    /cache/{digest}?radius=R&mode=M               集約済みかどうか（なければ404）
+    //   GET    /cache/{digest}/results?radius=R&mode=M       集約結果をページ単位で取得（offset, limit）
+    //   GET    /cache/{digest}/membership?radius=R&mode=M    入力点ごとの所属グループをページ単位で取得（offset, limit）
+    // digest は入力点の SHA-256（pointsDigest と同じ計算）。/aggregate・セッション・ジョブの結果を共有する
+    auto cache = make_shared<ResultCache>(options.cache_mb * 1024 * 1024);
+
+    // キャッシュ済みの結果を取得（なければ404を返して nullptr）
+    auto findCached = [cache](const string& endpoint, const httplib::Request& req, httplib::Response& res) {
+        const string digest = req.matches[1];
+        shared_ptr<const AggregationResult> result;
+        try {
+            if (!req.has_param("radius")) {
+                throw runtime_error("radius パラメータが存在しません");
+            }
+            double radius = stod(req.get_param_value("radius"));
+            ClusteringMode mode = parseClusteringMode(req.has_param("mode") ? req.get_param_value("mode") : string("serial"));
+            // 問い合わせ時だけヒット率に数える（ページ取得はヒット後の続き）
+            result = cache->find(ResultCache::makeKey(digest, radius, mode), endpoint == "cache endpoint");
+        } catch (const std::exception& e) {
+            sendError(res, 400, endpoint, "std_exception", e.what(), {{"points_digest", digest}});
+            return result;
+        }
+        if (!result) {
+            sendError(res, 404, endpoint, "cache_miss", "キャッシュに集約結果がありません", {{"points_digest", digest}});
+        }
+        return result;
+    };
+
+    server.Get("/cache", [cache](const httplib::Request&, httplib::Response& res) {
+        json response = cache->stats();
+        response["status"] = "success";
+        res.set_content(response.dump(), "application/json");
+    });
+
+    server.Delete("/cache", [cache](const httplib::Request&, httplib::Response& res) {
+        cache->clear();
+        res.set_content("{\"status\": \"success\"}", "application/json");
+    });
+
+    server.Get(R"(/cache/([0-9a-f]{64}))", [findCached](const httplib::Request& req, httplib::Response& res) {
+        auto result = findCached("cache endpoint", req, res);
+        if (!result) return;
+
+        json response = {
+            {"status", "success"},
+            {"points_digest", req.matches[1]},
+            {"input_count", result->input_count},
+            {"output_count", result->centroids.size()}
+        };
+        res.set_content(response.dump(), "application/json");
+    });
+
+    server.Get(R"(/cache/([0-9a-f]{64})/results)", [findCached](const httplib::Request& req, httplib::Response& res) {
+        auto result = findCached("cache results endpoint", req, res);
+        if (!result) return;
+
+        try {
+            sendCentroidPage(req, res, "cache results endpoint", result->centroids,
+                             {{"points_digest", req.matches[1]}, {"input_count", result->input_count}});
+        } catch (const std::exception& e) {
+            sendError(res, 400, "cache results endpoint", "std_exception", e.what());
+        }
+    });
+
+    server.Get(R"(/cache/([0-9a-f]{64})/membership)", [findCached](const httplib::Request& req, httplib::Response& res) {
+        auto result = findCached("cache membership endpoint", req, res);
+        if (!result) return;
+
+        try {
+            sendMembershipPage(req, res, "cache membership endpoint", result->cluster_ids,
+                               {{"points_digest", req.matches[1]}});
+        } catch (const std::exception& e) {
+            sendError(res, 400, "cache membership endpoint", "std_exception", e.what());
+        }
+    });
+
     // ポイント集約エンドポイント
-    server.Post("/aggregate", [](const httplib::Request& req, httplib::Response& res) {
+    // Content-Type: application/x-aggregation-binary の場合はバイナリ形式で受け取り、
+    // Accept に同じ型が含まれる場合はバイナリ形式で返す（それ以外はJSON）
+    server.Post("/aggregate", [cache, metrics](const httplib::Request& req, httplib::Response& res) {
         try {
-            // JSONデータを解析
-            json request_data = json::parse(req.body);
+            RequestTimings timings;
+            auto parse_start = chrono::steady_clock::now();
+            AggregateRequest request = parseAggregateRequest(req);
+            timings.add("parse", secondsSince(parse_start));
+            const vector<Point>& points = request.points;
+            bool with_membership = request.membership;
+
+            // 集約処理を実行（同じ入力・半径・モードの結果がキャッシュにあればそれを使う）
+            cout << "集約対象ポイント数: " << points.size() << endl;
+            ClusterProgress progress;
+            CachedAggregation aggregation = aggregateWithCache(*cache, points, request.radius, request.mode,
+                                                               request.threads, with_membership, &progress);
+            const vector<Point>& centroids = aggregation.result->centroids;
+            if (cache->enabled()) timings.add("cache_lookup", aggregation.lookup_seconds);
+            if (!aggregation.cache_hit) timings.addClusterPhases(progress);
+
+            auto serialization_start = chrono::steady_clock::now();
+            string body;
+            string content_type;
+            if (acceptsBinary(req)) {
+                // 所属グループは集約結果の後ろに続けて返す
+                body = encodeBinaryCentroids(centroids);
+                if (with_membership) {
+                    body += encodeBinaryMembership(aggregation.result->cluster_ids);
+                }
+                content_type = BINARY_CONTENT_TYPE;
 
-            vector<Point> points;
-            double radius = request_data.at("radius"); // 半径（メートル）ない場合は例外を投げる
-
-            // ポイントデータを抽出
-            if (request_data.contains("points")) {
-                for (const auto& point_data : request_data["points"]) {
-                    int oid = point_data.value("oid", 0);
-                    double lon = point_data.value("lon", 0.0);
-                    double lat = point_data.value("lat", 0.0);
-                    points.emplace_back(lon, lat, oid);
+                res.set_header("X-Input-Count", to_string(points.size()));
+                res.set_header("X-Output-Count", to_string(centroids.size()));
+                res.set_header("X-Cache", aggregation.cache_hit ? "hit" : "miss");
+                if (!aggregation.digest.empty()) {
+                    res.set_header("X-Points-Digest", aggregation.digest);
                 }
             } else {
-                throw runtime_error("ポイントデータが存在しません");
+                // レスポンスを作成（グループIDは1から）
+                json response = {
+                    {"status", "success"},
+                    {"aggregated_points", centroidsToJson(centroids, 0, centroids.size())},
+                    {"input_count", points.size()},
+                    {"output_count", centroids.size()},
+                    {"cache_hit", aggregation.cache_hit},
+                    {"points_digest", aggregation.digest}
+                };
+                if (with_membership) {
+                    response["membership"] = membershipToJson(aggregation.result->cluster_ids, centroids.size());
+                }
+                body = response.dump();
+                content_type = "application/json";
+            }
+            timings.add("serialization", secondsSince(serialization_start));
+
+            // 処理時間はヘッダー（バイナリ・JSON共通）と、JSONの場合は timings_ms にも返す
+            // （シリアライズの時間を含めるため、生成済みのJSONの先頭に差し込む）
+            if (content_type == "application/json") {
+                body.insert(1, "\"timings_ms\":" + timings.toJson().dump() + ",");
             }
+            res.set_header("Server-Timing", timings.serverTiming());
+            res.set_content(body, content_type);
+            metrics->recordAggregation(timings, points.size(), centroids.size(), aggregation.cache_hit);
+
+        } catch (...) {
+            sendRequestError(req, res, "aggregate endpoint");
+        }
+    });
 
-            // 集約処理を実行
-            json result = aggregatePoints(points, radius);
+    // MARK: アップロードセッション
+    //   POST   /sessions                         セッションを開始
+    //   POST   /sessions/{id}/chunks?offset=N    バイナリ形式 (AGP1) のチャンクを追加（compression=gzip/zstd で圧縮可）
+    //   POST   /sessions/{id}/finalize           集約を実行（radius, mode, threads はクエリ文字列）
+    //   GET    /sessions/{id}/results            集約結果をページ単位で取得（offset, limit）
+    //   GET    /sessions/{id}/membership         入力点ごとの所属グループをページ単位で取得（offset, limit）
+    //   DELETE /sessions/{id}                    セッションを破棄
+    auto sessions = make_shared<SessionStore>(SESSION_TTL);
+
+    // セッションを取得（存在しなければ404を返して nullptr）
+    auto findSession = [sessions](const string& endpoint, const string& id, httplib::Response& res) {
+        auto session = sessions->find(id);
+        if (!session) {
+            sendError(res, 404, endpoint, "session_not_found", "セッションが存在しません", {{"session_id", id}});
+        }
+        return session;
+    };
+
+    server.Post("/sessions", [sessions](const httplib::Request& req, httplib::Response& res) {
+        try {
+            auto created = sessions->create();
+            // 全体の点数が分かっている場合は事前に確保
+            size_t expected_count = getSizeParam(req, "expected_count", 0);
+            if (expected_count > 0) {
+                created.second->points.reserve(expected_count);
+            }
 
-            // レスポンスを作成
             json response = {
                 {"status", "success"},
-                {"aggregated_points", result},
-                {"input_count", points.size()},
-                {"output_count", result.size()}
+                {"session_id", created.first},
+                {"ttl_seconds", sessions->ttl().count()}
             };
+            res.status = 201;
+            res.set_content(response.dump(), "application/json");
+        } catch (const std::exception& e) {
+            sendError(res, 400, "sessions endpoint", "std_exception", e.what());
+        }
+    });
+
+    server.Post(R"(/sessions/([0-9a-f]+)/chunks)", [findSession, metrics](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        auto session = findSession("chunks endpoint", id, res);
+        if (!session) return;
+
+        size_t offset = 0;
+        size_t decoded_size = 0;
+        string compression = req.has_param("compression") ? req.get_param_value("compression") : string("none");
+        try {
+            if (!req.has_param("offset")) {
+                throw runtime_error("offset パラメータが存在しません");
+            }
+            offset = getSizeParam(req, "offset", 0);
 
+            // 展開と解析はセッションのロック外で行う
+            auto parse_start = chrono::steady_clock::now();
+            string decoded;
+            const string& chunk = decompressChunk(req.body, compression, decoded);
+            decoded_size = chunk.size();
+            vector<Point> points;
+            size_t count = appendBinaryPoints(chunk.data(), chunk.size(), points);
+            metrics->recordPhase("parse", secondsSince(parse_start));
+
+            lock_guard<mutex> lock(session->mtx);
+            session->last_access = chrono::steady_clock::now();
+            size_t received = session->input_count;
+
+            if (session->finalized) {
+                sendError(res, 409, "chunks endpoint", "session_finalized", "集約済みのセッションには追加できません",
+                          {{"session_id", id}, {"received_count", received}});
+                return;
+            }
+
+            bool duplicate = false;
+            if (offset == received) {
+                session->points.insert(session->points.end(), points.begin(), points.end());
+                session->input_count = session->points.size();
+                session->chunk_count++;
+                session->received_bytes += req.body.size();
+            } else if (offset + count <= received) {
+                // 再送されたチャンク（受信済みなので追加しない）
+                duplicate = true;
+            } else {
+                sendError(res, 409, "chunks endpoint", "offset_mismatch", "チャンクのオフセットが受信済みの点数と一致しません",
+                          {{"session_id", id}, {"offset", offset}, {"chunk_points", count},
+                           {"expected_offset", received}});
+                return;
+            }
+
+            json response = {
+                {"status", "success"},
+                {"session_id", id},
+                {"offset", offset},
+                {"chunk_points", count},
+                {"received_count", session->input_count},
+                {"duplicate", duplicate}
+            };
             res.set_content(response.dump(), "application/json");
+        } catch (const std::exception& e) {
+            sendError(res, 400, "chunks endpoint", "std_exception", e.what(),
+                      {{"session_id", id}, {"offset", offset}, {"compression", compression},
+                       {"request_size", req.body.size()}, {"decoded_size", decoded_size}});
+        }
+    });
+
+    server.Post(R"(/sessions/([0-9a-f]+)/finalize)", [findSession, cache, metrics](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        auto session = findSession("finalize endpoint", id, res);
+        if (!session) return;
+
+        try {
+            lock_guard<mutex> lock(session->mtx);
+            session->last_access = chrono::steady_clock::now();
+
+            // 再送された finalize には集約済みの結果をそのまま返す
+            if (!session->finalized) {
+                if (!req.has_param("radius")) {
+                    throw runtime_error("radius パラメータが存在しません");
+                }
+                double radius = stod(req.get_param_value("radius"));
+                ClusteringMode mode = parseClusteringMode(req.has_param("mode") ? req.get_param_value("mode") : string("serial"));
+                int threads = req.has_param("threads") ? stoi(req.get_param_value("threads")) : 0;
+
+                cout << "集約対象ポイント数: " << session->points.size()
+                     << " (セッション " << id << ", チャンク " << session->chunk_count << ")" << endl;
+                ClusterProgress progress;
+                CachedAggregation aggregation = aggregateWithCache(*cache, session->points, radius, mode, threads, true,
+                                                                   &progress);
+                if (cache->enabled()) session->timings.add("cache_lookup", aggregation.lookup_seconds);
+                if (!aggregation.cache_hit) session->timings.addClusterPhases(progress);
+                metrics->recordAggregation(session->timings, session->input_count, aggregation.result->centroids.size(),
+                                           aggregation.cache_hit);
+                session->result = move(aggregation.result);
+                session->points_digest = aggregation.digest;
+                session->cache_hit = aggregation.cache_hit;
+                session->finalized = true;
+                // 集約後は入力を保持しない
+                vector<Point>().swap(session->points);
+                session->last_access = chrono::steady_clock::now();
+            }
 
-        } catch (const nlohmann::json::exception& e) {
-            cerr << "[aggregate endpoint][JSON例外] " << e.what() << endl;
-            cerr << "  リクエストボディ: " << req.body << endl;
-            json error_response = {
-                {"status", "error"},
-                {"type", "json_exception"},
-                {"message", e.what()},
-                {"request_body", req.body}
+            json response = {
+                {"status", "success"},
+                {"session_id", id},
+                {"input_count", session->input_count},
+                {"output_count", session->result->centroids.size()},
+                {"cache_hit", session->cache_hit},
+                {"points_digest", session->points_digest},
+                {"timings_ms", session->timings.toJson()}
             };
-            res.status = 400;
-            res.set_content(error_response.dump(), "application/json");
+            res.set_content(response.dump(), "application/json");
+        } catch (const std::exception& e) {
+            sendError(res, 400, "finalize endpoint", "std_exception", e.what(), {{"session_id", id}});
+        }
+    });
+
+    server.Get(R"(/sessions/([0-9a-f]+)/results)", [findSession](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        auto session = findSession("results endpoint", id, res);
+        if (!session) return;
+
+        try {
+            lock_guard<mutex> lock(session->mtx);
+            session->last_access = chrono::steady_clock::now();
+            if (!session->finalized) {
+                sendError(res, 409, "results endpoint", "session_not_finalized", "セッションはまだ集約されていません",
+                          {{"session_id", id}, {"received_count", session->input_count}});
+                return;
+            }
+
+            sendCentroidPage(req, res, "results endpoint", session->result->centroids, {{"session_id", id}});
+        } catch (const std::exception& e) {
+            sendError(res, 400, "results endpoint", "std_exception", e.what(), {{"session_id", id}});
+        }
+    });
+
+    server.Get(R"(/sessions/([0-9a-f]+)/membership)", [findSession](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        auto session = findSession("membership endpoint", id, res);
+        if (!session) return;
+
+        try {
+            lock_guard<mutex> lock(session->mtx);
+            session->last_access = chrono::steady_clock::now();
+            if (!session->finalized) {
+                sendError(res, 409, "membership endpoint", "session_not_finalized", "セッションはまだ集約されていません",
+                          {{"session_id", id}, {"received_count", session->input_count}});
+                return;
+            }
+
+            // 入力点の順に所属グループを返す
+            sendMembershipPage(req, res, "membership endpoint", session->result->cluster_ids, {{"session_id", id}});
         } catch (const std::exception& e) {
-            cerr << "[aggregate endpoint][std::exception] " << e.what() << endl;
-            cerr << "  リクエストボディ: " << req.body << endl;
-            json error_response = {
-                {"status", "error"},
-                {"type", "std_exception"},
-                {"message", e.what()},
-                {"request_body", req.body}
+            sendError(res, 400, "membership endpoint", "std_exception", e.what(), {{"session_id", id}});
+        }
+    });
+
+    server.Delete(R"(/sessions/([0-9a-f]+))", [sessions](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        if (!sessions->remove(id)) {
+            sendError(res, 404, "sessions endpoint", "session_not_found", "セッションが存在しません", {{"session_id", id}});
+            return;
+        }
+        res.set_content("{\"status\": \"success\"}", "application/json");
+    });
+
+    // MARK: 非同期ジョブ
+    //   POST   /jobs                    集約ジョブを投入（ボディとパラメータは /aggregate と同じ）。202 と job_id を返す
+    //   GET    /jobs/{id}               状態・フェーズ・進捗率を取得
+    //   GET    /jobs/{id}/result        集約結果をページ単位で取得（offset, limit）
+    //   GET    /jobs/{id}/membership    入力点ごとの所属グループをページ単位で取得（membership を指定したジョブのみ）
+    //   DELETE /jobs/{id}               ジョブを破棄
+    auto jobs = make_shared<JobManager>(options.workers, JOB_TTL, cache, metrics);
+
+    // ジョブを取得（存在しなければ404を返して nullptr）
+    auto findJob = [jobs](const string& endpoint, const string& id, httplib::Response& res) {
+        auto job = jobs->find(id);
+        if (!job) {
+            sendError(res, 404, endpoint, "job_not_found", "ジョブが存在しません", {{"job_id", id}});
+        }
+        return job;
+    };
+
+    // 完了したジョブを取得（未完了・失敗なら409を返して nullptr）
+    auto findFinishedJob = [findJob](const string& endpoint, const string& id, httplib::Response& res,
+                                     unique_lock<mutex>& lock) {
+        auto job = findJob(endpoint, id, res);
+        if (!job) return job;
+        lock = unique_lock<mutex>(job->mtx);
+        if (job->state != JobState::Done) {
+            sendError(res, 409, endpoint, "job_not_done", "ジョブはまだ完了していません",
+                      {{"job_id", id}, {"state", jobStateName(job->state)}, {"error", job->error}});
+            return shared_ptr<AggregationJob>();
+        }
+        return job;
+    };
+
+    server.Post("/jobs", [jobs](const httplib::Request& req, httplib::Response& res) {
+        try {
+            auto parse_start = chrono::steady_clock::now();
+            AggregateRequest request = parseAggregateRequest(req);
+            size_t input_count = request.points.size();
+            auto submitted = jobs->submit(move(request), secondsSince(parse_start));
+
+            json response = {
+                {"status", "success"},
+                {"job_id", submitted.first},
+                {"state", jobStateName(JobState::Queued)},
+                {"input_count", input_count},
+                {"queue_position", jobs->queuePosition(submitted.second)}
             };
-            res.status = 400;
-            res.set_content(error_response.dump(), "application/json");
+            res.status = 202;
+            res.set_content(response.dump(), "application/json");
         } catch (...) {
-            cerr << "[aggregate endpoint][unknown exception]" << endl;
-            cerr << "  リクエストボディ: " << req.body << endl;
-            json error_response = {
-                {"status", "error"},
-                {"type", "unknown_exception"},
-                {"message", "unknown error"},
-                {"request_body", req.body}
-            };
-            res.status = 400;
-            res.set_content(error_response.dump(), "application/json");
+            sendRequestError(req, res, "jobs endpoint");
+        }
+    });
+
+    server.Get(R"(/jobs/([0-9a-f]+))", [jobs, findJob](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        auto job = findJob("jobs endpoint", id, res);
+        if (!job) return;
+
+        size_t queue_position = jobs->queuePosition(job);
+        lock_guard<mutex> lock(job->mtx);
+        res.set_content(jobStatusToJson(id, *job, queue_position).dump(), "application/json");
+    });
+
+    server.Get(R"(/jobs/([0-9a-f]+)/result)", [findFinishedJob](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        unique_lock<mutex> lock;
+        auto job = findFinishedJob("job result endpoint", id, res, lock);
+        if (!job) return;
+
+        try {
+            sendCentroidPage(req, res, "job result endpoint", job->result->centroids,
+                             {{"job_id", id}, {"input_count", job->input_count}});
+        } catch (const std::exception& e) {
+            sendError(res, 400, "job result endpoint", "std_exception", e.what(), {{"job_id", id}});
+        }
+    });
+
+    server.Get(R"(/jobs/([0-9a-f]+)/membership)", [findFinishedJob](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        unique_lock<mutex> lock;
+        auto job = findFinishedJob("job membership endpoint", id, res, lock);
+        if (!job) return;
+
+        if (!job->membership) {
+            sendError(res, 409, "job membership endpoint", "membership_not_requested",
+                      "membership を指定せずに投入されたジョブです", {{"job_id", id}});
+            return;
+        }
+        try {
+            sendMembershipPage(req, res, "job membership endpoint", job->result->cluster_ids, {{"job_id", id}});
+        } catch (const std::exception& e) {
+            sendError(res, 400, "job membership endpoint", "std_exception", e.what(), {{"job_id", id}});
         }
     });
 
+    server.Delete(R"(/jobs/([0-9a-f]+))", [jobs](const httplib::Request& req, httplib::Response& res) {
+        const string id = req.matches[1];
+        if (!jobs->remove(id)) {
+            sendError(res, 404, "jobs endpoint", "job_not_found", "ジョブが存在しません", {{"job_id", id}});
+            return;
+        }
+        res.set_content("{\"status\": \"success\"}", "application/json");
+    });
+
+    server.Get("/metrics", [metrics, cache, jobs](const httplib::Request&, httplib::Response& res) {
+        string out = metrics->render();
+
+        json cache_stats = cache->stats();
+        appendMetric(out, "aggregation_cache_entries", "gauge", "キャッシュに保持している集約結果の件数", cache_stats["entries"]);
+        appendMetric(out, "aggregation_cache_bytes", "gauge", "キャッシュの使用量（バイト）", cache_stats["used_bytes"]);
+        appendMetric(out, "aggregation_cache_budget_bytes", "gauge", "キャッシュの上限（バイト）", cache_stats["budget_bytes"]);
+        appendMetric(out, "aggregation_cache_hits_total", "counter", "キャッシュのヒット数", cache_stats["hits"]);
+        appendMetric(out, "aggregation_cache_misses_total", "counter", "キャッシュのミス数", cache_stats["misses"]);
+        appendMetric(out, "aggregation_cache_evictions_total", "counter", "上限超過で破棄した件数", cache_stats["evictions"]);
+        appendMetric(out, "aggregation_jobs_queued", "gauge", "待機中のジョブ数", static_cast<double>(jobs->queueDepth()));
+        appendMetric(out, "aggregation_job_workers", "gauge", "ジョブワーカー数", jobs->workerCount());
+
+        res.set_content(out, "text/plain; version=0.0.4; charset=utf-8");
+    });
+
+    // HTTPリクエストを処理するスレッド数（同期の /aggregate や finalize はこのスレッドで集約する）
+    server.new_task_queue = [http_threads = options.http_threads] { return new httplib::ThreadPool(http_threads); };
+
     // サーバーを開始
-    cout << "ポイント集約サーバーを開始しました" << endl;
-    server.listen("0.0.0.0", 8080);
+    cout << "ポイント集約サーバーを開始しました（ポート " << options.port << ", ジョブワーカー " << jobs->workerCount()
+         << ", HTTPスレッド " << options.http_threads << ", キャッシュ " << options.cache_mb << "MB）" << endl;
+    server.listen("0.0.0.0", options.port);
 
     cout << "サーバーが停止しました" << endl;
     return 0;
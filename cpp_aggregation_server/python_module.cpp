@@ -0,0 +1,90 @@
+// ポイント集約のPython拡張モジュール（HTTPサーバーを介さずにプロセス内で集約する）
+//
+//   import aggregation_native
+//   lon, lat = aggregation_native.aggregate(lon, lat, radius_meters=100.0, mode="tiled", threads=0)
+//   lon, lat, cluster_ids, counts = aggregation_native.aggregate(lon, lat, 100.0, return_membership=True)
+//
+// 入力の lon, lat は連続した float64 配列ならコピーせずにそのまま読み、
+// 出力の lon, lat は集約結果のバッファを参照するビュー（コピーなし）として返す。
+// 集約処理の間は GIL を解放する。
+
+#include "aggregation_core.hpp"
+
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+
+#include <memory>
+
+namespace py = pybind11;
+using namespace aggregation;
+
+using CoordinateArray = py::array_t<double, py::array::c_style | py::array::forcecast>;
+
+/**
+ * vector をコピーせずに NumPy 配列として返す（vector の所有権は配列に移る）
+ */
+template <typename T>
+py::array_t<T> vectorToArray(std::vector<T>&& values) {
+    auto* buffer = new std::vector<T>(std::move(values));
+    py::capsule owner(buffer, [](void* p) { delete static_cast<std::vector<T>*>(p); });
+    return py::array_t<T>({static_cast<py::ssize_t>(buffer->size())}, {static_cast<py::ssize_t>(sizeof(T))},
+                          buffer->data(), owner);
+}
+
+/**
+ * 経度・緯度の配列を集約し、グループ（ID は 1 から順）ごとの重心の経度・緯度の配列を返す
+ * return_membership が真なら、入力点ごとのグループID (int32) とグループごとの点数 (int32) も返す
+ */
+py::tuple aggregate(CoordinateArray lon, CoordinateArray lat, double radius_meters,
+                    const std::string& mode, int threads, bool return_membership) {
+    if (lon.ndim() != 1 || lat.ndim() != 1 || lon.shape(0) != lat.shape(0)) {
+        throw std::invalid_argument("lon と lat は同じ長さの1次元配列にしてください: lon " +
+                                    std::to_string(lon.size()) + " 件, lat " + std::to_string(lat.size()) + " 件");
+    }
+    if (!(radius_meters > 0)) {
+        throw std::invalid_argument("radius_meters は正の値にしてください");
+    }
+
+    ClusteringMode clustering_mode = parseClusteringMode(mode);
+    const double* lon_ptr = lon.data();
+    const double* lat_ptr = lat.data();
+    size_t n = static_cast<size_t>(lon.shape(0));
+
+    // 結果はヒープ上のバッファに置き、NumPy 配列が参照している間は capsule で保持する
+    auto centroids = std::make_unique<std::vector<Point>>();
+    ClusterMembership membership;
+    {
+        py::gil_scoped_release release;
+        *centroids = clusterColumns(lon_ptr, lat_ptr, n, radius_meters, clustering_mode, resolveThreadCount(threads),
+                                    return_membership ? &membership : nullptr);
+    }
+
+    std::vector<Point>* buffer = centroids.release();
+    py::capsule owner(buffer, [](void* p) { delete static_cast<std::vector<Point>*>(p); });
+
+    // Point は {lon, lat, oid} の構造体なので、lon・lat はストライド付きのビューになる
+    py::ssize_t count = static_cast<py::ssize_t>(buffer->size());
+    py::ssize_t stride = static_cast<py::ssize_t>(sizeof(Point));
+    const double* base = buffer->empty() ? nullptr : &(*buffer)[0].lon;
+    py::array_t<double> out_lon({count}, {stride}, base, owner);
+    py::array_t<double> out_lat({count}, {stride}, base ? &(*buffer)[0].lat : nullptr, owner);
+    out_lon.attr("flags").attr("writeable") = false;
+    out_lat.attr("flags").attr("writeable") = false;
+
+    if (return_membership) {
+        return py::make_tuple(out_lon, out_lat,
+                              vectorToArray(std::move(membership.cluster_ids)),
+                              vectorToArray(std::move(membership.counts)));
+    }
+    return py::make_tuple(out_lon, out_lat);
+}
+
+PYBIND11_MODULE(aggregation_native, m) {
+    m.doc() = "ポイント集約のコア処理（C++）";
+
+    m.def("aggregate", &aggregate,
+          py::arg("lon"), py::arg("lat"), py::arg("radius_meters"),
+          py::arg("mode") = "serial", py::arg("threads") = 0, py::arg("return_membership") = false,
+          "経度・緯度の配列を半径 radius_meters で集約し、重心の (lon, lat) 配列を返す（i 番目がグループID i + 1）。\n"
+          "return_membership=True なら入力点ごとのグループIDとグループごとの点数も返す");
+}
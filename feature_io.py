@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from point_set import PointSet
+from route_geometry import geometry_from_json
+
+# GeoParquet の読み書きに必要 (pip install pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# FlatGeobuf の読み書きに必要（GDAL を同梱した wheel がある。pip install pyogrio）
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+# 拡張子と形式の対応
+FILE_FORMATS = {'.parquet': 'parquet', '.geoparquet': 'parquet', '.fgb': 'fgb'}
+
+# 入力のOIDとして使う列（見つからなければ1からの連番）
+OID_COLUMNS = ("OID", "OBJECTID", "oid", "objectid", "FID", "fid")
+
+# WKB のジオメトリ種別
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POINT_SIZE = 21  # バイト順1 + 種別4 + 座標 8 × 2
+EWKB_SRID_FLAG = 0x20000000  # 種別のこのビットが立っていると種別の後に SRID (4バイト) が続く
+
+# WGS84 の経度・緯度とみなす座標系
+WGS84_CRS = {('EPSG', '4326'), ('OGC', 'CRS84')}
+
+FIELD_TYPES = ("int32", "int64", "float64")
+
+
+def file_format(path: str) -> str:
+    """拡張子から形式 ("parquet" / "fgb") を判定"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FILE_FORMATS:
+        raise ValueError(f"未対応のファイル形式です: {path}（{', '.join(FILE_FORMATS)}）")
+    fmt = FILE_FORMATS[ext]
+    if fmt == "parquet" and pa is None:
+        raise ImportError("GeoParquet の読み書きには pyarrow が必要です (pip install pyarrow)")
+    if fmt == "fgb" and (pyogrio is None or pa is None):
+        raise ImportError("FlatGeobuf の読み書きには pyogrio と pyarrow が必要です (pip install pyogrio pyarrow)")
+    return fmt
+
+
+# MARK: 読み込み
+def read_points(path: str, oid_column: Optional[str] = None) -> PointSet:
+    """
+    GeoParquet / FlatGeobuf のポイントを PointSet として一括で読み込む
+
+    GeoParquet はメモリマップで開き、ジオメトリ列（WKB またはGeoArrowの point）と OID の列だけを読む。
+    FlatGeobuf は GDAL (pyogrio) で Arrow の列として読む。ジオメトリが空の行は除外する。
+
+    Args:
+        path: 入力ファイル (.parquet / .geoparquet / .fgb)
+        oid_column: OID として使う列（None なら OID_COLUMNS から探し、なければ1からの連番）
+
+    Raises:
+        ValueError: 座標系が WGS84 でない場合、ポイント以外のジオメトリを含む場合
+    """
+    if file_format(path) == "parquet":
+        geometry, oid, crs = _read_geoparquet_columns(path, oid_column)
+    else:
+        geometry, oid, crs = _read_flatgeobuf_columns(path, oid_column)
+
+    if not is_wgs84(crs):
+        raise ValueError(f"{path} の座標系が WGS84 (経度, 緯度) ではありません: {crs}")
+
+    lon, lat, valid = point_columns(geometry)
+    if oid is None:
+        oid = np.arange(1, len(valid) + 1, dtype=np.int64)
+    points = PointSet(oid, lon, lat)
+    return points if valid.all() else points.take(valid)
+
+
+def _find_oid_column(names: Sequence[str], oid_column: Optional[str]) -> Optional[str]:
+    if oid_column is not None:
+        if oid_column not in names:
+            raise ValueError(f"OID の列 {oid_column} がありません（列: {', '.join(names)}）")
+        return oid_column
+    return next((name for name in OID_COLUMNS if name in names), None)
+
+
+def _read_geoparquet_columns(path: str, oid_column: Optional[str]):
+    """GeoParquet のジオメトリ列・OID・座標系（'geo' メタデータの crs、未指定は OGC:CRS84）"""
+    schema = pq.read_schema(path, memory_map=True)
+    geo = json.loads((schema.metadata or {}).get(b'geo', b'{}'))
+    geometry_column = geo.get('primary_column', 'geometry')
+    if geometry_column not in schema.names:
+        raise ValueError(f"{path} にジオメトリ列 {geometry_column} がありません")
+    column_meta = geo.get('columns', {}).get(geometry_column, {})
+    crs = column_meta['crs'] if 'crs' in column_meta else "OGC:CRS84"
+
+    oid_name = _find_oid_column(schema.names, oid_column)
+    columns = [geometry_column] + ([oid_name] if oid_name else [])
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    oid = table[oid_name].to_numpy().astype(np.int64) if oid_name else None
+    return table[geometry_column], oid, crs
+
+
+def _read_flatgeobuf_columns(path: str, oid_column: Optional[str]):
+    """FlatGeobuf のジオメトリ列 (WKB)・OID・座標系"""
+    info = pyogrio.read_info(path)
+    oid_name = _find_oid_column(list(info['fields']), oid_column)
+    meta, table = pyogrio.read_arrow(path, columns=[oid_name] if oid_name else [])
+    geometry_column = meta.get('geometry_name') or "wkb_geometry"
+    oid = table[oid_name].to_numpy().astype(np.int64) if oid_name else None
+    return table[geometry_column], oid, meta.get('crs')
+
+
+def is_wgs84(crs) -> bool:
+    """座標系が WGS84 の経度・緯度か（None は不明として WGS84 とみなす）"""
+    if crs is None:
+        return True
+    if isinstance(crs, dict):
+        # PROJJSON
+        ident = crs.get('id') or {}
+        return (str(ident.get('authority', '')).upper(), str(ident.get('code', ''))) in WGS84_CRS
+    authority, _, code = str(crs).upper().partition(":")
+    return (authority, code) in WGS84_CRS
+
+
+def point_columns(geometry) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ポイントのジオメトリ列から (経度, 緯度, 有効な行) を取り出す
+
+    WKB（バイナリ列）と GeoArrow の point（x, y の構造体）に対応する。WKB は行ごとに解析せず、
+    各行の座標のバイトを NumPy でまとめて取り出す。
+    """
+    if isinstance(geometry, pa.ChunkedArray):
+        chunks = geometry.chunks
+    else:
+        chunks = [geometry]
+    if not chunks:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty, np.empty(0, dtype=bool)
+
+    parts = [_struct_point_columns(chunk) if pa.types.is_struct(chunk.type) else _wkb_point_columns(chunk)
+             for chunk in chunks]
+    return tuple(np.concatenate(values) for values in zip(*parts))
+
+
+def _struct_point_columns(chunk):
+    valid = np.asarray(chunk.is_valid())
+    lon = chunk.field('x').to_numpy(zero_copy_only=False).astype(np.float64)
+    lat = chunk.field('y').to_numpy(zero_copy_only=False).astype(np.float64)
+    return lon, lat, valid & np.isfinite(lon) & np.isfinite(lat)
+
+
+def _wkb_point_columns(chunk):
+    if pa.types.is_large_binary(chunk.type):
+        offset_dtype = np.int64
+    elif pa.types.is_binary(chunk.type):
+        offset_dtype = np.int32
+    else:
+        raise ValueError(f"ジオメトリ列の型に対応していません: {chunk.type}")
+
+    n = len(chunk)
+    _, offsets_buffer, data_buffer = chunk.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=offset_dtype)[chunk.offset:chunk.offset + n + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.empty(0, dtype=np.uint8)
+    starts = offsets[:-1].astype(np.int64)
+
+    # 空のジオメトリ (NULL・長さ0) は除外。ポイント以外は読み込まない
+    valid = np.asarray(chunk.is_valid()) & (np.diff(offsets) >= WKB_POINT_SIZE)
+    lon = np.full(n, np.nan)
+    lat = np.full(n, np.nan)
+    if not valid.any():
+        return lon, lat, valid
+
+    starts = starts[valid]
+    little = data[starts] == 1
+    geometry_type = _gather(data, starts + 1, 4, little).view('<u4').ravel()
+    # ISO WKB の Z/M (1001 など) と EWKB のフラグは種別の判定から除く
+    if np.any((geometry_type & 0x0FFFFFFF) % 1000 != WKB_POINT):
+        raise ValueError("ポイント以外のジオメトリが含まれています")
+
+    # EWKB (PostGIS など) で SRID のフラグが立っている行は、座標の前に4バイトの SRID が入る
+    has_srid = (geometry_type & EWKB_SRID_FLAG) != 0
+    if has_srid.any():
+        if np.any(np.diff(offsets)[valid][has_srid] < WKB_POINT_SIZE + 4):
+            raise ValueError("SRID 付きの EWKB のポイントが途中で切れています")
+        srid = _gather(data, starts[has_srid] + 5, 4, little[has_srid]).view('<u4').ravel()
+        other = np.unique(srid[(srid != 0) & (srid != 4326)])
+        if len(other):
+            raise ValueError(f"座標系が WGS84 (経度, 緯度) ではありません: EWKB の SRID {', '.join(map(str, other))}")
+    coordinate_starts = starts + 5 + 4 * has_srid
+
+    lon[valid] = _gather(data, coordinate_starts, 8, little).view('<f8').ravel()
+    lat[valid] = _gather(data, coordinate_starts + 8, 8, little).view('<f8').ravel()
+    return lon, lat, valid & np.isfinite(lon) & np.isfinite(lat)
+
+
+def _gather(data: np.ndarray, positions: np.ndarray, size: int, little: np.ndarray) -> np.ndarray:
+    """各位置から size バイトを取り出し、ビッグエンディアンの行はバイト順を反転した (N, size) の配列"""
+    raw = np.empty((len(positions), size), dtype=np.uint8)
+    for k in range(size):
+        raw[:, k] = data[positions + k]
+    if not little.all():
+        raw[~little] = raw[~little, ::-1]
+    return raw
+
+
+# MARK: 書き出し
+def points_to_wkb(lon: np.ndarray, lat: np.ndarray):
+    """ポイントの列を WKB のバイナリ列 (pyarrow) にする"""
+    n = len(lon)
+    records = np.empty(n, dtype=np.dtype([('order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8')]))
+    records['order'] = 1
+    records['type'] = WKB_POINT
+    records['x'] = lon
+    records['y'] = lat
+    offsets = np.arange(n + 1, dtype=np.int32) * WKB_POINT_SIZE
+    return pa.Array.from_buffers(pa.binary(), n, [None, pa.py_buffer(offsets), pa.py_buffer(records.tobytes())])
+
+
+def linestrings_to_wkb(lines: List[np.ndarray]):
+    """(N, 2) の座標配列のリストを WKB のバイナリ列 (pyarrow) にする"""
+    parts = []
+    for coords in lines:
+        coords = np.ascontiguousarray(coords, dtype='<f8').reshape(-1, 2)
+        parts.append(struct.pack('<BII', 1, WKB_LINESTRING, len(coords)))
+        parts.append(coords.tobytes())
+    sizes = np.array([9 + 16 * len(coords) for coords in lines], dtype=np.int64)
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return pa.Array.from_buffers(pa.large_binary(), len(lines),
+                                 [None, pa.py_buffer(offsets), pa.py_buffer(b"".join(parts))])
+
+
+class FeatureFileWriter:
+    """
+    ポイント・ラインを GeoParquet / FlatGeobuf に列のまとまりで書き出す
+
+    arcpy.da.InsertCursor と同じく insertRow([ジオメトリ, 属性...]) で1行ずつ受け取り、
+    batch_size 行ごとに Arrow の列にまとめて書き出す。ジオメトリはポイントなら (経度, 緯度)、
+    ラインなら (N, 2) の座標配列または GeoJSON。座標系は WGS84。
+
+    - GeoParquet: ParquetWriter で行グループごとに追記する（'geo' メタデータ付き、WKB）
+    - FlatGeobuf: 一時ファイルに Arrow IPC で追記し、close でまとめて GDAL (pyogrio) で書き出す
+      （FlatGeobuf は空間インデックスのため全件がそろってから書く形式）
+
+    close を呼ぶまでファイルは完成しない。
+    """
+
+    GEOMETRY_COLUMN = "geometry"
+
+    def __init__(self, path: str, geometry_type: str, fields: Sequence[Tuple[str, str]], batch_size: int = 10000):
+        """
+        Args:
+            path: 出力先 (.parquet / .geoparquet / .fgb。既存のファイルは置き換える)
+            geometry_type: "Point" または "LineString"
+            fields: 属性の (列名, 型) のリスト。型は "int32" / "int64" / "float64"
+            batch_size: まとめて書き出す行数
+        """
+        if geometry_type not in ("Point", "LineString"):
+            raise ValueError(f"未対応のジオメトリ種別です: {geometry_type}")
+        for name, field_type in fields:
+            if field_type not in FIELD_TYPES:
+                raise ValueError(f"未対応の列の型です: {name} {field_type}（{', '.join(FIELD_TYPES)}）")
+
+        self.path = path
+        self.format = file_format(path)
+        self.geometry_type = geometry_type
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self.count = 0
+
+        geometry_field = pa.field(self.GEOMETRY_COLUMN, pa.binary() if geometry_type == "Point" else pa.large_binary())
+        self.schema = pa.schema([geometry_field] + [pa.field(name, field_type) for name, field_type in self.fields])
+        self._columns = [[] for _ in range(len(self.fields) + 1)]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.format == "parquet":
+            geo = {
+                'version': '1.1.0',
+                'primary_column': self.GEOMETRY_COLUMN,
+                # crs を省略すると OGC:CRS84（経度, 緯度）
+                'columns': {self.GEOMETRY_COLUMN: {'encoding': 'WKB', 'geometry_types': [geometry_type]}},
+            }
+            self.schema = self.schema.with_metadata({b'geo': json.dumps(geo).encode('utf-8')})
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self._tmp_path = path + ".arrows.tmp"
+            self._sink = pa.OSFile(self._tmp_path, "wb")
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def insertRow(self, row: Sequence[Any]):
+        """[ジオメトリ, 属性...] を1行追加"""
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if len(self._columns[0]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        geometries = self._columns[0]
+        if not geometries:
+            return
+        if self.geometry_type == "Point":
+            xy = np.asarray(geometries, dtype=np.float64).reshape(-1, 2)
+            geometry_array = points_to_wkb(xy[:, 0], xy[:, 1])
+        else:
+            geometry_array = linestrings_to_wkb([geometry_from_json(geometry) for geometry in geometries])
+        self.write_columns(geometry_array, self._columns[1:])
+        self._columns = [[] for _ in self._columns]
+
+    def write_columns(self, geometry_array, columns: Sequence[Any]):
+        """WKB のジオメトリ列と属性の列（fields の順）をそのまま1つのまとまりとして書き出す"""
+        arrays = [geometry_array] + [pa.array(values, type=field_type)
+                                     for values, (_, field_type) in zip(columns, self.fields)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.count += len(geometry_array)
+
+    def close(self):
+        """残りを書き出してファイルを完成させる"""
+        if self._writer is None:
+            return
+        self._flush()
+        self._writer.close()
+        self._writer = None
+        if self.format == "fgb":
+            self._sink.close()
+            try:
+                with pa.memory_map(self._tmp_path) as source:
+                    reader = pa.ipc.open_stream(source)
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                    pyogrio.write_arrow(reader, self.path, driver="FlatGeobuf",
+                                        geometry_name=self.GEOMETRY_COLUMN, geometry_type=self.geometry_type,
+                                        crs="EPSG:4326")
+            finally:
+                os.remove(self._tmp_path)
+
+
+def write_table(path: str, rows: np.ndarray):
+    """ジオメトリのない表（構造化配列）を Parquet に書き出す"""
+    if pa is None:
+        raise ImportError("Parquet の書き出しには pyarrow が必要です (pip install pyarrow)")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    pq.write_table(pa.table({name: rows[name] for name in rows.dtype.names}), path)
+
+
+def write_points(path: str, points: PointSet, columns: Optional[Dict[str, np.ndarray]] = None):
+    """PointSet（と属性の列）を GeoParquet / FlatGeobuf に一括で書き出す（入力データの作成・変換用）"""
+    columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+    fields = [("OID", "int64")] + [(name, str(values.dtype)) for name, values in columns.items()]
+    writer = FeatureFileWriter(path, "Point", fields)
+    try:
+        writer.write_columns(points_to_wkb(points.lon, points.lat), [points.oid] + list(columns.values()))
+    finally:
+        writer.close()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ルート検索の負荷試験（OSRM 代替サーバーに対するスループットの計測）
+
+合成の建物・避難所データから main() と同じ手順（find_closest_shelters → build_table_batches）で
+バッチを作り、main() と同じ方法で OSRM に問い合わせて、維持できる処理件数/秒とリクエスト数/秒を計測する。
+
+- thread:  ThreadPoolExecutor(max_workers) で process_batch_routes を実行（main() の既定）
+- asyncio: run_batch_routes_async（同時リクエスト数と接続数の上限 = workers）
+
+いずれも同時リクエスト数は notebook.osrm_client が workers を上限に自動調整する（初期値は --initial-concurrency）。
+--output-modes に attributes を含めると、main() の設定 3-3 の所要時間・距離のみの出力
+（process_batch_attributes。Routeリクエストなし）も計測する。
+--replicas を指定すると代替サーバーを複数起動し、OSRMサーバーのプール（main() の設定 4-2）として分散する
+（スレッド数・同時リクエスト数は全サーバーの合計、同時リクエスト数の上限はサーバーごとに workers）。
+
+--osrm-url を指定しなければ mock_osrm_server をプロセス内で起動する（遅延・エラー率などは同じ引数で設定）。
+本物の osrm-routed に対しても実行できる（ただし負荷をかけるため運用中のサーバーには使わないこと）。
+
+使用例:
+    python load_test_routing.py --buildings 20000 --workers 5,10,20,40 --latency-ms 5 --jitter-ms 5 --threads 8
+    python load_test_routing.py --engines asyncio --workers 50,200 --error-rate 0.01 --output load_test.json
+    python load_test_routing.py --replicas 1,2,4 --workers 64 --latency-ms 20 --threads 2
+    python load_test_routing.py --geometries geojson,polyline6 --geometry-points 500 --simplify-tolerance-m 2
+    python load_test_routing.py --output-modes routes,attributes --engines thread,asyncio --latency-ms 20
+    python load_test_routing.py --osrm-url http://localhost:5000,http://localhost:5001 --buildings 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional
+
+import notebook
+from benchmark_aggregation import generate_buildings, to_point_set, git_commit
+from mock_osrm_server import MockOSRMServer, add_config_arguments, config_from_args
+
+
+# MARK: データ準備
+def build_batches(num_buildings: int, num_shelters: int, num_closest: int, max_table_size: int, seed: int):
+    """合成データから main() と同じ手順でバッチを作成し、(batches, shelters, 建物数) を返す"""
+    lon, lat = generate_buildings(num_buildings, seed=seed)
+    buildings = to_point_set(lon, lat)
+    # 避難所も人口の多い場所に多く配置されるよう、建物と同じ分布から別のシードで生成する
+    lon, lat = generate_buildings(num_shelters, seed=seed + 1)
+    shelter_points = to_point_set(lon, lat)
+    shelters = shelter_points.to_dict()
+
+    near_oids = notebook.find_closest_shelters(buildings, shelter_points, num_closest)
+    tasks = []
+    for (oid, coord), shelter_oids in zip(buildings.items(), near_oids.tolist()):
+        nearby_shelter_oids = [s for s in shelter_oids if s >= 0]
+        if nearby_shelter_oids:
+            tasks.append((oid, coord, nearby_shelter_oids))
+    return notebook.build_table_batches(tasks, max_table_size), shelters, len(tasks)
+
+
+# MARK: 実行
+def run_thread_engine(batches, shelters, osrm_url: str, workers: int,
+                      attributes_only: bool = False) -> List[Dict[str, Any]]:
+    """main() の thread エンジンと同じ方法で全バッチを処理"""
+    process_batch = notebook.process_batch_attributes if attributes_only else notebook.process_batch_routes
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_batch, batch, shelters, osrm_url) for batch in batches]
+        for future in as_completed(futures):
+            results.extend(future.result())
+    return results
+
+
+def run_asyncio_engine(batches, shelters, osrm_url: str, workers: int,
+                       attributes_only: bool = False) -> List[Dict[str, Any]]:
+    """main() の asyncio エンジンと同じ方法で全バッチを処理"""
+    results = []
+    asyncio.run(notebook.run_batch_routes_async(batches, shelters, osrm_url, workers, workers, results.extend,
+                                                attributes_only=attributes_only))
+    return results
+
+
+ENGINES = {'thread': run_thread_engine, 'asyncio': run_asyncio_engine}
+
+
+def run_load(engine: str, workers: int, batches, shelters, osrm_urls: List[str],
+             servers: List[MockOSRMServer], initial_concurrency: int = 8, geometries: str = "polyline6",
+             simplify_tolerance_m: Optional[float] = None, output_mode: str = "routes") -> Dict[str, Any]:
+    """1回の負荷試験を実行し、処理件数/秒・リクエスト数/秒と所要時間の分布をまとめる"""
+    # 実行ごとに計測と同時リクエスト数の調整をやり直す（notebook の各関数はモジュールの metrics に記録する）
+    notebook.metrics.reset()
+    notebook.osrm_client.configure(initial_concurrency=min(initial_concurrency, workers), max_concurrency=workers,
+                                   backends=osrm_urls if len(osrm_urls) > 1 else None)
+    notebook.route_geometry.configure(geometries=geometries, simplify_tolerance_m=simplify_tolerance_m)
+    stats_before = [server.stats for server in servers]
+    osrm_url = osrm_urls[0]
+
+    start = time.perf_counter()
+    results = ENGINES[engine](batches, shelters, osrm_url, workers, attributes_only=output_mode == "attributes")
+    elapsed = time.perf_counter() - start
+
+    summary = notebook.metrics.summary()
+    distributions = summary['distributions']
+    requests_done = sum(distributions.get(name, {}).get('count', 0) for name in ("table_seconds", "route_seconds"))
+    successful = sum(1 for result in results if result['success'])
+
+    run = {
+        'engine': engine,
+        'workers': workers,
+        'replicas': len(osrm_urls),
+        'output_mode': output_mode,
+        'geometries': geometries,
+        'elapsed_seconds': elapsed,
+        'buildings': len(results),
+        'successful': successful,
+        'buildings_per_second': len(results) / elapsed if elapsed > 0 else None,
+        'requests_per_second': requests_done / elapsed if elapsed > 0 else None,
+        'counters': summary['counters'],
+    }
+    for name in ("table", "route"):
+        stats = distributions.get(f"{name}_seconds")
+        if stats:
+            run[f"{name}_requests"] = stats['count']
+            run[f"{name}_ms"] = {key: stats[key] * 1000.0 for key in ("p50", "p95", "p99", "max")}
+    # ジオメトリの転送量と復元の負荷（応答のサイズ、JSON の解析 + 座標配列への復元の時間、保持する点数）
+    if "route_response_bytes" in distributions:
+        run['route_response_bytes_mean'] = distributions['route_response_bytes']['mean']
+        run['route_decode_ms_p50'] = sum(distributions.get(name, {}).get('p50', 0.0)
+                                         for name in ("route_parse_seconds", "route_decode_seconds")) * 1000.0
+    if "route_points_stored" in summary['counters']:
+        run['route_points_kept_ratio'] = (summary['counters']['route_points_stored']
+                                          / max(1, summary['counters']['route_points_decoded']))
+    if "osrm_in_flight" in distributions:
+        run['osrm_in_flight_max'] = distributions['osrm_in_flight']['max']
+    run['osrm'] = notebook.osrm_client.stats()
+    if servers:
+        run['servers'] = [{key: after[key] - before[key] for key in after}
+                          for before, after in zip(stats_before, (server.stats for server in servers))]
+    return run
+
+
+def format_run(run: Dict[str, Any]) -> str:
+    geometries = run['geometries'] if run['output_mode'] == "routes" else "-"
+    line = (f"  {run['engine']:<8} {run['output_mode']:<10} {geometries:<9} replicas={run['replicas']:<2} workers={run['workers']:<4} "
+            f"{run['buildings_per_second']:8.1f} 件/秒, "
+            f"{run['requests_per_second']:8.1f} リクエスト/秒, 成功 {run['successful']}/{run['buildings']}")
+    for name in ("table", "route"):
+        if f"{name}_ms" in run:
+            ms = run[f"{name}_ms"]
+            line += f", {name} p50 {ms['p50']:.1f}ms p99 {ms['p99']:.1f}ms"
+    retries = sum(value for key, value in run['counters'].items() if key.endswith("_retries"))
+    if "route_response_bytes_mean" in run:
+        line += (f", route 応答 {run['route_response_bytes_mean'] / 1024:.1f}KB"
+                 f" 解析+復元 p50 {run['route_decode_ms_p50']:.2f}ms")
+    if "route_points_kept_ratio" in run:
+        line += f", 簡略化後の点数 {run['route_points_kept_ratio'] * 100:.0f}%"
+    # osrm_server_errors などは再試行の内訳なので含めない
+    errors = run['counters'].get("table_errors", 0) + run['counters'].get("route_errors", 0)
+    if retries or errors:
+        line += f", 再試行 {retries}, エラー {errors}"
+    line += ", 同時数 " + "/".join(f"{osrm_stats['concurrency_limit']:.1f}" for osrm_stats in run['osrm'].values())
+    return line
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ルート検索の負荷試験（OSRM 代替サーバーに対するスループット）")
+    parser.add_argument("--buildings", type=int, default=20000, help="集約建物ポイント数 (既定: 20000)")
+    parser.add_argument("--shelters", type=int, default=500, help="避難所数 (既定: 500)")
+    parser.add_argument("--num-closest", type=int, default=3, help="候補とする近傍の避難所数 (main() の設定 6)")
+    parser.add_argument("--engines", default="thread", help="ルート検索エンジンのリスト (thread, asyncio)")
+    parser.add_argument("--workers", default="10", help="同時実行数のリスト (thread はスレッド数、asyncio は同時リクエスト数)")
+    parser.add_argument("--initial-concurrency", type=int, default=8,
+                        help="同時リクエスト数の初期値 (main() の設定 7-2。workers を上限に自動調整される)")
+    parser.add_argument("--seed", type=int, default=42, help="合成データの乱数シード")
+    parser.add_argument("--replicas", default="1", help="代替サーバーの台数のリスト (プールとして分散)")
+    parser.add_argument("--geometries", default="polyline6",
+                        help="ルートのジオメトリ形式のリスト (geojson, polyline6。main() の設定 15)")
+    parser.add_argument("--simplify-tolerance-m", type=float, default=None,
+                        help="保存前の簡略化の許容誤差 (メートル、main() の設定 15-2)")
+    parser.add_argument("--output-modes", default="routes",
+                        help="出力内容のリスト (routes, attributes。main() の設定 3-3)")
+    parser.add_argument("--osrm-url", default=None,
+                        help="負荷をかけるサーバー（カンマ区切りで複数ならプール。省略時は代替サーバーをプロセス内で起動）")
+    parser.add_argument("--output", default=None, help="結果を保存するJSON")
+    # 代替サーバーの設定（--max-table-size はバッチ分割の上限 (main() の設定 8) にも使う）
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    engines = [engine.strip() for engine in args.engines.split(",")]
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown:
+        parser.error(f"不明なエンジンです: {', '.join(unknown)}")
+    workers_list = [int(workers) for workers in args.workers.split(",")]
+    replicas_list = [int(replicas) for replicas in args.replicas.split(",")]
+    geometries_list = [geometries.strip() for geometries in args.geometries.split(",")]
+    output_modes = [mode.strip() for mode in args.output_modes.split(",")]
+    unknown = [mode for mode in output_modes if mode not in ("routes", "attributes")]
+    if unknown:
+        parser.error(f"不明な出力内容です: {', '.join(unknown)}")
+
+    batches, shelters, num_tasks = build_batches(args.buildings, args.shelters, args.num_closest,
+                                                 args.max_table_size, args.seed)
+    print(f"建物 {num_tasks} 件, 避難所 {len(shelters)} 件, Tableリクエスト数 {len(batches)}")
+
+    servers = []
+    if args.osrm_url is None:
+        for _ in range(max(replicas_list)):
+            servers.append(MockOSRMServer(config_from_args(args)).start())
+        print(f"OSRM 代替サーバーを起動しました: {', '.join(server.url for server in servers)}")
+        pools = [[server.url for server in servers[:replicas]] for replicas in replicas_list]
+    else:
+        pools = [[url.strip() for url in args.osrm_url.split(",")]]
+
+    report = {
+        'load_test': 'routing',
+        'git_commit': git_commit(),
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'cpu_count': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key != "output"},
+        'num_buildings': num_tasks,
+        'num_table_batches': len(batches),
+        'runs': [],
+    }
+
+    try:
+        for engine in engines:
+            for output_mode in output_modes:
+                # 所要時間・距離のみの出力はジオメトリを要求しないため形式ごとには繰り返さない
+                for geometries in (geometries_list if output_mode == "routes" else geometries_list[:1]):
+                    for osrm_urls in pools:
+                        for workers in workers_list:
+                            run = run_load(engine, workers, batches, shelters, osrm_urls, servers[:len(osrm_urls)],
+                                           args.initial_concurrency, geometries, args.simplify_tolerance_m,
+                                           output_mode)
+                            report['runs'].append(run)
+                            print(format_run(run))
+    finally:
+        for server in servers:
+            server.stop()
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
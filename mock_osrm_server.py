@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ルート検索の負荷試験用の OSRM 代替サーバー（osrm-routed の /table/v1 と /route/v1 の応答形式を模擬）
+
+所要時間・距離は直線距離に迂回率を掛けて歩行速度で割った値を返すため、
+最寄り避難所の選択は直線距離の順と一致する。地図データは不要。
+
+応答の遅延、エラー率、切断率、ジオメトリの点数、同時処理数（osrm-routed の --threads に相当）を設定できる。
+
+使用例:
+    python mock_osrm_server.py --port 5000 --latency-ms 5 --jitter-ms 10 --threads 8
+    python mock_osrm_server.py --port 5000 --error-rate 0.01 --reset-rate 0.01 --geometry-points 200
+
+プロセス内で使う場合:
+    with MockOSRMServer(MockOSRMConfig(latency_ms=5)) as server:
+        process_batch_routes(batch, shelters, server.url)
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from route_geometry import POLYLINE_PRECISION, encode_polyline
+
+EARTH_RADIUS_M = 6371000.0
+
+
+@dataclass
+class MockOSRMConfig:
+    """
+    代替サーバーの動作設定
+
+    Attributes:
+        latency_ms: 1リクエストあたりの基本の処理時間
+        jitter_ms: 処理時間に加える一様乱数の上限
+        table_cell_us: Tableリクエストの行列1要素あたりの処理時間（マイクロ秒）
+        threads: 同時に処理するリクエスト数の上限（超えた分は待たされる。0 で無制限）
+        error_rate: HTTP 500 を返す割合
+        reset_rate: 応答せずに接続を切る割合（クライアントでは ConnectionError になる）
+        max_table_size: Tableリクエストの座標数の上限（超えると OSRM と同じ 400 TooBig）
+        geometry_spacing_m: ルートのジオメトリの点の間隔（メートル）
+        geometry_points: ジオメトリの点数（0 なら geometry_spacing_m から決める）
+        walking_speed_mps: 所要時間の計算に使う歩行速度
+        detour_factor: 直線距離に対する道のりの比
+        seed: エラー・遅延の乱数のシード（None で毎回異なる）
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    table_cell_us: float = 0.0
+    threads: int = 0
+    error_rate: float = 0.0
+    reset_rate: float = 0.0
+    max_table_size: int = 100
+    geometry_spacing_m: float = 20.0
+    geometry_points: int = 0
+    walking_speed_mps: float = 1.4
+    detour_factor: float = 1.25
+    seed: Optional[int] = None
+
+
+# MARK: 距離計算
+def haversine_m(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """2点間の大円距離（メートル）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2.0 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_coordinates(text: str) -> List[Tuple[float, float]]:
+    """'lon,lat;lon,lat;...' を [(lon, lat), ...] に変換"""
+    coordinates = []
+    for pair in unquote(text).split(";"):
+        lon, lat = pair.split(",")
+        coordinates.append((float(lon), float(lat)))
+    return coordinates
+
+
+def parse_indices(query: Dict[str, List[str]], name: str, count: int) -> List[int]:
+    """sources / destinations パラメータ（省略または 'all' なら全座標）"""
+    value = query.get(name, ["all"])[0]
+    if value == "all":
+        return list(range(count))
+    indices = [int(i) for i in value.split(";")]
+    if any(i < 0 or i >= count for i in indices):
+        raise ValueError(f"{name} の番号が座標数を超えています")
+    return indices
+
+
+def waypoint(lon: float, lat: float) -> Dict[str, Any]:
+    return {'hint': '', 'distance': 0.0, 'name': '', 'location': [lon, lat]}
+
+
+# MARK: 応答の生成
+class MockOSRM:
+    """リクエストの内容から OSRM 形式の応答を作る（HTTP 処理とは分けて、負荷の模擬もここで行う）"""
+
+    def __init__(self, config: MockOSRMConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(config.threads) if config.threads > 0 else None
+        self.stats_lock = threading.Lock()
+        self.stats = {'table': 0, 'route': 0, 'errors': 0, 'resets': 0, 'too_big': 0, 'bad_requests': 0}
+
+    def count(self, name: str):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def stats_snapshot(self) -> Dict[str, int]:
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def uniform(self) -> float:
+        with self.random_lock:
+            return self.random.random()
+
+    def path_cost(self, meters: float) -> Tuple[float, float]:
+        """直線距離から (所要時間[秒], 道のり[m]) を求める"""
+        distance = meters * self.config.detour_factor
+        return distance / self.config.walking_speed_mps, distance
+
+    def handle(self, path: str, query: Dict[str, List[str]]) -> Tuple[Optional[int], Dict[str, Any]]:
+        """
+        リクエストを処理して (HTTPステータス, 応答JSON) を返す
+
+        ステータスが None の場合は応答せずに接続を切る
+        """
+        parts = path.strip("/").split("/")
+        if len(parts) != 4 or parts[0] not in ("table", "route") or parts[1] != "v1":
+            self.count('bad_requests')
+            return 400, {'code': 'InvalidUrl', 'message': f"URL string malformed: {path}"}
+        service = parts[0]
+
+        # 障害の模擬（リクエストの内容によらず一定の割合で発生）
+        draw = self.uniform()
+        if draw < self.config.reset_rate:
+            self.count('resets')
+            return None, {}
+        if draw < self.config.reset_rate + self.config.error_rate:
+            self.count('errors')
+            return 500, {'code': 'InternalError', 'message': 'mock: injected error'}
+
+        try:
+            coordinates = parse_coordinates(parts[3])
+        except ValueError:
+            self.count('bad_requests')
+            return 400, {'code': 'InvalidQuery', 'message': 'Query string malformed'}
+
+        # 同時処理数の上限（osrm-routed のワーカースレッド数に相当）
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            if service == "table":
+                status, body, cells = self.table(coordinates, query)
+            else:
+                status, body, cells = self.route(coordinates, query)
+            self.simulate_work(cells)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+        if status == 200:
+            self.count(service)
+        return status, body
+
+    def simulate_work(self, cells: int):
+        seconds = (self.config.latency_ms + self.config.jitter_ms * self.uniform()) / 1000.0
+        seconds += cells * self.config.table_cell_us / 1e6
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def table(self, coordinates, query) -> Tuple[int, Dict[str, Any], int]:
+        if len(coordinates) > self.config.max_table_size:
+            self.count('too_big')
+            return 400, {'code': 'TooBig', 'message': 'Too many table coordinates'}, 0
+        try:
+            sources = parse_indices(query, "sources", len(coordinates))
+            destinations = parse_indices(query, "destinations", len(coordinates))
+        except ValueError as e:
+            self.count('bad_requests')
+            return 400, {'code': 'InvalidOptions', 'message': str(e)}, 0
+
+        annotations = query.get("annotations", ["duration"])[0].split(",")
+        durations = []
+        distances = []
+        for s in sources:
+            duration_row = []
+            distance_row = []
+            for d in destinations:
+                duration, distance = self.path_cost(haversine_m(*coordinates[s], *coordinates[d]))
+                duration_row.append(round(duration, 1))
+                distance_row.append(round(distance, 1))
+            durations.append(duration_row)
+            distances.append(distance_row)
+
+        body = {
+            'code': 'Ok',
+            'sources': [waypoint(*coordinates[s]) for s in sources],
+            'destinations': [waypoint(*coordinates[d]) for d in destinations],
+        }
+        if "duration" in annotations:
+            body['durations'] = durations
+        if "distance" in annotations:
+            body['distances'] = distances
+        return 200, body, len(sources) * len(destinations)
+
+    def route(self, coordinates, query) -> Tuple[int, Dict[str, Any], int]:
+        if len(coordinates) < 2:
+            self.count('bad_requests')
+            return 400, {'code': 'InvalidValue', 'message': 'Route needs at least two coordinates'}, 0
+        geometries = query.get("geometries", ["polyline"])[0]
+        if geometries != "geojson" and geometries not in POLYLINE_PRECISION:
+            self.count('bad_requests')
+            return 400, {'code': 'InvalidOptions',
+                         'message': "geometries must be one of geojson, polyline, polyline6"}, 0
+
+        legs = []
+        line = [list(coordinates[0])]
+        for (lon1, lat1), (lon2, lat2) in zip(coordinates[:-1], coordinates[1:]):
+            meters = haversine_m(lon1, lat1, lon2, lat2)
+            duration, distance = self.path_cost(meters)
+            legs.append({'steps': [], 'summary': '', 'weight': duration, 'duration': duration, 'distance': distance})
+            line.extend(self.leg_geometry(lon1, lat1, lon2, lat2, meters)[1:])
+
+        duration = sum(leg['duration'] for leg in legs)
+        distance = sum(leg['distance'] for leg in legs)
+        route = {'legs': legs, 'weight_name': 'duration', 'weight': duration, 'duration': duration,
+                 'distance': distance}
+        if query.get("overview", ["simplified"])[0] != "false":
+            if geometries == "geojson":
+                route['geometry'] = {'type': 'LineString', 'coordinates': line}
+            else:
+                route['geometry'] = encode_polyline(line, POLYLINE_PRECISION[geometries])
+        body = {'code': 'Ok', 'routes': [route], 'waypoints': [waypoint(*c) for c in coordinates]}
+        return 200, body, 0
+
+    def leg_geometry(self, lon1, lat1, lon2, lat2, meters) -> List[List[float]]:
+        """2点間を結ぶ折れ線（始点・終点を含む）。道なりに見えるよう中間点を左右に少しずらす"""
+        if self.config.geometry_points > 0:
+            num_points = max(2, self.config.geometry_points)
+        else:
+            num_points = max(2, int(meters / self.config.geometry_spacing_m) + 1)
+
+        line = []
+        for i in range(num_points):
+            t = i / (num_points - 1)
+            offset = 0.0 if i in (0, num_points - 1) else 0.00005 * math.sin(i)
+            line.append([round(lon1 + (lon2 - lon1) * t + offset, 6), round(lat1 + (lat2 - lat1) * t - offset, 6)])
+        return line
+
+
+# MARK: HTTPサーバー
+class MockOSRMRequestHandler(BaseHTTPRequestHandler):
+    # キープアライブ接続を使えるように HTTP/1.1 で応答する（requests / aiohttp の接続プール用）
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に送るため、キープアライブ接続で遅延ACKを待たないようにする（Nagle 無効化）
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/_mock/stats":
+            self.send_json(200, self.server.osrm.stats_snapshot())
+            return
+
+        status, body = self.server.osrm.handle(url.path, parse_qs(url.query))
+        if status is None:
+            # 応答せずに切断（過負荷で接続が切られた場合を模擬）
+            self.close_connection = True
+            return
+        self.send_json(status, body)
+
+    def send_json(self, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockOSRMServer:
+    """
+    代替サーバーを別スレッドで起動する（with 文で使うと終了時に停止する）
+
+    Args:
+        config: 動作設定
+        host, port: 待ち受けるアドレス（port=0 で空いているポート）
+    """
+
+    def __init__(self, config: Optional[MockOSRMConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.osrm = MockOSRM(config or MockOSRMConfig())
+        self.httpd = ThreadingHTTPServer((host, port), MockOSRMRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 1024
+        self.httpd.osrm = self.osrm
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return self.osrm.stats_snapshot()
+
+    def start(self) -> "MockOSRMServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self) -> "MockOSRMServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """MockOSRMConfig の設定をコマンドライン引数として追加（負荷試験スクリプトと共用）"""
+    defaults = MockOSRMConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="基本の処理時間 (ミリ秒)")
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms, help="処理時間に加える乱数の上限 (ミリ秒)")
+    parser.add_argument("--table-cell-us", type=float, default=defaults.table_cell_us,
+                        help="Table行列の1要素あたりの処理時間 (マイクロ秒)")
+    parser.add_argument("--threads", type=int, default=defaults.threads, help="同時処理数の上限 (0 で無制限)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="HTTP 500 を返す割合")
+    parser.add_argument("--reset-rate", type=float, default=defaults.reset_rate, help="応答せずに切断する割合")
+    parser.add_argument("--max-table-size", type=int, default=defaults.max_table_size, help="Tableの座標数の上限")
+    parser.add_argument("--geometry-spacing-m", type=float, default=defaults.geometry_spacing_m,
+                        help="ルートのジオメトリの点の間隔 (メートル)")
+    parser.add_argument("--geometry-points", type=int, default=defaults.geometry_points,
+                        help="ルートのジオメトリの点数 (0 で間隔から決める)")
+    parser.add_argument("--mock-seed", type=int, default=None, help="エラー・遅延の乱数のシード")
+
+
+def config_from_args(args: argparse.Namespace) -> MockOSRMConfig:
+    return MockOSRMConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        table_cell_us=args.table_cell_us,
+        threads=args.threads,
+        error_rate=args.error_rate,
+        reset_rate=args.reset_rate,
+        max_table_size=args.max_table_size,
+        geometry_spacing_m=args.geometry_spacing_m,
+        geometry_points=args.geometry_points,
+        seed=args.mock_seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="負荷試験用の OSRM 代替サーバー (/table/v1, /route/v1)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    server = MockOSRMServer(config, host=args.host, port=args.port)
+    print(f"OSRM 代替サーバーを起動しました: {server.url}")
+    print(f"設定: {json.dumps(asdict(config), ensure_ascii=False)}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"処理件数: {server.stats}")
@@ -1,19 +1,45 @@
 # -*- coding: utf-8 -*-
 # # C:\Program Files\ArcGIS\Pro\bin\Python\envs\arcgispro-py3\python.exe
 
-import arcpy
+import os
 import requests
 import time
+import argparse
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import asyncio
+import queue
 import numpy as np
 from scipy.spatial import KDTree, ConvexHull
 
 from aggregation_client import aggregate_points_by_cpp_server
+from route_cache import RouteCache
+from route_journal import RouteJournal
+from pipeline_metrics import PipelineMetrics
+from osrm_client import OSRMClient
+from route_geometry import RouteGeometryCodec, geometry_to_json, geometry_from_json, geometry_to_geojson
+from accessibility_raster import AccessibilityGrid, AccessibilityRasterWriter, NODATA
+from point_set import PointSet, as_point_set
+from feature_io import FeatureFileWriter, read_points, write_table
+
+try:
+    import aiohttp  # asyncioエンジン使用時のみ必要 (pip install aiohttp)
+except ImportError:
+    aiohttp = None
+
+# main() の実行には ArcGIS Pro の arcpy が必要（ベンチマークなど集約・近傍検索の関数だけを使う場合は不要）
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
 
 # Check out the ArcGIS Spatial Analyst extension license
-arcpy.CheckOutExtension("Spatial")
+if arcpy is not None:
+    arcpy.CheckOutExtension("Spatial")
+
+# main() で捕捉する arcpy のエラー（arcpy がない場合は何も捕捉しない）
+ARCPY_ERRORS = (arcpy.ExecuteError,) if arcpy is not None else ()
 
 # スレッドセーフなロック
 print_lock = threading.Lock()
@@ -25,12 +51,25 @@ def safe_print(*args, **kwargs):
         print(*args, **kwargs)
 
 
+# パイプラインの計測（ステージごとの処理時間、OSRMの所要時間分布、再試行回数、キューの深さ）
+metrics = PipelineMetrics()
+
+# OSRMへのリクエスト（サーバーごとの同時リクエスト数の自動調整・再試行・サーキットブレーカー。設定は main() で変更）
+osrm_client = OSRMClient(metrics=metrics)
+
+# Routeサービスのジオメトリ形式と保存前の簡略化（設定は main() で変更）
+route_geometry = RouteGeometryCodec(metrics=metrics)
+
+
 # MARK: メイン処理
-def main():
+def main(resume=False):
     """
     メイン処理
     建物ポイントから最も近い避難所へのルートをOSRMで検索し、
     結果をフィーチャクラスに保存します。
+
+    resume=True の場合は前回のジャーナルを読み込み、
+    ルート検索済みの集約建物をスキップして残りだけを処理します。
     """
     # --- --- --- --- --- --- --- --- --- --- --- --- --- --- ---
     #  ▼▼▼ ユーザー設定項目 ▼▼▼
@@ -48,271 +87,536 @@ def main():
     # 3. 出力フィーチャクラス名 (新規作成されます)
     output_fc_name = "OSRM_Routes_Optimized"
 
+    # 3-2. 建物OIDと集約建物OID (Agg_OID) の対応表 (None で出力しない)
+    membership_table_name = "Building_Agg_Membership"
+
+    # 3-3. 出力内容
+    # "routes": 最寄り避難所へのルート (ライン) と集約建物ポイントを出力
+    # "attributes": 集約建物ポイントの所要時間・距離のみを出力 (Tableサービスの値を使い、Routeサービスは呼ばない)
+    # "raster": 調査範囲のグリッドの各セルから最寄り避難所までの所要時間をラスタに出力 (設定 16。建物の集約は行わない)
+    output_mode = "routes"
+
     # 4. OSRMサーバーのURL (ローカルのDockerサーバーを指定)
     osrm_url = "http://localhost:5000"
 
+    # 4-2. 複数のOSRMサーバーを使う場合の一覧 (None で osrm_url のみ使用)
+    # region は担当範囲 (最小経度, 最小緯度, 最大経度, 最大緯度)、None は全域。各建物は範囲に含まれるサーバーに送られ、
+    # 同じ範囲のサーバーを複数並べると処理中のリクエストが少ないサーバーに振り分ける (レプリカ)。
+    # 指定した場合、osrm_url はURLの組み立てにだけ使われる。
+    osrm_backends = None
+    # osrm_backends = [
+    #     {'url': "http://localhost:5000", 'region': (134.0, 33.4, 137.0, 35.8)},  # 関西 (osrm_kansai.bat)
+    #     {'url': "http://localhost:5001", 'region': (134.0, 33.4, 137.0, 35.8)},  # 関西のレプリカ
+    #     {'url': "http://localhost:5002", 'region': (138.3, 34.8, 141.0, 37.2)},  # 関東 (osrm_kanto.bat)
+    # ]
+    osrm_health_check_interval = 30  # 秒 (osrm_backends のヘルスチェック間隔。None で開始時のみ)
+
     # 5. 建物集約の半径 (メートル単位)
     aggregation_radius_meters = 100
 
+    # 5-2. C++集約サーバーのグループ化モード ("serial": 従来の逐次処理 / "tiled": 全コアで並列処理)
+    #      "tiled" は高速だが、グループの起点の選ばれ方が異なるため "serial" とは集約結果が少し異なる
+    cpp_clustering_mode = "serial"
+
+    # 5-3. C++集約の実行方法 ("native": Python拡張モジュール / "server": HTTPサーバー / "auto": 拡張モジュールがあれば使用)
+    cpp_aggregation_backend = "auto"
+
     # 6. 検索対象とする近傍の避難所数
     num_closest_shelters = 3
 
-    # 7. 並列処理の同時実行スレッド数 (OSRMサーバーの性能に応じて調整)
-    max_workers = 10
+    # 6-2. 候補とする避難所までの最大直線距離 (メートル単位、None で無制限)
+    shelter_search_max_distance_m = None
+
+    # 7. 並列処理のスレッド数 (OSRMへの同時リクエスト数の上限。実際の同時数は 7-2 で自動調整される)
+    max_workers = 32
+
+    # 7-2. OSRMへの同時リクエスト数の自動調整 (AIMD) と再試行
+    # 応答時間が悪化したりエラーが出たりすると同時数を減らし、余裕があれば少しずつ増やす。
+    # 再試行は指数バックオフ + ジッターで待ち、連続して失敗するとサーバーの回復まで送信を止める。
+    osrm_initial_concurrency = 8
+    osrm_connect_timeout = 5  # 秒
+    osrm_read_timeout = 300  # 秒 (大きなTableリクエストの計算時間を含む)
+    osrm_max_attempts = 10  # 1リクエストあたりの試行回数 (超えた建物はスキップし、--resume で再試行できる)
+
+    # 8. 1回のTableリクエストに含める座標数の上限 (建物 + 候補避難所)
+    # osrm-routed の --max-table-size (既定値 100) 以下にすること
+    max_table_size = 100
+
+    # 9. ルート検索エンジン ("thread": スレッドプール / "asyncio": 非同期I/O)
+    routing_engine = "thread"
+
+    # 10. asyncioエンジンのコネクションプール上限と同時リクエスト数上限 (同時数は 7-2 で自動調整される)
+    async_max_connections = 64
+    async_max_in_flight = 1000
+
+    # 11. ルートキャッシュ (実行をまたいでOSRMの結果を再利用。None で無効)
+    route_cache_path = rf"C:\Users\東京電機大学\Documents\ArcGIS\Projects\{project_name}\osrm_route_cache.sqlite"
+    route_cache_max_bytes = 4 * 1024 ** 3  # 4GB を超えると古い結果から削除
+    # OSRMデータを再構築したら変更する (古いキャッシュを使わないため)
+    osrm_dataset_version = "kansai-latest"
+
+    # 12. ルート検索結果のジャーナル (異常終了後に --resume で再開するため)
+    journal_dir = rf"C:\Users\東京電機大学\Documents\ArcGIS\Projects\{project_name}\route_journal"
+    journal_chunk_size = 1000  # この件数ごとにチャンクファイルを書き出す
+
+    # 13. 書き込みスレッドへのキューの上限 (満杯になるとルート検索側が待機する)
+    writer_queue_size = 10000
+
+    # 14. 計測レポートの出力先 (ステージごとの処理時間、Table/Routeの p50/p95/p99 など。None で出力しない)
+    metrics_report_path = rf"C:\Users\東京電機大学\Documents\ArcGIS\Projects\{project_name}\run_metrics.json"
+
+    # 15. ルートのジオメトリ形式 ("polyline6": エンコード済み文字列で受け取り高速に復元 / "geojson": 座標の配列)
+    route_geometry_format = "polyline6"
+    # 15-2. 保存前にルートを簡略化する許容誤差 (メートル単位、None で簡略化しない)
+    route_simplify_tolerance_m = None
+
+    # 16. 到達時間ラスタ (output_mode = "raster" の場合)
+    # 拡張子 .bil は ArcGIS でそのまま開ける ESRI BIL 形式、.npy は NumPy 配列 (範囲は同名の .json)。値は秒、NODATA は -9999
+    accessibility_raster_path = rf"C:\Users\東京電機大学\Documents\ArcGIS\Projects\{project_name}\shelter_access_time.bil"
+    accessibility_cell_size_m = 100  # セルの大きさ (メートル)
+    accessibility_tile_cells = 256  # 1度に処理するタイルの1辺のセル数 (メモリに載せるのは1タイル分)
+    accessibility_building_distance_m = 500  # 最寄りの建物がこれより遠いセルは計算しない (None で全セル)
+
+    # 17. arcpy を使わないファイル入出力 (output_dir が None ならジオデータベースを使用)
+    # 入力は WGS84 のポイント (.parquet: GeoParquet / .fgb: FlatGeobuf)。OID は OID / OBJECTID 列 (なければ1からの連番)
+    # 結果は output_dir に {フィーチャクラス名}.{output_file_format}、対応表は {membership_table_name}.parquet で書き出す
+    # Linux の計算サーバーなどで実行し、結果だけを ArcGIS Pro に取り込む場合に使う (pip install pyarrow pyogrio)
+    building_points_path = None  # 例: "/data/osaka/buildings.parquet"
+    shelter_points_path = None  # 例: "/data/osaka/shelters.fgb"
+    output_dir = None  # 例: "/data/osaka/output"
+    output_file_format = "parquet"  # "parquet" (GeoParquet) / "fgb" (FlatGeobuf)
 
     # --- --- --- --- --- --- --- --- --- --- --- --- --- --- ---
     # ▲▲▲ ユーザー設定ここまで ▲▲▲
     # --- --- --- --- --- --- --- --- --- --- --- --- --- --- ---
 
+    file_io = output_dir is not None
+    if file_io:
+        if not (building_points_path and shelter_points_path):
+            raise ValueError("output_dir を指定する場合は building_points_path と shelter_points_path も指定してください")
+        if output_file_format not in ("parquet", "fgb"):
+            raise ValueError(f"不明な出力形式です: {output_file_format}（parquet, fgb）")
+    elif arcpy is None:
+        raise ImportError("main() には arcpy が必要です（ArcGIS Pro の Python 環境で実行するか、17. のファイル入出力を指定してください）")
+    if output_mode not in ("routes", "attributes", "raster"):
+        raise ValueError(f"不明な出力内容です: {output_mode}（routes, attributes, raster）")
+    attributes_only = output_mode == "attributes"
+    if attributes_only:
+        # ルートのラインは作成しない
+        output_fc_name = None
+
+    # 計測レポートに残す実行条件と件数
+    run_summary = {'routing_engine': routing_engine, 'max_workers': max_workers, 'resume': resume,
+                   'output_mode': output_mode, 'file_io': file_io,
+                   'route_geometry_format': route_geometry_format,
+                   'route_simplify_tolerance_m': route_simplify_tolerance_m}
+
     try:
-        # --- 1. 環境設定 ---
-        arcpy.env.workspace = gdb_path
-        arcpy.env.overwriteOutput = True
-        safe_print(f"ワークスペースを {gdb_path} に設定しました。")
-
-        # --- 2. 前処理: 座標変換 (WGS84へ) ---
-        wgs84_sr = arcpy.SpatialReference(4326)
-
-        # building_fc_name の座標系を取得
-        desc_building = arcpy.Describe(building_fc_name)
-        building_sr = desc_building.spatialReference
-        safe_print(f"建物フィーチャクラスの座標系: {building_sr.name} (タイプ: {building_sr.type})")
-
-        # 座標系に応じて処理を分岐
-        if building_sr.factoryCode == 4326:  # 既にWGS84の場合
-            safe_print(f"'{building_fc_name}' は既にWGS84座標系です。変換をスキップします。")
-            building_fc_wgs84 = building_fc_name
-        else:
-            # WGS84でない場合は変換を実行
-            building_fc_wgs84 = f"{building_fc_name}_WGS84"
-            if arcpy.Exists(building_fc_wgs84):
-                safe_print(f"'{building_fc_wgs84}' は既に存在します。再利用します。")
-            else:
-                safe_print(f"'{building_fc_name}' をWGS84に変換しています...")
-                arcpy.management.Project(building_fc_name, building_fc_wgs84, wgs84_sr)
-
-        # shelter_fc_name の座標系を取得
-        desc_shelter = arcpy.Describe(shelter_fc_name)
-        shelter_sr = desc_shelter.spatialReference
-        safe_print(f"避難所フィーチャクラスの座標系: {shelter_sr.name} (タイプ: {shelter_sr.type})")
-
-        # 座標系に応じて処理を分岐
-        if shelter_sr.factoryCode == 4326:  # 既にWGS84の場合
-            safe_print(f"'{shelter_fc_name}' は既にWGS84座標系です。変換をスキップします。")
-            shelter_fc_wgs84 = shelter_fc_name
-        else:
-            # WGS84でない場合は変換を実行
-            shelter_fc_wgs84 = f"{shelter_fc_name}_WGS84"
-            if arcpy.Exists(shelter_fc_wgs84):
-                safe_print(f"'{shelter_fc_wgs84}' は既に存在します。再利用します。")
-            else:
-                safe_print(f"'{shelter_fc_name}' をWGS84に変換しています...")
-                arcpy.management.Project(shelter_fc_name, shelter_fc_wgs84, wgs84_sr)
-        safe_print("座標変換が完了しました。")
+        if not file_io:
+            # --- 1. 環境設定 ---
+            arcpy.env.workspace = gdb_path
+            arcpy.env.overwriteOutput = True
+            safe_print(f"ワークスペースを {gdb_path} に設定しました。")
+
+            # --- 2. 前処理: 座標変換 (WGS84へ) ---
+            with metrics.stage("projection"):
+                wgs84_sr = arcpy.SpatialReference(4326)
+
+                # building_fc_name の座標系を取得
+                desc_building = arcpy.Describe(building_fc_name)
+                building_sr = desc_building.spatialReference
+                safe_print(f"建物フィーチャクラスの座標系: {building_sr.name} (タイプ: {building_sr.type})")
+
+                # 座標系に応じて処理を分岐
+                if building_sr.factoryCode == 4326:  # 既にWGS84の場合
+                    safe_print(f"'{building_fc_name}' は既にWGS84座標系です。変換をスキップします。")
+                    building_fc_wgs84 = building_fc_name
+                else:
+                    # WGS84でない場合は変換を実行
+                    building_fc_wgs84 = f"{building_fc_name}_WGS84"
+                    if arcpy.Exists(building_fc_wgs84):
+                        safe_print(f"'{building_fc_wgs84}' は既に存在します。再利用します。")
+                    else:
+                        safe_print(f"'{building_fc_name}' をWGS84に変換しています...")
+                        arcpy.management.Project(building_fc_name, building_fc_wgs84, wgs84_sr)
+
+                # shelter_fc_name の座標系を取得
+                desc_shelter = arcpy.Describe(shelter_fc_name)
+                shelter_sr = desc_shelter.spatialReference
+                safe_print(f"避難所フィーチャクラスの座標系: {shelter_sr.name} (タイプ: {shelter_sr.type})")
+
+                # 座標系に応じて処理を分岐
+                if shelter_sr.factoryCode == 4326:  # 既にWGS84の場合
+                    safe_print(f"'{shelter_fc_name}' は既にWGS84座標系です。変換をスキップします。")
+                    shelter_fc_wgs84 = shelter_fc_name
+                else:
+                    # WGS84でない場合は変換を実行
+                    shelter_fc_wgs84 = f"{shelter_fc_name}_WGS84"
+                    if arcpy.Exists(shelter_fc_wgs84):
+                        safe_print(f"'{shelter_fc_wgs84}' は既に存在します。再利用します。")
+                    else:
+                        safe_print(f"'{shelter_fc_name}' をWGS84に変換しています...")
+                        arcpy.management.Project(shelter_fc_name, shelter_fc_wgs84, wgs84_sr)
+                safe_print("座標変換が完了しました。")
 
         # --- 3. データ読み込み (WGS84座標) ---
-        safe_print("建物ポイント(WGS84)をメモリに読み込んでいます...")
-        building_coords_wgs84 = get_coords_dict_from_fc(building_fc_wgs84)
-
-        safe_print("避難所の座標をメモリに読み込んでいます...")
-        shelter_coords_dict = get_coords_dict_from_fc(shelter_fc_wgs84)
-        safe_print(f"避難所の数: {len(shelter_coords_dict)}")
-
-        # --- 4. 建物ポイントの集約 (最適化実装) ---
-        safe_print(f"建物ポイントを半径 {aggregation_radius_meters}m で集約しています (最適化実装)...")
-        # NumPy版（最高速）
-        # aggregated_building_coords = aggregate_points_by_grid_max_speed(building_coords_wgs84, aggregation_radius_meters)
-        # C++版
-        aggregated_building_coords = aggregate_points_by_cpp_server(building_coords_wgs84, aggregation_radius_meters)
-        total_aggregated_buildings = len(aggregated_building_coords)
-        safe_print(f"建物の集約が完了しました。代表ポイント数: {total_aggregated_buildings}")
+        with metrics.stage("loading"):
+            safe_print("建物ポイント(WGS84)をメモリに読み込んでいます...")
+            if file_io:
+                building_points = read_points(building_points_path)
+            else:
+                building_points = get_point_set_from_fc(building_fc_wgs84)
+            safe_print(f"建物の数: {len(building_points)} ({building_points.nbytes / 1024 ** 2:.0f} MB)")
 
-        # --- 5. 近傍避難所の特定 (Python実装) ---
-        safe_print(f"各建物代表ポイントに最も近い {num_closest_shelters} 件の避難所を検索しています (Python実装)...")
-        near_dict = find_closest_shelters(aggregated_building_coords, shelter_coords_dict, num_closest_shelters, max_workers)
+            safe_print("避難所の座標をメモリに読み込んでいます...")
+            if file_io:
+                shelter_points = read_points(shelter_points_path)
+            else:
+                shelter_points = get_point_set_from_fc(shelter_fc_wgs84)
+            # OSRMへの問い合わせでは避難所を1件ずつ参照するため辞書も作る（件数が少ない）
+            shelter_coords_dict = shelter_points.to_dict()
+            safe_print(f"避難所の数: {len(shelter_coords_dict)}")
+
+        # 同時リクエスト数は初期値から自動調整（上限はサーバーごとにスレッド数 / asyncio の同時リクエスト数上限）
+        osrm_client.configure(
+            initial_concurrency=osrm_initial_concurrency,
+            max_concurrency=async_max_in_flight if routing_engine == "asyncio" else max_workers,
+            connect_timeout=osrm_connect_timeout,
+            read_timeout=osrm_read_timeout,
+            max_attempts=osrm_max_attempts,
+            backends=osrm_backends,
+        )
+        route_geometry.configure(geometries=route_geometry_format, simplify_tolerance_m=route_simplify_tolerance_m)
 
         # --- OSRMサーバーの接続テスト ---
-        safe_print(f"OSRMサーバー ({osrm_url}) の接続をテストしています...")
-        max_retries = 1000  # 非常に大きな数に設定
-        retry_delay = 5  # 5秒待機
+        with metrics.stage("osrm_check"):
+            if osrm_backends:
+                # 応答しないサーバーには送らない（ヘルスチェックで回復すれば再開）
+                for backend_url, healthy in osrm_client.check_health().items():
+                    safe_print(f"OSRMサーバー ({backend_url}): {'正常' if healthy else '応答なし（回復するまで使用しません）'}")
+                if osrm_health_check_interval:
+                    osrm_client.start_health_checks(osrm_health_check_interval)
+            else:
+                safe_print(f"OSRMサーバー ({osrm_url}) の接続をテストしています...")
+                max_retries = 1000  # 非常に大きな数に設定
+                retry_delay = 5  # 5秒待機
+
+                for attempt in range(max_retries):
+                    try:
+                        # タイムアウトをNoneに設定して無限に待機
+                        test_response = requests.get(f"{osrm_url}/route/v1/driving/139.7670,35.6814;139.7671,35.6815", timeout=None)
+                        if test_response.status_code == 200:
+                            safe_print("OSRMサーバーに正常に接続できました。")
+                            break
+                        else:
+                            safe_print(f"OSRMサーバーの応答が異常です。ステータスコード: {test_response.status_code}")
+                            break
+                    except requests.exceptions.ConnectionError as e:
+                        safe_print(f"OSRMサーバー接続エラー (試行 {attempt + 1}/{max_retries}): {e}")
+                        if attempt < max_retries - 1:
+                            safe_print(f"{retry_delay}秒後に再試行します...")
+                            time.sleep(retry_delay)
+                        else:
+                            safe_print(f"OSRMサーバーに接続できません（{max_retries}回試行後）: {e}")
+                            safe_print("ルート検索はスキップされますが、集約ポイントは保存されます。")
+                    except Exception as e:
+                        safe_print(f"OSRMサーバーに接続できません: {e}")
+                        safe_print("ルート検索はスキップされますが、集約ポイントは保存されます。")
+                        break
+
+        # --- 到達時間ラスタ (建物の集約・ルート検索は行わない) ---
+        if output_mode == "raster":
+            with metrics.stage("raster"):
+                raster_stats = build_accessibility_raster(
+                    accessibility_raster_path, building_points, shelter_coords_dict, osrm_url,
+                    accessibility_cell_size_m, num_closest_shelters, max_table_size,
+                    tile_cells=accessibility_tile_cells,
+                    max_distance_m=shelter_search_max_distance_m,
+                    building_distance_m=accessibility_building_distance_m,
+                    routing_engine=routing_engine, max_workers=max_workers,
+                    max_connections=async_max_connections, max_in_flight=async_max_in_flight,
+                )
+            run_summary['raster'] = raster_stats
+            run_summary['osrm'] = osrm_client.stats()
+            safe_print(f"到達時間ラスタを保存しました: {accessibility_raster_path}")
+            safe_print(f"  計算したセル: {raster_stats['queried']} / {raster_stats['cells']} 件, "
+                       f"値が入ったセル: {raster_stats['filled']} 件")
+            return
 
-        for attempt in range(max_retries):
-            try:
-                # タイムアウトをNoneに設定して無限に待機
-                test_response = requests.get(f"{osrm_url}/route/v1/driving/139.7670,35.6814;139.7671,35.6815", timeout=None)
-                if test_response.status_code == 200:
-                    safe_print("OSRMサーバーに正常に接続できました。")
-                    break
-                else:
-                    safe_print(f"OSRMサーバーの応答が異常です。ステータスコード: {test_response.status_code}")
-                    break
-            except requests.exceptions.ConnectionError as e:
-                safe_print(f"OSRMサーバー接続エラー (試行 {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    safe_print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
+        # --- 4. 建物ポイントの集約 (最適化実装) ---
+        with metrics.stage("aggregation"):
+            safe_print(f"建物ポイントを半径 {aggregation_radius_meters}m で集約しています (最適化実装)...")
+            # NumPy版（最高速）
+            # aggregated_points, membership = aggregate_points_by_grid_max_speed(
+            #     building_points, aggregation_radius_meters, return_membership=True)
+            # C++版
+            aggregated_points, membership = aggregate_points_by_cpp_server(building_points,
+                                                                           aggregation_radius_meters,
+                                                                           mode=cpp_clustering_mode,
+                                                                           backend=cpp_aggregation_backend,
+                                                                           membership=True)
+            # 建物の座標は以降使わない（対応表の OID は membership が保持）
+            del building_points
+            total_aggregated_buildings = len(aggregated_points)
+            safe_print(f"建物の集約が完了しました。代表ポイント数: {total_aggregated_buildings}")
+
+            # 建物ごとの集約建物OIDを対応表に保存（空間結合なしで結果を建物に戻せるように）
+            if membership_table_name:
+                if file_io:
+                    write_table(os.path.join(output_dir, f"{membership_table_name}.parquet"), membership_rows(membership))
                 else:
-                    safe_print(f"OSRMサーバーに接続できません（{max_retries}回試行後）: {e}")
-                    safe_print("ルート検索はスキップされますが、集約ポイントは保存されます。")
-            except Exception as e:
-                safe_print(f"OSRMサーバーに接続できません: {e}")
-                safe_print("ルート検索はスキップされますが、集約ポイントは保存されます。")
-                break
+                    write_membership_table(gdb_path, membership_table_name, membership)
+                safe_print(f"建物と集約建物の対応表 '{membership_table_name}' を保存しました。({len(membership['oids'])} 件)")
 
+        # --- 5. 近傍避難所の特定 (Python実装) ---
+        with metrics.stage("knn"):
+            safe_print(f"各建物代表ポイントに最も近い {num_closest_shelters} 件の避難所を検索しています (Python実装)...")
+            near_oids = find_closest_shelters(aggregated_points, shelter_points, num_closest_shelters,
+                                              max_distance_m=shelter_search_max_distance_m)
 
         # --- 集約建物ポイントの新規レイヤー作成 ---
-        agg_points_fc_name = "Aggregated_Buildings"
-        safe_print(f"集約建物ポイントフィーチャクラス '{agg_points_fc_name}' を作成しています...")
-        if arcpy.Exists(agg_points_fc_name):
-            arcpy.management.Delete(agg_points_fc_name)
-
-        arcpy.management.CreateFeatureclass(
-            gdb_path,
-            agg_points_fc_name,
-            "POINT",
-            spatial_reference=wgs84_sr
-        )
-        safe_print(f"集約建物ポイントフィーチャクラス '{agg_points_fc_name}' の作成が完了しました。")
-
-        # フィールドを追加
-        arcpy.management.AddField(agg_points_fc_name, "Agg_OID", "LONG", field_alias="集約建物OID")
-        arcpy.management.AddField(agg_points_fc_name, "Nearest", "LONG", field_alias="最寄り避難所OID")
-        arcpy.management.AddField(agg_points_fc_name, "Drtn_sec", "DOUBLE", field_alias="所要時間(秒)")
-        arcpy.management.AddField(agg_points_fc_name, "Dstnc_m", "DOUBLE", field_alias="距離(m)")
-        safe_print("集約建物ポイントフィーチャクラスのフィールドの追加が完了しました。")
-
-        # --- 6. 出力フィーチャクラスの作成 ---
-        safe_print(f"出力フィーチャクラス '{output_fc_name}' を作成しています...")
-        if arcpy.Exists(output_fc_name):
-            arcpy.management.Delete(output_fc_name)
-        arcpy.management.CreateFeatureclass(
-            gdb_path,
-            output_fc_name,
-            "POLYLINE",
-            spatial_reference=wgs84_sr
-        )
-        arcpy.management.AddField(output_fc_name, "Agg_OID", "LONG", field_alias="集約建物OID")  # 集約建物OID
-        arcpy.management.AddField(output_fc_name, "Shltr_OID", "LONG", field_alias="避難所OID")  # 避難所OID
-        arcpy.management.AddField(output_fc_name, "Drtn_sec", "DOUBLE", field_alias="所要時間(秒)")  # 所要時間(秒)
-        arcpy.management.AddField(output_fc_name, "Dstnc_m", "DOUBLE", field_alias="距離(m)")  # 距離(m)
+        with metrics.stage("create_output"):
+            agg_points_fc_name = "Aggregated_Buildings"
+            if file_io:
+                # ファイルは書き込みスレッドが作成する（既存のファイルは置き換える）
+                safe_print(f"結果を {output_dir} に {output_file_format} 形式で書き出します。")
+                if not output_fc_name:
+                    safe_print("所要時間・距離のみを出力します（ルートのファイルは作成しません）。")
+            else:
+                safe_print(f"集約建物ポイントフィーチャクラス '{agg_points_fc_name}' を作成しています...")
+                if arcpy.Exists(agg_points_fc_name):
+                    arcpy.management.Delete(agg_points_fc_name)
+
+                arcpy.management.CreateFeatureclass(
+                    gdb_path,
+                    agg_points_fc_name,
+                    "POINT",
+                    spatial_reference=wgs84_sr
+                )
+                safe_print(f"集約建物ポイントフィーチャクラス '{agg_points_fc_name}' の作成が完了しました。")
+
+                # フィールドを追加
+                arcpy.management.AddField(agg_points_fc_name, "Agg_OID", "LONG", field_alias="集約建物OID")
+                arcpy.management.AddField(agg_points_fc_name, "Nearest", "LONG", field_alias="最寄り避難所OID")
+                arcpy.management.AddField(agg_points_fc_name, "Drtn_sec", "DOUBLE", field_alias="所要時間(秒)")
+                arcpy.management.AddField(agg_points_fc_name, "Dstnc_m", "DOUBLE", field_alias="距離(m)")
+                safe_print("集約建物ポイントフィーチャクラスのフィールドの追加が完了しました。")
+
+                # --- 6. 出力フィーチャクラスの作成 ---
+                if output_fc_name:
+                    safe_print(f"出力フィーチャクラス '{output_fc_name}' を作成しています...")
+                    if arcpy.Exists(output_fc_name):
+                        arcpy.management.Delete(output_fc_name)
+                    arcpy.management.CreateFeatureclass(
+                        gdb_path,
+                        output_fc_name,
+                        "POLYLINE",
+                        spatial_reference=wgs84_sr
+                    )
+                    arcpy.management.AddField(output_fc_name, "Agg_OID", "LONG", field_alias="集約建物OID")  # 集約建物OID
+                    arcpy.management.AddField(output_fc_name, "Shltr_OID", "LONG", field_alias="避難所OID")  # 避難所OID
+                    arcpy.management.AddField(output_fc_name, "Drtn_sec", "DOUBLE", field_alias="所要時間(秒)")  # 所要時間(秒)
+                    arcpy.management.AddField(output_fc_name, "Dstnc_m", "DOUBLE", field_alias="距離(m)")  # 距離(m)
+                else:
+                    safe_print("所要時間・距離のみを出力します（ルートのフィーチャクラスは作成しません）。")
 
         # --- 7. ルート検索と保存 & 集約ポイント属性保存 (最適化バッチ並列処理版) ---
         safe_print(f"最適化バッチ並列処理を開始します（最大 {max_workers} スレッド）...")
 
-        # 処理対象のタスクリストを作成
+        # 処理対象のタスクリストを作成（near_oids は集約ポイントと同じ順序、-1 は候補なし）
+        # OSRMへの問い合わせとフィーチャの書き込みは1点ずつ扱うため、ここで集約ポイントごとの辞書にする
         tasks = []
-        for agg_bldg_oid, agg_bldg_coord in aggregated_building_coords.items():
-            nearby_shelter_oids = near_dict.get(agg_bldg_oid)
+        no_shelter_points = []
+        aggregated_building_coords = {}
+        for (agg_bldg_oid, agg_bldg_coord), shelter_oids in zip(aggregated_points.items(), near_oids.tolist()):
+            aggregated_building_coords[agg_bldg_oid] = agg_bldg_coord
+            nearby_shelter_oids = [oid for oid in shelter_oids if oid >= 0]
             if nearby_shelter_oids:
                 tasks.append((agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids))
+            else:
+                no_shelter_points.append((agg_bldg_oid, agg_bldg_coord))
+
+        if osrm_backends:
+            out_of_region = sum(1 for task in tasks if osrm_client.region_index(task[1]['lon'], task[1]['lat']) < 0)
+            if out_of_region:
+                safe_print(f"警告: {out_of_region} 件の建物はどのOSRMサーバーの担当範囲にも含まれません（スキップされます）")
+
+        # 近い建物をまとめ、1回の多対多Tableリクエストに収まるようにバッチ分割
+        batches = build_table_batches(tasks, max_table_size)
+        safe_print(f"Tableリクエスト数: {len(batches)} (建物 {len(tasks)} 件)")
+
+        # ルートキャッシュを開く
+        route_cache = None
+        if route_cache_path:
+            route_cache = RouteCache(route_cache_path, profile="walking", dataset_version=osrm_dataset_version,
+                                     max_bytes=route_cache_max_bytes)
+            safe_print(f"ルートキャッシュを使用します: {route_cache_path}")
+
+        # 書き込みスレッドを開始（ルート検索と並行して両フィーチャクラスに書き込む）
+        write_queue = queue.Queue(maxsize=writer_queue_size)
+        writer_stats = {'points': 0, 'routes': 0}
+        writer_thread = threading.Thread(
+            target=feature_writer_worker,
+            args=(write_queue, agg_points_fc_name, output_fc_name, writer_stats,
+                  output_dir if file_io else None, output_file_format),
+            daemon=True
+        )
+        writer_thread.start()
 
-        # バッチサイズを調整（OSRMサーバーの負荷を考慮）
-        batch_size = min(20, max(1, len(tasks) // max_workers))
-        batches = [tasks[i:i + batch_size] for i in range(0, len(tasks), batch_size)]
+        # 近傍避難所がない集約ポイントは属性なしで保存
+        for agg_bldg_oid, agg_bldg_coord in no_shelter_points:
+            write_queue.put((agg_bldg_oid, agg_bldg_coord, None, None, None, None))
 
         # 並列処理の実行
-        route_rows = []
         successful_routes = 0
         skipped_routes = 0
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # バッチを並列実行
-            future_to_batch = {
-                executor.submit(process_batch_routes, batch, shelter_coords_dict, osrm_url): batch
-                for batch in batches
-            }
-
-            # 結果を収集
-            with tqdm(total=len(tasks), desc="バッチ処理中（並列）", unit="件") as pbar:
-                for future in as_completed(future_to_batch):
-                    batch_results = future.result()
-
-                    for result in batch_results:
-                        agg_bldg_oid = result['agg_bldg_oid']
-                        agg_bldg_coord = result['agg_bldg_coord']
+        # ジャーナルの準備（実行条件が変わると Agg_OID の対応が変わるため一緒に記録する）
+        journal = RouteJournal(journal_dir, chunk_size=journal_chunk_size)
+        run_meta = {
+            'building_fc': building_points_path if file_io else building_fc_name,
+            'shelter_fc': shelter_points_path if file_io else shelter_fc_name,
+            'aggregation_radius_meters': aggregation_radius_meters,
+            'cpp_clustering_mode': cpp_clustering_mode,
+            'num_closest_shelters': num_closest_shelters,
+            'shelter_search_max_distance_m': shelter_search_max_distance_m,
+            'num_aggregated': total_aggregated_buildings,
+            'osrm_dataset_version': osrm_dataset_version,
+        }
+        if attributes_only:
+            # ジオメトリを持たないジャーナルをルート出力の再開に使わないよう区別する
+            run_meta['output_mode'] = output_mode
+        if resume:
+            journaled_records = journal.load(run_meta)
+            for record in journaled_records:
+                write_queue.put((
+                    record['agg_oid'],
+                    aggregated_building_coords[record['agg_oid']],
+                    record['shltr_oid'],
+                    record['duration'],
+                    record['distance'],
+                    geometry_from_json(record['geometry'])
+                ))
+            successful_routes = len(journaled_records)
+
+            # ルート検索済みの集約建物はスキップ
+            done_oids = {record['agg_oid'] for record in journaled_records}
+            tasks = [task for task in tasks if task[0] not in done_oids]
+            batches = build_table_batches(tasks, max_table_size)
+            safe_print(f"ジャーナルから {len(journaled_records)} 件を再開しました。残り {len(tasks)} 件を処理します。")
+        else:
+            journal.start(run_meta)
 
-                        if result['success']:
-                            # 成功した場合
-                            successful_routes += 1
-
-                            # ルート情報を一時リストに格納
-                            geom = arcpy.AsShape(result['route_info']['geometry'])
-                            row_data = (
-                                geom,
-                                agg_bldg_oid,
-                                result['nearest_shltr']['oid'],
-                                result['route_info']['duration'],
-                                result['route_info']['distance']
-                            )
-                            route_rows.append(row_data)
+        with metrics.stage("routing"), tqdm(total=len(tasks), desc="バッチ処理中（並列）", unit="件") as pbar:
 
-                        else:
-                            # 失敗した場合
-                            skipped_routes += 1
-                            if result['error']:
-                                safe_print(f"建物OID {agg_bldg_oid} の処理中にエラー: {result['error']}")
-
-                        # 進捗表示を更新
-                        pbar.set_postfix({
-                            '成功': successful_routes,
-                            'スキップ': skipped_routes,
-                            '成功率': f"{(successful_routes / (successful_routes + skipped_routes) * 100):.1f}%" if (successful_routes + skipped_routes) > 0 else "0.0%"
-                        })
-                        pbar.update(1)
+            def handle_batch_results(batch_results):
+                """バッチの処理結果を集計し、書き込みスレッドとジャーナルに渡す"""
+                nonlocal successful_routes, skipped_routes
 
-        # 集約ポイントレイヤーにデータを保存
-        safe_print("集約ポイントレイヤーにデータを保存しています...")
-        safe_print(f"保存対象の集約ポイント数: {len(aggregated_building_coords)}")
+                # 書き込みが追いついているか（キューが上限付近なら書き込みが律速）
+                metrics.observe("write_queue_depth", write_queue.qsize())
 
-        try:
-            agg_cursor = arcpy.da.InsertCursor(agg_points_fc_name, ["SHAPE@XY", "Agg_OID", "Nearest", "Drtn_sec", "Dstnc_m"])
+                for result in batch_results:
+                    agg_bldg_oid = result['agg_bldg_oid']
+                    agg_bldg_coord = result['agg_bldg_coord']
 
-            # 成功したルートの情報を辞書に整理
-            successful_routes_dict = {}
-            for route_row in route_rows:
-                agg_bldg_oid = route_row[1]  # Agg_OID
-                successful_routes_dict[agg_bldg_oid] = {
-                    'shltr_oid': route_row[2],  # Shltr_OID
-                    'duration': route_row[3],   # Drtn_sec
-                    'distance': route_row[4]    # Dstnc_m
-                }
+                    if result['success']:
+                        # 成功した場合
+                        successful_routes += 1
 
-            # 全ての集約ポイントを保存
-            saved_count = 0
-            for agg_bldg_oid, agg_bldg_coord in aggregated_building_coords.items():
-                try:
-                    if agg_bldg_oid in successful_routes_dict:
-                        # 成功したルートがある場合
-                        route_data = successful_routes_dict[agg_bldg_oid]
-                        agg_cursor.insertRow([
-                            (agg_bldg_coord['lon'], agg_bldg_coord['lat']),
+                        # 書き込みスレッドに渡す（キューが満杯なら空くまで待機）
+                        write_queue.put((
                             agg_bldg_oid,
-                            route_data['shltr_oid'],
-                            route_data['duration'],
-                            route_data['distance']
-                        ])
+                            agg_bldg_coord,
+                            result['nearest_shltr']['oid'],
+                            result['route_info']['duration'],
+                            result['route_info']['distance'],
+                            result['route_info']['geometry']
+                        ))
+
+                        # ジャーナルに記録（chunk_size 件ごとにディスクへ書き出す）
+                        journal.append({
+                            'agg_oid': agg_bldg_oid,
+                            'shltr_oid': result['nearest_shltr']['oid'],
+                            'duration': result['route_info']['duration'],
+                            'distance': result['route_info']['distance'],
+                            'geometry': geometry_to_json(result['route_info']['geometry'])
+                        })
+
                     else:
-                        # ルート検索が失敗した場合
-                        agg_cursor.insertRow([
-                            (agg_bldg_coord['lon'], agg_bldg_coord['lat']),
-                            agg_bldg_oid,
-                            None,  # Nearest
-                            None,  # Drtn_sec
-                            None   # Dstnc_m
-                        ])
-                    saved_count += 1
-                except Exception as e:
-                    safe_print(f"集約ポイント {agg_bldg_oid} の保存中にエラー: {e}")
-                    continue
-
-            del agg_cursor
-            safe_print(f"集約ポイントの保存が完了しました。保存件数: {saved_count}")
+                        # 失敗した場合（集約ポイントは属性なしで保存）
+                        skipped_routes += 1
+                        write_queue.put((agg_bldg_oid, agg_bldg_coord, None, None, None, None))
+                        if result['error']:
+                            safe_print(f"建物OID {agg_bldg_oid} の処理中にエラー: {result['error']}")
+
+                    # 進捗表示を更新
+                    pbar.set_postfix({
+                        '成功': successful_routes,
+                        'スキップ': skipped_routes,
+                        '成功率': f"{(successful_routes / (successful_routes + skipped_routes) * 100):.1f}%" if (successful_routes + skipped_routes) > 0 else "0.0%"
+                    })
+                    pbar.update(1)
 
-        except Exception as e:
-            safe_print(f"集約ポイント保存中に致命的なエラー: {e}")
+            try:
+                if routing_engine == "asyncio":
+                    # 非同期I/O: 1スレッドでキープアライブ接続を共有し、多数のリクエストを同時実行
+                    safe_print(f"asyncioエンジンで実行します（接続数上限 {async_max_connections}, 同時リクエスト数上限 {async_max_in_flight}）")
+                    asyncio.run(run_batch_routes_async(
+                        batches, shelter_coords_dict, osrm_url,
+                        async_max_connections, async_max_in_flight, handle_batch_results, route_cache,
+                        attributes_only=attributes_only
+                    ))
+                else:
+                    process_batch = process_batch_attributes if attributes_only else process_batch_routes
+                    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                        # バッチを並列実行
+                        future_to_batch = {
+                            executor.submit(process_batch, batch, shelter_coords_dict, osrm_url, route_cache): batch
+                            for batch in batches
+                        }
+
+                        # 結果を収集
+                        for future in as_completed(future_to_batch):
+                            handle_batch_results(future.result())
+            finally:
+                # 中断された場合もバッファ中の結果をジャーナルに残す
+                journal.flush()
+
+                # 書き込みスレッドに終了を通知し、残りの書き込みを待つ
+                write_queue.put(None)
+                safe_print("残りのフィーチャを書き込んでいます...")
+                writer_thread.join()
+
+        run_summary.update({
+            'num_aggregated': total_aggregated_buildings,
+            'successful_routes': successful_routes,
+            'skipped_routes': skipped_routes,
+            'written_points': writer_stats['points'],
+            'written_routes': writer_stats['routes'],
+        })
+
+        for base_url, osrm_stats in osrm_client.stats().items():
+            safe_print(f"OSRM {base_url}: リクエスト {osrm_stats['requests']} 件, "
+                       f"最終的な同時リクエスト数 {osrm_stats['concurrency_limit']:.1f}, "
+                       f"サーキットブレーカー作動 {osrm_stats['circuit_opened']} 回")
+        run_summary['osrm'] = osrm_client.stats()
+
+        if route_cache is not None:
+            safe_print(f"ルートキャッシュ: ヒット {route_cache.hits} 件 / ミス {route_cache.misses} 件")
+            run_summary['route_cache'] = {'hits': route_cache.hits, 'misses': route_cache.misses}
+            route_cache.close()
+
+        safe_print(f"集約ポイントの保存が完了しました。保存件数: {writer_stats['points']}")
 
         # フィーチャクラスの存在確認
-        if arcpy.Exists(agg_points_fc_name):
+        if file_io:
+            agg_points_path = os.path.join(output_dir, f"{agg_points_fc_name}.{output_file_format}")
+            if os.path.exists(agg_points_path):
+                safe_print(f"ファイル '{agg_points_path}' が正常に作成されました。")
+            else:
+                safe_print(f"ファイル '{agg_points_path}' が見つかりません。")
+        elif arcpy.Exists(agg_points_fc_name):
             desc = arcpy.Describe(agg_points_fc_name)
             safe_print(f"フィーチャクラス '{agg_points_fc_name}' が正常に作成されました。")
             safe_print(f"  フィーチャ数: {arcpy.management.GetCount(agg_points_fc_name)[0]}")
@@ -324,38 +628,131 @@ def main():
         safe_print(f"  スキップ: {skipped_routes} 件")
         safe_print(f"  合計: {successful_routes + skipped_routes} 件")
 
-        # ルート情報をまとめて出力フィーチャクラスに保存
-        if route_rows:
-            safe_print(f"ルート情報を出力フィーチャクラスに保存しています... ({len(route_rows)} 件)")
-            insert_cursor = arcpy.da.InsertCursor(output_fc_name, ["SHAPE@", "Agg_OID", "Shltr_OID", "Drtn_sec", "Dstnc_m"])
-            for row_data in route_rows:
-                insert_cursor.insertRow(row_data)
-            del insert_cursor
-            safe_print("ルート情報の保存が完了しました。")
-        else:
+        if writer_stats['routes']:
+            safe_print(f"ルート情報の保存が完了しました。保存件数: {writer_stats['routes']}")
+        elif not attributes_only:
             safe_print("保存するルート情報がありませんでした。")
 
         safe_print("\n全ての処理が完了しました。")
         safe_print(f"作成されたフィーチャクラス:")
         safe_print(f"  - {agg_points_fc_name}: 集約建物ポイント")
-        if route_rows:
+        if writer_stats['routes']:
             safe_print(f"  - {output_fc_name}: ルート情報")
 
-    except arcpy.ExecuteError:
+    except ARCPY_ERRORS:
         safe_print(arcpy.GetMessages(2))
 
+    finally:
+        osrm_client.stop_health_checks()
+
+        # 途中で失敗した場合も、そこまでの計測結果を残す
+        safe_print(metrics.format_summary())
+        if metrics_report_path:
+            metrics.write_report(metrics_report_path, extra={'run': run_summary})
+            safe_print(f"計測レポートを保存しました: {metrics_report_path}")
+
+
+# MARK: フィーチャ書き込み
+def feature_writer_worker(write_queue, agg_points_fc_name, output_fc_name, writer_stats,
+                          output_dir=None, output_file_format="parquet"):
+    """
+    書き込みスレッドの本体
+
+    キューから受け取った結果を集約ポイントとルートの両フィーチャクラスに逐次書き込む。
+    キューの要素は (agg_bldg_oid, agg_bldg_coord, shltr_oid, duration, distance, geometry) で、
+    ルートがない集約ポイントは shltr_oid 以降が None。None を受け取ると終了する。
+    output_fc_name が None の場合（所要時間・距離のみの出力）はルートを書き込まない。
+    output_dir を指定した場合はジオデータベースの代わりに output_dir の
+    {フィーチャクラス名}.{output_file_format} (GeoParquet / FlatGeobuf) に書き出す。
+    カーソルは作成したスレッドでのみ使用するため、このスレッド内で開閉する。
+    """
+    agg_cursor = None
+    route_cursor = None
+    try:
+        if output_dir:
+            # InsertCursor と同じ insertRow で受け取り、まとめて列ごとに書き出す
+            agg_cursor = FeatureFileWriter(
+                os.path.join(output_dir, f"{agg_points_fc_name}.{output_file_format}"), "Point",
+                [("Agg_OID", "int32"), ("Nearest", "int32"), ("Drtn_sec", "float64"), ("Dstnc_m", "float64")])
+            if output_fc_name:
+                route_cursor = FeatureFileWriter(
+                    os.path.join(output_dir, f"{output_fc_name}.{output_file_format}"), "LineString",
+                    [("Agg_OID", "int32"), ("Shltr_OID", "int32"), ("Drtn_sec", "float64"), ("Dstnc_m", "float64")])
+        else:
+            agg_cursor = arcpy.da.InsertCursor(agg_points_fc_name, ["SHAPE@XY", "Agg_OID", "Nearest", "Drtn_sec", "Dstnc_m"])
+            if output_fc_name:
+                route_cursor = arcpy.da.InsertCursor(output_fc_name, ["SHAPE@", "Agg_OID", "Shltr_OID", "Drtn_sec", "Dstnc_m"])
+    except Exception as e:
+        safe_print(f"書き込みカーソルの作成中に致命的なエラー: {e}")
+
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+
+        # カーソルを作成できなかった場合もルート検索側が待機しないようキューは空にする
+        if agg_cursor is None or (output_fc_name and route_cursor is None):
+            continue
+
+        agg_bldg_oid, agg_bldg_coord, shltr_oid, duration, distance, geometry = item
+        write_start = time.perf_counter()
+        try:
+            agg_cursor.insertRow([
+                (agg_bldg_coord['lon'], agg_bldg_coord['lat']),
+                agg_bldg_oid,
+                shltr_oid,  # Nearest
+                duration,   # Drtn_sec
+                distance    # Dstnc_m
+            ])
+            writer_stats['points'] += 1
+
+            if geometry is not None and route_cursor is not None:
+                shape = geometry if output_dir else arcpy.AsShape(geometry_to_geojson(geometry))
+                route_cursor.insertRow([shape, agg_bldg_oid, shltr_oid, duration, distance])
+                writer_stats['routes'] += 1
+        except Exception as e:
+            safe_print(f"集約ポイント {agg_bldg_oid} の保存中にエラー: {e}")
+        # ルート検索と並行して動くため、ステージ時間には書き込みにかかった時間だけを加算する
+        metrics.add_stage_time("write", time.perf_counter() - write_start)
+
+    # ファイルは close で残りを書き出して完成させる
+    for cursor in (agg_cursor, route_cursor):
+        if isinstance(cursor, FeatureFileWriter):
+            try:
+                cursor.close()
+            except Exception as e:
+                safe_print(f"{cursor.path} の書き出し中にエラー: {e}")
+
+    del agg_cursor
+    del route_cursor
+
 
 # MARK: ポイント集約
-def aggregate_points_by_grid_max_speed(points_dict, radius_m):
-    """最高速ポイント集約 - NumPy Advanced Indexing実装（極限最適化版）"""
-    points_data = list(points_dict.values())
-    if not points_data:
-        return {}
+def aggregate_points_by_grid_max_speed(points_dict, radius_m, hull_min_points=4, return_membership=False):
+    """
+    最高速ポイント集約 - ソートベースのグループ集約実装
+
+    グリッドIDで1回だけ argsort し、同じグリッドの点を連続したスライスとして扱う。
+    重心は np.add.reduceat でまとめて計算し、凸包の重心は hull_min_points 点以上の
+    グループだけで計算する（3点以下では凸包の頂点の平均は算術平均と一致するため）。
+
+    points_dict は辞書または PointSet で、集約結果も同じ形式で返す（Agg_OID は1から）。
+
+    return_membership が True の場合は (集約結果, 所属グループ) を返す。所属グループは
+    {'oids': 入力点のOID, 'cluster_ids': 各点の Agg_OID, 'counts': Agg_OID ごとの点数（counts[i] が Agg_OID i + 1）}
+    """
+    columnar = isinstance(points_dict, PointSet)
+    points = as_point_set(points_dict)
+    if not len(points):
+        empty_result = PointSet([], [], []) if columnar else {}
+        if return_membership:
+            empty = np.empty(0, dtype=np.int32)
+            return empty_result, {'oids': np.empty(0, dtype=np.int64), 'cluster_ids': empty, 'counts': empty}
+        return empty_result
 
-    safe_print(f"集約対象ポイント数: {len(points_data)}")
+    safe_print(f"集約対象ポイント数: {len(points)}")
 
-    # NumPy配列として一括変換（最適化）
-    coords = np.array([[p['lon'], p['lat']] for p in points_data], dtype=np.float64)
+    coords = np.column_stack([points.lon, points.lat])
 
     # 参照点（重心）
     ref_point = np.mean(coords, axis=0)
@@ -371,131 +768,620 @@ def aggregate_points_by_grid_max_speed(points_dict, radius_m):
 
     # グリッドインデックス（完全ベクトル化）
     grid_size = radius_m * 2.0
-    grid_indices = np.floor(xy / grid_size).astype(np.int32)
+    grid_indices = np.floor(xy / grid_size).astype(np.int64)
+
+    # グリッドを衝突のない64bitのIDに変換（最小値からのオフセット × y方向のセル数）
+    grid_x = grid_indices[:, 0] - grid_indices[:, 0].min()
+    grid_y = grid_indices[:, 1] - grid_indices[:, 1].min()
+    grid_ids = grid_x * (grid_y.max() + 1) + grid_y
+
+    # グリッドIDで1回だけソートし、同じグリッドの点を連続したスライスにする
+    order = np.argsort(grid_ids, kind='stable')
+    sorted_ids = grid_ids[order]
+    sorted_coords = coords[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_ids)) + 1))
+    counts = np.diff(np.append(starts, len(sorted_ids)))
+
+    # 算術平均の重心をまとめて計算
+    centroids = np.add.reduceat(sorted_coords, starts, axis=0) / counts[:, None]
+
+    # 凸包の重心を計算（図形の内側に重心が来るように）。点数が少ないグループは算術平均のまま
+    hull_groups = np.flatnonzero(counts >= hull_min_points)
+    for i in tqdm(hull_groups, desc="集約処理（凸包）"):
+        group_coords = sorted_coords[starts[i]:starts[i] + counts[i]]
+        try:
+            # 凸包の頂点座標の重心を計算
+            hull = ConvexHull(group_coords)
+            centroids[i] = np.mean(group_coords[hull.vertices], axis=0)
+        except Exception:
+            # 凸包計算に失敗した場合は算術平均を使用
+            pass
+
+    if columnar:
+        aggregated_points = PointSet(np.arange(1, len(centroids) + 1), centroids[:, 0], centroids[:, 1])
+    else:
+        aggregated_points = {}
+        for i, (lon, lat) in enumerate(centroids.tolist()):
+            aggregated_points[i + 1] = {
+                'oid': i + 1,
+                'lon': lon,
+                'lat': lat
+            }
 
-    # グリッドを一意のIDに変換（より効率的）
-    grid_ids = grid_indices[:, 0] * 100000 + grid_indices[:, 1]
+    if return_membership:
+        # ソート順のグループ番号を入力順に戻す
+        cluster_ids = np.empty(len(points), dtype=np.int32)
+        cluster_ids[order] = np.repeat(np.arange(1, len(counts) + 1, dtype=np.int32), counts)
+        membership = {
+            'oids': points.oid,
+            'cluster_ids': cluster_ids,
+            'counts': counts.astype(np.int32)
+        }
+        return aggregated_points, membership
 
-    # ユニークなグリッドを高速取得
-    unique_ids, inverse_indices = np.unique(grid_ids, return_inverse=True)
+    return aggregated_points
 
-    # 最高速集約：凸包を使用した重心計算
-    aggregated_points = {}
 
-    for i in tqdm(range(len(unique_ids)), desc="集約処理"):
-        mask = inverse_indices == i
-        group_coords = coords[mask]
+def write_membership_table(gdb_path, table_name, membership):
+    """
+    建物OID (BLDG_OID) と集約建物OID (Agg_OID)、集約建物の構成建物数 (Agg_Count) の対応表を書き出す
 
-        # 凸包の重心を計算（図形の内側に重心が来るように）
-        if len(group_coords) >= 3:
-            try:
-                # 凸包を計算
-                hull = ConvexHull(group_coords)
-                # 凸包の頂点座標の重心を計算
-                hull_points = group_coords[hull.vertices]
-                centroid = np.mean(hull_points, axis=0)
-            except Exception:
-                # 凸包計算に失敗した場合は算術平均を使用
-                centroid = np.mean(group_coords, axis=0)
-        else:
-            # 点数が3未満の場合は算術平均を使用
-            centroid = np.mean(group_coords, axis=0)
+    Args:
+        gdb_path: 出力先のジオデータベース
+        table_name: テーブル名（既存の場合は置き換える）
+        membership: aggregate_points_by_cpp_server / aggregate_points_by_grid_max_speed が返す所属グループ
+    """
+    table_path = os.path.join(gdb_path, table_name)
+    if arcpy.Exists(table_path):
+        arcpy.management.Delete(table_path)
+    arcpy.da.NumPyArrayToTable(membership_rows(membership), table_path)
 
-        aggregated_points[i + 1] = {
-            'oid': i + 1,
-            'lon': centroid[0],
-            'lat': centroid[1]
-        }
 
-    return aggregated_points
+def membership_rows(membership):
+    """対応表の行 (BLDG_OID, Agg_OID, Agg_Count) の構造化配列"""
+    cluster_ids = np.asarray(membership['cluster_ids'])
+    rows = np.empty(len(cluster_ids), dtype=[('BLDG_OID', '<i4'), ('Agg_OID', '<i4'), ('Agg_Count', '<i4')])
+    rows['BLDG_OID'] = membership['oids']
+    rows['Agg_OID'] = cluster_ids
+    rows['Agg_Count'] = np.asarray(membership['counts'])[cluster_ids - 1]
+    return rows
 
 
 # MARK: 近傍検索
-def find_closest_shelters(aggregated_points, shelters, num_closest, max_workers):
-    """KDTreeを使った高速近傍検索"""
+def find_closest_shelters(aggregated_points, shelters, num_closest, workers=-1, max_distance_m=None):
+    """
+    KDTreeを使った高速近傍検索（全点を一括変換し、1回の並列クエリで検索）
+
+    Args:
+        aggregated_points: 集約ポイントの辞書または PointSet
+        shelters: 避難所の辞書または PointSet
+        num_closest: 各ポイントの候補避難所数
+        workers: KDTree検索の並列数（-1 で全コア）
+        max_distance_m: 候補とする最大直線距離（メートル、None で無制限）
+
+    Returns:
+        (集約ポイント数, num_closest) の int64 配列。行は aggregated_points の順序で、
+        近い順に避難所OIDが並ぶ。候補がない欄は -1
+    """
+    num_points = len(aggregated_points)
+    if num_points == 0 or not len(shelters):
+        return np.full((num_points, num_closest), -1, dtype=np.int64)
 
-    # 避難所の座標を配列に変換（度数をラジアンに変換）
-    shelter_list = list(shelters.values())
-    shelter_coords = np.array([[s['lat'], s['lon']] for s in shelter_list])
-    shelter_coords_rad = np.radians(shelter_coords)
+    # 避難所を単位球面上の3D座標に変換
+    shelters = as_point_set(shelters)
+    shelter_oids = shelters.oid
+    tree = KDTree(lat_lon_to_unit_xyz(shelters.lat_lon()))
 
-    # 球面座標を3D直交座標に変換（より正確な距離計算のため）
-    x = np.cos(shelter_coords_rad[:, 0]) * np.cos(shelter_coords_rad[:, 1])
-    y = np.cos(shelter_coords_rad[:, 0]) * np.sin(shelter_coords_rad[:, 1])
-    z = np.sin(shelter_coords_rad[:, 0])
-    shelter_3d = np.column_stack([x, y, z])
+    # 集約ポイントも一括で3D座標に変換
+    point_xyz = lat_lon_to_unit_xyz(as_point_set(aggregated_points).lat_lon())
 
-    # KDTreeを構築
-    tree = KDTree(shelter_3d)
+    # 距離の上限は球面上の弧長を単位球の弦長に換算
+    if max_distance_m is None:
+        distance_upper_bound = np.inf
+    else:
+        distance_upper_bound = 2.0 * np.sin(max_distance_m / (2.0 * 6371000.0))
 
-    near_dict = {}
-    for agg_oid, agg_point in aggregated_points.items():
-        # 集約ポイントも3D座標に変換
-        lat_rad, lon_rad = np.radians([agg_point['lat'], agg_point['lon']])
-        point_x = np.cos(lat_rad) * np.cos(lon_rad)
-        point_y = np.cos(lat_rad) * np.sin(lon_rad)
-        point_z = np.sin(lat_rad)
+    # 全点を1回の並列クエリで検索
+    _, indices = tree.query(point_xyz, k=num_closest, distance_upper_bound=distance_upper_bound, workers=workers)
+    indices = np.asarray(indices).reshape(num_points, num_closest)
 
-                # 最近傍検索
-        distances, indices = tree.query([point_x, point_y, point_z], k=num_closest)
+    # 見つからなかった欄（インデックス = 避難所数）は -1
+    found = indices < len(shelter_oids)
+    near_oids = np.full(indices.shape, -1, dtype=np.int64)
+    near_oids[found] = shelter_oids[indices[found]]
 
-        # 単一の結果の場合は配列に変換
-        if np.isscalar(indices):
-            indices = np.array([indices])
-        elif not isinstance(indices, np.ndarray):
-            indices = np.array(indices)
+    return near_oids
 
-        closest_shelter_oids = [shelter_list[int(i)]['oid'] for i in indices]
-        near_dict[agg_oid] = closest_shelter_oids
 
-    return near_dict
+def lat_lon_to_unit_xyz(lat_lon_deg):
+    """(緯度, 経度) [度] の配列を単位球面上の3D直交座標に変換"""
+    lat_lon_rad = np.radians(lat_lon_deg)
+    cos_lat = np.cos(lat_lon_rad[:, 0])
+    return np.column_stack([
+        cos_lat * np.cos(lat_lon_rad[:, 1]),
+        cos_lat * np.sin(lat_lon_rad[:, 1]),
+        np.sin(lat_lon_rad[:, 0])
+    ])
 
 
 # MARK: データ読み込み
-def get_coords_dict_from_fc(feature_class):
-    """メモリ効率的なデータ読み込み"""
+def get_point_set_from_fc(feature_class):
+    """
+    ポイントフィーチャクラスを列指向の PointSet として一括で読み込む（arcpy.da.FeatureClassToNumPyArray）
 
-    coords_dict = {}
-    chunk_size = 10000
+    ジオメトリが空のフィーチャは除外する。
+    """
+    rows = arcpy.da.FeatureClassToNumPyArray(feature_class, ["OID@", "SHAPE@X", "SHAPE@Y"], skip_nulls=True)
+    return PointSet(rows["OID@"], rows["SHAPE@X"], rows["SHAPE@Y"])
 
-    with arcpy.da.SearchCursor(feature_class, ["OID@", "SHAPE@XY"]) as cursor:
-        chunk = []
-        for row in cursor:
-            chunk.append(row)
-            if len(chunk) >= chunk_size:
-                # チャンクを処理
-                for oid, (lon, lat) in chunk:
-                    coords_dict[oid] = {'oid': oid, 'lon': lon, 'lat': lat}
-                chunk = []
 
-        # 残りを処理
-        for oid, (lon, lat) in chunk:
-            coords_dict[oid] = {'oid': oid, 'lon': lon, 'lat': lat}
+# MARK: バッチ分割
+def build_table_batches(tasks, max_table_size):
+    """
+    近い建物同士を同じバッチにまとめ、Tableリクエストの座標数上限に収まるよう分割
 
-    return coords_dict
+    OSRMサーバーのプールを使う場合は、1つのバッチが同じ担当範囲の建物だけになるよう範囲の境界でも分割する。
+    """
+    # 担当範囲ごとに、約2kmの帯ごとに経度順で並べる（近くの建物は候補避難所を共有しやすい）
+    keyed_tasks = sorted(
+        ((osrm_client.region_index(task[1]['lon'], task[1]['lat']), int(task[1]['lat'] // 0.02), task[1]['lon']), task)
+        for task in tasks
+    )
+
+    batches = []
+    batch = []
+    batch_shelters = set()
+    batch_region = None
+    for (region, _, _), task in keyed_tasks:
+        merged_shelters = batch_shelters.union(task[2])
+        # 建物数 + 避難所数 が上限を超える場合、担当範囲が変わる場合は新しいバッチを開始
+        if batch and (len(batch) + 1 + len(merged_shelters) > max_table_size or region != batch_region):
+            batches.append(batch)
+            batch = []
+            merged_shelters = set(task[2])
+        batch.append(task)
+        batch_shelters = merged_shelters
+        batch_region = region
+
+    if batch:
+        batches.append(batch)
+
+    return batches
 
 
 # MARK: ルート処理
-def process_batch_routes(batch_tasks, shelter_coords_dict, osrm_url):
-    """バッチでルート処理"""
+def process_batch_routes(batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """
+    バッチでルート処理（Tableサービスはバッチ全体で1回の多対多リクエストにまとめる）
+
+    Tableの検索中の想定外の例外（応答の解析やキャッシュのエラーなど）では実行を止めず、
+    バッチの全建物を失敗として返す。
+    """
+    try:
+        closest_list = find_closest_by_table_batch(batch_tasks, shelter_coords_dict, osrm_url, route_cache)
+    except Exception as e:
+        return build_batch_failure_results(batch_tasks, e)
+
+    # 多対多リクエストが失敗した場合は個別処理にフォールバック
+    if closest_list is None:
+        return [
+            process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shelter_coords_dict, osrm_url,
+                                 route_cache)
+            for agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids in batch_tasks
+        ]
+
     results = []
+    for (agg_bldg_oid, agg_bldg_coord, _), (closest_shelter, min_duration) in zip(batch_tasks, closest_list):
+        if closest_shelter is None:
+            results.append({
+                'agg_bldg_oid': agg_bldg_oid,
+                'agg_bldg_coord': agg_bldg_coord,
+                'success': False,
+                'nearest_shltr': None,
+                'route_info': None,
+                'error': 'OSRM Tableサービスが失敗しました'
+            })
+            continue
+
+        results.append(process_route_to_shelter(agg_bldg_oid, agg_bldg_coord, closest_shelter, osrm_url, route_cache))
+
+    return results
+
+
+def build_batch_failure_results(batch_tasks, error):
+    """バッチの処理中に想定外の例外が発生した場合の、建物ごとの失敗結果（process_single_route と同じ形式）"""
+    safe_print(f"バッチ処理エラー: {error}")
+    metrics.count("table_errors")
+    return [
+        {
+            'agg_bldg_oid': agg_bldg_oid,
+            'agg_bldg_coord': agg_bldg_coord,
+            'success': False,
+            'nearest_shltr': None,
+            'route_info': None,
+            'error': str(error)
+        }
+        for agg_bldg_oid, agg_bldg_coord, _ in batch_tasks
+    ]
+
+
+# MARK: バッチ最短避難所検索
+def find_closest_by_table_batch(batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """
+    OSRMのTableサービスを多対多で1回だけ呼び出し、バッチ内の各建物から最も近い避難所を見つける
 
-    # バッチサイズが大きすぎる場合は分割処理
-    if len(batch_tasks) > 10:
-        # 大きなバッチは個別処理にフォールバック
-        for agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids in batch_tasks:
-            result = process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shelter_coords_dict, osrm_url)
-            results.append(result)
-        return results
+    バッチ内の候補避難所の和集合を destinations とし、各建物の行から
+    自身の候補避難所の列だけを比較して最小所要時間の避難所を選ぶ。
+    route_cache がある場合、キャッシュ済みの建物はOSRMに問い合わせない。
 
-    # 小さなバッチは個別処理で十分効率的
-    for agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids in batch_tasks:
-        result = process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shelter_coords_dict, osrm_url)
-        results.append(result)
+    Returns:
+        batch_tasks と同じ順序の (closest_shelter, min_duration) のリスト。
+        Tableサービス自体が失敗した場合は None
+    """
+    closest_list, miss_positions = resolve_closest_from_cache(batch_tasks, shelter_coords_dict, route_cache)
+    if not miss_positions:
+        return closest_list
+
+    miss_tasks = [batch_tasks[i] for i in miss_positions]
+    api_url, dest_index = build_table_batch_url(miss_tasks, shelter_coords_dict, osrm_url)
+    if api_url is None:
+        for i in miss_positions:
+            closest_list[i] = (None, None)
+        return closest_list
+
+    try:
+        data = osrm_client.get_json(api_url, "table", point=coord_point(miss_tasks[0][1]))
+    except requests.exceptions.HTTPError as e:
+        # 座標数の上限超過 (TooBig) などはフォールバックさせる
+        safe_print(f"OSRM Table API Error: {e}")
+        metrics.count("table_errors")
+        return None
+
+    if data is None:
+        # 再試行しても応答がない（サーバー障害）。1建物ずつにフォールバックせず失敗として返す
+        for i in miss_positions:
+            closest_list[i] = (None, None)
+        return closest_list
+
+    if data['code'] != 'Ok' or not data.get('durations'):
+        safe_print(f"OSRM Table API Error: {data.get('message', 'No message')}")
+        metrics.count("table_errors")
+        return None
+
+    store_table_in_cache(route_cache, data['durations'], miss_tasks, dest_index)
+    fetched = select_closest_from_table(data['durations'], miss_tasks, shelter_coords_dict, dest_index)
+    for i, closest in zip(miss_positions, fetched):
+        closest_list[i] = closest
+    return closest_list
+
+
+def build_table_batch_url(batch_tasks, shelter_coords_dict, osrm_url, annotations="duration"):
+    """
+    多対多TableリクエストのURLと、避難所OID→列番号の対応表を作成（候補がなければURLはNone）
 
+    annotations="duration,distance" で距離の行列も要求する。
+    """
+    # 候補避難所の和集合（出現順を保持）と列番号の対応表
+    dest_oids = []
+    dest_index = {}
+    for _, _, nearby_shelter_oids in batch_tasks:
+        for oid in nearby_shelter_oids:
+            if oid in shelter_coords_dict and oid not in dest_index:
+                dest_index[oid] = len(dest_oids)
+                dest_oids.append(oid)
+
+    if not dest_oids:
+        return None, dest_index
+
+    # 座標の文字列を作成: 建物 → 避難所 の順に並べる
+    num_sources = len(batch_tasks)
+    source_coords = [f"{coord['lon']},{coord['lat']}" for _, coord, _ in batch_tasks]
+    dest_coords = [f"{shelter_coords_dict[oid]['lon']},{shelter_coords_dict[oid]['lat']}" for oid in dest_oids]
+    locations_str = ";".join(source_coords + dest_coords)
+    sources_str = ";".join(str(i) for i in range(num_sources))
+    destinations_str = ";".join(str(num_sources + j) for j in range(len(dest_oids)))
+
+    api_url = (f"{osrm_url}/table/v1/walking/{locations_str}"
+               f"?sources={sources_str}&destinations={destinations_str}&annotations={annotations}")
+    return api_url, dest_index
+
+
+def select_closest_from_table(durations_matrix, batch_tasks, shelter_coords_dict, dest_index):
+    """Tableの所要時間行列から、各建物の候補避難所のうち最短のものを選ぶ"""
+    results = []
+    for durations, (_, _, nearby_shelter_oids) in zip(durations_matrix, batch_tasks):
+        shelter_durations = table_row_to_durations(durations, nearby_shelter_oids, dest_index)
+        results.append(select_closest_shelter(shelter_durations, nearby_shelter_oids, shelter_coords_dict))
     return results
 
 
+def table_row_to_durations(durations, nearby_shelter_oids, dest_index):
+    """Tableの1行から {候補避難所OID: 所要時間} を取り出す（到達不能は None）"""
+    return {oid: durations[dest_index[oid]] for oid in nearby_shelter_oids if oid in dest_index}
+
+
+def select_closest_shelter(shelter_durations, nearby_shelter_oids, shelter_coords_dict):
+    """{避難所OID: 所要時間} から最短の避難所を選び、(closest_shelter, min_duration) を返す"""
+    min_duration = float('inf')
+    closest_shelter_oid = None
+
+    # 候補避難所の順に比較（同じ所要時間なら先の候補を優先）
+    for oid in nearby_shelter_oids:
+        duration = shelter_durations.get(oid)
+        if duration is not None and duration < min_duration:
+            min_duration = duration
+            closest_shelter_oid = oid
+
+    if closest_shelter_oid is None:
+        return None, None
+    return shelter_coords_dict[closest_shelter_oid], min_duration
+
+
+# MARK: ルートキャッシュ
+def resolve_closest_from_cache(batch_tasks, shelter_coords_dict, route_cache):
+    """
+    キャッシュ済みのTable結果から最寄り避難所を解決する
+
+    Returns:
+        (closest_list, miss_positions)。closest_list は batch_tasks と同じ順序で、
+        未解決の位置は None。miss_positions はOSRMへの問い合わせが必要な位置のリスト
+    """
+    if route_cache is None:
+        return [None] * len(batch_tasks), list(range(len(batch_tasks)))
+
+    closest_list = []
+    miss_positions = []
+    for i, (_, agg_bldg_coord, nearby_shelter_oids) in enumerate(batch_tasks):
+        candidate_oids = [oid for oid in nearby_shelter_oids if oid in shelter_coords_dict]
+        shelter_durations = route_cache.get_table_durations(agg_bldg_coord, candidate_oids)
+        if shelter_durations is None:
+            closest_list.append(None)
+            miss_positions.append(i)
+        else:
+            closest_list.append(select_closest_shelter(shelter_durations, nearby_shelter_oids, shelter_coords_dict))
+    return closest_list, miss_positions
+
+
+def store_table_in_cache(route_cache, durations_matrix, batch_tasks, dest_index):
+    """Tableの所要時間行列を建物・避難所ごとにキャッシュへ保存"""
+    if route_cache is None:
+        return
+    for durations, (_, agg_bldg_coord, nearby_shelter_oids) in zip(durations_matrix, batch_tasks):
+        route_cache.put_table_durations(agg_bldg_coord, table_row_to_durations(durations, nearby_shelter_oids, dest_index))
+
+
+# MARK: 所要時間・距離のみ (ルートなし)
+def process_batch_attributes(batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """
+    バッチの各建物について、最寄り避難所までの所要時間と距離だけを求める（Routeサービスは呼ばない）
+
+    Tableサービスに annotations=duration,distance を指定し、1回の多対多リクエストで所要時間と距離を取得する。
+    結果の形式は process_batch_routes と同じで、route_info の geometry は None。
+    想定外の例外（応答の解析やキャッシュのエラーなど）ではバッチの全建物を失敗として返す。
+    """
+    try:
+        costs_list = find_costs_by_table_batch(batch_tasks, shelter_coords_dict, osrm_url, route_cache)
+
+        # 多対多リクエストが失敗した場合は1建物ずつにフォールバック
+        if costs_list is None:
+            costs_list = [
+                (find_costs_by_table_batch([task], shelter_coords_dict, osrm_url, route_cache)
+                 or [(None, None, None)])[0]
+                for task in batch_tasks
+            ]
+    except Exception as e:
+        safe_print(f"バッチ処理エラー: {e}")
+        metrics.count("table_errors")
+        costs_list = [(None, None, None)] * len(batch_tasks)
+
+    return [build_attributes_result(agg_bldg_oid, agg_bldg_coord, *costs)
+            for (agg_bldg_oid, agg_bldg_coord, _), costs in zip(batch_tasks, costs_list)]
+
+
+def find_costs_by_table_batch(batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """
+    find_closest_by_table_batch の所要時間・距離版
+
+    Returns:
+        batch_tasks と同じ順序の (closest_shelter, duration, distance) のリスト。
+        Tableサービス自体が失敗した場合は None
+    """
+    costs_list, miss_positions = resolve_costs_from_cache(batch_tasks, shelter_coords_dict, route_cache)
+    if not miss_positions:
+        return costs_list
+
+    miss_tasks = [batch_tasks[i] for i in miss_positions]
+    api_url, dest_index = build_table_batch_url(miss_tasks, shelter_coords_dict, osrm_url,
+                                                annotations="duration,distance")
+    if api_url is None:
+        for i in miss_positions:
+            costs_list[i] = (None, None, None)
+        return costs_list
+
+    try:
+        data = osrm_client.get_json(api_url, "table", point=coord_point(miss_tasks[0][1]))
+    except requests.exceptions.HTTPError as e:
+        # 座標数の上限超過 (TooBig) などはフォールバックさせる
+        safe_print(f"OSRM Table API Error: {e}")
+        metrics.count("table_errors")
+        return None
+
+    return apply_costs_table(data, costs_list, miss_positions, miss_tasks, shelter_coords_dict, dest_index,
+                             route_cache)
+
+
+def apply_costs_table(data, costs_list, miss_positions, miss_tasks, shelter_coords_dict, dest_index, route_cache):
+    """所要時間・距離のTableの応答を costs_list の未解決の位置に反映する（応答が異常なら None）"""
+    if data is None:
+        # 再試行しても応答がない（サーバー障害）。1建物ずつにフォールバックせず失敗として返す
+        for i in miss_positions:
+            costs_list[i] = (None, None, None)
+        return costs_list
+
+    if data['code'] != 'Ok' or not data.get('durations') or not data.get('distances'):
+        safe_print(f"OSRM Table API Error: {data.get('message', 'No message')}")
+        metrics.count("table_errors")
+        return None
+
+    for i, durations, distances, (_, agg_bldg_coord, nearby_shelter_oids) in zip(
+            miss_positions, data['durations'], data['distances'], miss_tasks):
+        shelter_durations = table_row_to_durations(durations, nearby_shelter_oids, dest_index)
+        shelter_distances = table_row_to_durations(distances, nearby_shelter_oids, dest_index)
+        if route_cache is not None:
+            route_cache.put_table_durations(agg_bldg_coord, shelter_durations, shelter_distances)
+        costs_list[i] = select_closest_costs(shelter_durations, shelter_distances, nearby_shelter_oids,
+                                             shelter_coords_dict)
+    return costs_list
+
+
+def select_closest_costs(shelter_durations, shelter_distances, nearby_shelter_oids, shelter_coords_dict):
+    """select_closest_shelter に加えて、選んだ避難所までの距離を返す (closest_shelter, duration, distance)"""
+    closest_shelter, min_duration = select_closest_shelter(shelter_durations, nearby_shelter_oids,
+                                                           shelter_coords_dict)
+    if closest_shelter is None:
+        return None, None, None
+    return closest_shelter, min_duration, shelter_distances.get(closest_shelter['oid'])
+
+
+def resolve_costs_from_cache(batch_tasks, shelter_coords_dict, route_cache):
+    """resolve_closest_from_cache の所要時間・距離版（距離が未キャッシュの建物はOSRMに問い合わせる）"""
+    if route_cache is None:
+        return [None] * len(batch_tasks), list(range(len(batch_tasks)))
+
+    costs_list = []
+    miss_positions = []
+    for i, (_, agg_bldg_coord, nearby_shelter_oids) in enumerate(batch_tasks):
+        candidate_oids = [oid for oid in nearby_shelter_oids if oid in shelter_coords_dict]
+        costs = route_cache.get_table_costs(agg_bldg_coord, candidate_oids)
+        if costs is None:
+            costs_list.append(None)
+            miss_positions.append(i)
+        else:
+            costs_list.append(select_closest_costs({oid: cost[0] for oid, cost in costs.items()},
+                                                   {oid: cost[1] for oid, cost in costs.items()},
+                                                   nearby_shelter_oids, shelter_coords_dict))
+    return costs_list, miss_positions
+
+
+def build_attributes_result(agg_bldg_oid, agg_bldg_coord, closest_shelter, duration, distance):
+    """所要時間・距離のみの結果（process_route_to_shelter と同じ形式、geometry は None）"""
+    if closest_shelter is None:
+        return {
+            'agg_bldg_oid': agg_bldg_oid,
+            'agg_bldg_coord': agg_bldg_coord,
+            'success': False,
+            'nearest_shltr': None,
+            'route_info': None,
+            'error': 'OSRM Tableサービスが失敗しました'
+        }
+    return {
+        'agg_bldg_oid': agg_bldg_oid,
+        'agg_bldg_coord': agg_bldg_coord,
+        'success': True,
+        'nearest_shltr': closest_shelter,
+        'route_info': {'duration': duration, 'distance': distance, 'geometry': None},
+        'error': None
+    }
+
+
+# MARK: 到達時間ラスタ
+def build_accessibility_raster(raster_path, building_coords, shelter_coords_dict, osrm_url, cell_size_m,
+                               num_closest, max_table_size, tile_cells=256, max_distance_m=None,
+                               building_distance_m=None, routing_engine="thread", max_workers=32,
+                               max_connections=64, max_in_flight=1000):
+    """
+    調査範囲に等間隔のグリッドを重ね、各セルの中心から最寄り避難所までの徒歩の所要時間（秒）をラスタに書き出す
+
+    グリッドは tile_cells 四方のタイルごとに処理し、メモリに載せるのは1タイル分だけにする。
+    タイル内のセルは集約建物ポイントと同じ手順（find_closest_shelters → build_table_batches →
+    process_batch_attributes）で多対多Tableリクエストにまとめる。
+
+    Args:
+        raster_path: 出力先（.bil などは ESRI BIL、.npy は NumPy 配列。AccessibilityRasterWriter を参照）
+        building_coords: 建物の座標の辞書または PointSet（範囲と、建物から遠いセルの除外に使う）
+        shelter_coords_dict: 避難所座標の辞書
+        osrm_url: OSRMサーバーのURL
+        cell_size_m: セルの大きさ（メートル）
+        num_closest: 各セルの候補避難所数
+        max_table_size: 1回のTableリクエストの座標数の上限
+        tile_cells: タイルの1辺のセル数
+        max_distance_m: 候補とする避難所までの最大直線距離（メートル、None で無制限）
+        building_distance_m: 最寄りの建物がこれより遠いセル（海・山林など）は問い合わせず NODATA にする（None で全セル）
+        routing_engine: "thread" または "asyncio"
+        max_workers: thread エンジンのスレッド数
+        max_connections / max_in_flight: asyncio エンジンの接続数・同時実行バッチ数の上限
+
+    Returns:
+        {'rows', 'cols', 'cell_size_m', 'cells', 'queried', 'filled'}（queried は問い合わせたセル数、filled は値が入ったセル数）
+    """
+    building_points = as_point_set(building_coords)
+    grid = AccessibilityGrid.from_points(building_points.lon, building_points.lat, cell_size_m, margin_m=cell_size_m)
+
+    # 建物からの距離の判定用と、候補避難所の検索用（タイルごとに作り直さない）
+    building_tree = None
+    if building_distance_m is not None:
+        building_tree = KDTree(lat_lon_to_unit_xyz(building_points.lat_lon()))
+        building_chord = 2.0 * np.sin(building_distance_m / (2.0 * 6371000.0))
+    shelter_points = as_point_set(shelter_coords_dict)
+
+    stats = {'rows': grid.rows, 'cols': grid.cols, 'cell_size_m': cell_size_m, 'cells': grid.rows * grid.cols,
+             'queried': 0, 'filled': 0}
+    safe_print(f"到達時間ラスタ: {grid.rows} 行 × {grid.cols} 列 ({stats['cells']} セル, {cell_size_m}m)")
+
+    writer = AccessibilityRasterWriter(raster_path, grid)
+    executor = ThreadPoolExecutor(max_workers=max_workers) if routing_engine != "asyncio" else None
+    try:
+        with tqdm(total=stats['cells'], desc="到達時間ラスタ", unit="セル") as pbar:
+            for tile in grid.tiles(tile_cells):
+                lon, lat = grid.cell_centers(tile)
+                values = np.full(lon.size, NODATA, dtype=np.float32)
+
+                active = np.arange(lon.size)
+                if building_tree is not None:
+                    xyz = lat_lon_to_unit_xyz(np.column_stack([lat, lon]))
+                    distances, _ = building_tree.query(xyz, k=1, distance_upper_bound=building_chord)
+                    active = np.flatnonzero(np.isfinite(distances))
+
+                # セルの位置（タイル内の番号）を集約建物OIDの代わりに使う
+                cells = PointSet(active, np.round(lon[active], 6), np.round(lat[active], 6))
+                near_oids = find_closest_shelters(cells, shelter_points, num_closest, max_distance_m=max_distance_m)
+                tasks = []
+                for (cell_index, cell_coord), shelter_oids in zip(cells.items(), near_oids.tolist()):
+                    nearby_shelter_oids = [oid for oid in shelter_oids if oid >= 0]
+                    if nearby_shelter_oids:
+                        tasks.append((cell_index, cell_coord, nearby_shelter_oids))
+                del cells, near_oids
+
+                def handle_batch_results(batch_results):
+                    for result in batch_results:
+                        if result['success']:
+                            values[result['agg_bldg_oid']] = result['route_info']['duration']
+                    pbar.update(len(batch_results))
+
+                batches = build_table_batches(tasks, max_table_size)
+                if routing_engine == "asyncio":
+                    asyncio.run(run_batch_routes_async(batches, shelter_coords_dict, osrm_url, max_connections,
+                                                       max_in_flight, handle_batch_results, attributes_only=True))
+                else:
+                    futures = [executor.submit(process_batch_attributes, batch, shelter_coords_dict, osrm_url)
+                               for batch in batches]
+                    for future in as_completed(futures):
+                        handle_batch_results(future.result())
+
+                writer.write_tile(tile, values)
+                stats['queried'] += len(tasks)
+                stats['filled'] += int(np.count_nonzero(values != NODATA))
+                metrics.count("raster_tiles")
+                # 問い合わせなかったセルも進捗に含める
+                pbar.update(lon.size - len(tasks))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        writer.close()
+
+    return stats
+
+
 # MARK: 最短の避難所検索
 def find_closest_by_table(source_building, target_shelters, osrm_url):
     """OSRMのTableサービスを使い、3つの避難所から最も近い施設を見つける"""
@@ -507,71 +1393,66 @@ def find_closest_by_table(source_building, target_shelters, osrm_url):
     # API URLを作成（sources=0 は最初の座標=建物をソースとすることを意味する、徒歩モード "walking" を使用）
     api_url = f"{osrm_url}/table/v1/walking/{locations_str}?sources=0&annotations=duration"
 
-    # 無限に待機するための再試行ロジック
-    max_retries = 10000  # 非常に大きな数に設定
-
-    for attempt in range(max_retries):
-        try:
-            # タイムアウトをNoneに設定して無限に待機
-            response = requests.get(api_url, timeout=None)
-            response.raise_for_status()
-            data = response.json()
-
-            if data['code'] != 'Ok' or not data.get('durations'):
-                safe_print(f"OSRM Table API Error: {data.get('message', 'No message')}")
-                return None, None
+    # 再試行しても応答がない場合は None（サーバー障害）
+    data = osrm_client.get_json(api_url, "table", point=coord_point(source_building))
+    if data is None:
+        return None, None
 
-            durations = data['durations'][0]
-            min_duration = float('inf')
-            closest_shelter_index = -1
+    if data['code'] != 'Ok' or not data.get('durations'):
+        safe_print(f"OSRM Table API Error: {data.get('message', 'No message')}")
+        metrics.count("table_errors")
+        return None, None
 
-            # 最初の要素は建物自身(0)なのでスキップし、避難所との所要時間のみをチェック
-            for idx, duration in enumerate(durations[1:]):
-                if duration is not None and duration < min_duration:
-                    min_duration = duration
-                    closest_shelter_index = idx
+    durations = data['durations'][0]
+    min_duration = float('inf')
+    closest_shelter_index = -1
 
-            if closest_shelter_index == -1:
-                return None, None
+    # 最初の要素は建物自身(0)なのでスキップし、避難所との所要時間のみをチェック
+    for idx, duration in enumerate(durations[1:]):
+        if duration is not None and duration < min_duration:
+            min_duration = duration
+            closest_shelter_index = idx
 
-            return target_shelters[closest_shelter_index], min_duration
+    if closest_shelter_index == -1:
+        return None, None
 
-        except requests.exceptions.ConnectionError as e:
-            continue
-    # ループを抜けた場合にも必ずタプルで返す
-    return None, None
+    return target_shelters[closest_shelter_index], min_duration
 
 
 # MARK: ルート詳細
 def get_route_geometry(source_building, target_shelter, osrm_url):
     """OSRMのRouteサービスを使い、2点間の経路ジオメトリと詳細情報を取得"""
 
-    coords_str = f"{source_building['lon']},{source_building['lat']};{target_shelter['lon']},{target_shelter['lat']}"
-    api_url = f"{osrm_url}/route/v1/walking/{coords_str}?overview=full&geometries=geojson"
+    api_url = build_route_url(source_building, target_shelter, osrm_url)
 
-    # 無限に待機するための再試行ロジック
-    max_retries = 10000  # 非常に大きな数に設定
+    # 再試行しても応答がない場合は None（サーバー障害）
+    data = osrm_client.get_json(api_url, "route", point=coord_point(source_building))
+    if data is None:
+        return None
 
-    for attempt in range(max_retries):
-        try:
-            # タイムアウトをNoneに設定して無限に待機
-            response = requests.get(api_url, timeout=None)
-            response.raise_for_status()
-            data = response.json()
+    if data['code'] == 'Ok' and data.get('routes'):
+        return route_geometry.decode_route(data['routes'][0]) # 距離、時間、ジオメトリ（座標配列）を返す
+    else:
+        safe_print(f"OSRM Route API Error: {data.get('message', 'No message')}")
+        metrics.count("route_errors")
+        return None
 
-            if data['code'] == 'Ok' and data.get('routes'):
-                return data['routes'][0] # 距離、時間、ジオメトリを含むルートオブジェクトを返す
-            else:
-                safe_print(f"OSRM Route API Error: {data.get('message', 'No message')}")
-                return None
 
-        except requests.exceptions.ConnectionError as e:
-            continue  # つながるまでやれ
+def coord_point(coord):
+    """座標辞書を OSRMクライアントの送信先の選択に使う (経度, 緯度) にする"""
+    return coord['lon'], coord['lat']
+
+
+def build_route_url(source_building, target_shelter, osrm_url):
+    """2点間のRouteリクエストのURLを作成"""
+    coords_str = f"{source_building['lon']},{source_building['lat']};{target_shelter['lon']},{target_shelter['lat']}"
+    return f"{osrm_url}/route/v1/walking/{coords_str}?{route_geometry.url_params()}"
 
 
 # MARK: 単一ルート検索
-def process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shelter_coords_dict, osrm_url):
-    """単一のルート検索処理を実行する関数（並列処理用）"""
+def process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shelter_coords_dict, osrm_url,
+                         route_cache=None):
+    """単一のルート検索処理を実行する関数（並列処理用、キャッシュにあればOSRMを呼ばない）"""
     try:
         # 近傍避難所の座標リストを作成
         target_shelters = [shelter_coords_dict[oid] for oid in nearby_shelter_oids if oid in shelter_coords_dict]
@@ -585,8 +1466,13 @@ def process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shel
                 'error': '避難所座標が見つかりません'
             }
 
-        # Tableサービスで最も近い避難所を特定
-        closest_shelter, min_duration = find_closest_by_table(agg_bldg_coord, target_shelters, osrm_url)
+        # Tableサービスで最も近い避難所を特定（キャッシュにあればそれを使う）
+        if route_cache is None:
+            closest_shelter, min_duration = find_closest_by_table(agg_bldg_coord, target_shelters, osrm_url)
+        else:
+            task = (agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids)
+            closest_list = find_closest_by_table_batch([task], shelter_coords_dict, osrm_url, route_cache)
+            closest_shelter, min_duration = closest_list[0] if closest_list else (None, None)
         if closest_shelter is None:
             return {
                 'agg_bldg_oid': agg_bldg_oid,
@@ -598,7 +1484,31 @@ def process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shel
             }
 
         # Routeサービスで経路ジオメトリと詳細情報を取得
-        route_info = get_route_geometry(agg_bldg_coord, closest_shelter, osrm_url)
+        return process_route_to_shelter(agg_bldg_oid, agg_bldg_coord, closest_shelter, osrm_url, route_cache)
+
+    except Exception as e:
+        return {
+            'agg_bldg_oid': agg_bldg_oid,
+            'agg_bldg_coord': agg_bldg_coord,
+            'success': False,
+            'nearest_shltr': None,
+            'route_info': None,
+            'error': str(e)
+        }
+
+
+# MARK: 経路取得
+def process_route_to_shelter(agg_bldg_oid, agg_bldg_coord, closest_shelter, osrm_url, route_cache=None):
+    """最寄り避難所が決まった建物について、Routeサービスで経路を取得して結果を返す"""
+    try:
+        route_info = None
+        if route_cache is not None:
+            route_info = route_cache.get_route(agg_bldg_coord, closest_shelter['oid'])
+
+        if route_info is None:
+            route_info = get_route_geometry(agg_bldg_coord, closest_shelter, osrm_url)
+            if route_info and route_cache is not None:
+                route_cache.put_route(agg_bldg_coord, closest_shelter['oid'], route_info)
         if not route_info:
             return {
                 'agg_bldg_oid': agg_bldg_oid,
@@ -614,17 +1524,261 @@ def process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shel
             'agg_bldg_coord': agg_bldg_coord,
             'success': True,
             'nearest_shltr': closest_shelter,
-            'route_info': route_info,
+            'route_info': route_geometry.simplify_route(route_info),
             'error': None
         }
 
     except Exception as e:
+        return {
+            'agg_bldg_oid': agg_bldg_oid,
+            'agg_bldg_coord': agg_bldg_coord,
+            'success': False,
+            'nearest_shltr': closest_shelter,
+            'route_info': None,
+            'error': str(e)
+        }
+
+
+# MARK: 非同期ルート処理
+async def run_batch_routes_async(batches, shelter_coords_dict, osrm_url, max_connections, max_in_flight, on_batch_done,
+                                 route_cache=None, attributes_only=False):
+    """
+    asyncioでバッチ群を処理する（スレッドプール版の代替）
+
+    キープアライブ接続のプールを1つのセッションで共有し、同時に送信中の
+    リクエスト数は osrm_client が max_in_flight 件を上限に自動調整する。
+    バッチが完了するたびに on_batch_done(batch_results) を呼び出す。
+
+    Args:
+        batches: build_table_batches で作成したバッチのリスト
+        shelter_coords_dict: 避難所座標の辞書
+        osrm_url: OSRMサーバーのURL
+        max_connections: コネクションプールの上限
+        max_in_flight: 同時に実行するバッチ数の上限（同時リクエスト数の上限は osrm_client.configure で設定）
+        on_batch_done: バッチ完了時に結果リストを受け取るコールバック
+        route_cache: ルートキャッシュ（None で無効）
+        attributes_only: True で所要時間・距離だけを求める（process_batch_attributes の asyncio 版を使う）
+    """
+    if aiohttp is None:
+        raise ImportError("asyncioエンジンには aiohttp が必要です (pip install aiohttp)")
+
+    connector = aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=None)  # リクエストごとのタイムアウトは osrm_client で指定
+
+    process_batch = process_batch_attributes_async if attributes_only else process_batch_routes_async
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # 実行中のバッチ数も max_in_flight 件までに抑え、タスクを一度に生成しない
+        pending = set()
+        for batch in batches:
+            if len(pending) >= max_in_flight:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    on_batch_done(task.result())
+            pending.add(asyncio.create_task(
+                process_batch(session, batch, shelter_coords_dict, osrm_url, route_cache)
+            ))
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                on_batch_done(task.result())
+
+
+async def run_cache_io(route_cache, func, *args):
+    """
+    ルートキャッシュ（SQLite）を読み書きする処理をイベントループの外で実行する
+
+    SQLite の呼び出しはブロックするため、既定のスレッドプールで実行して他のリクエストを止めない。
+    キャッシュを使わない場合はそのまま呼び出す。
+    """
+    if route_cache is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def process_batch_routes_async(session, batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """
+    process_batch_routes の asyncio 版（Table 1回 + 各建物のRouteを同時実行）
+
+    Tableの検索中の想定外の例外（応答の途中切断や解析、キャッシュのエラーなど）はバッチの全建物を
+    失敗として返し、他の実行中のバッチを止めない。
+    """
+    try:
+        closest_list = await find_closest_by_table_batch_async(
+            session, batch_tasks, shelter_coords_dict, osrm_url, route_cache
+        )
+
+        # 多対多リクエストが失敗した場合は1建物ずつのTableにフォールバック
+        if closest_list is None:
+            single_results = await asyncio.gather(*(
+                find_closest_by_table_batch_async(session, [task], shelter_coords_dict, osrm_url, route_cache)
+                for task in batch_tasks
+            ))
+            closest_list = [result[0] if result else (None, None) for result in single_results]
+    except Exception as e:
+        return build_batch_failure_results(batch_tasks, e)
+
+    coroutines = []
+    for (agg_bldg_oid, agg_bldg_coord, _), (closest_shelter, min_duration) in zip(batch_tasks, closest_list):
+        coroutines.append(process_route_to_shelter_async(
+            session, agg_bldg_oid, agg_bldg_coord, closest_shelter, osrm_url, route_cache
+        ))
+
+    return list(await asyncio.gather(*coroutines))
+
+
+async def process_batch_attributes_async(session, batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """process_batch_attributes の asyncio 版（想定外の例外ではバッチの全建物を失敗として返す）"""
+    try:
+        costs_list = await find_costs_by_table_batch_async(session, batch_tasks, shelter_coords_dict, osrm_url,
+                                                           route_cache)
+
+        # 多対多リクエストが失敗した場合は1建物ずつにフォールバック
+        if costs_list is None:
+            single_results = await asyncio.gather(*(
+                find_costs_by_table_batch_async(session, [task], shelter_coords_dict, osrm_url, route_cache)
+                for task in batch_tasks
+            ))
+            costs_list = [result[0] if result else (None, None, None) for result in single_results]
+    except Exception as e:
+        safe_print(f"バッチ処理エラー: {e}")
+        metrics.count("table_errors")
+        costs_list = [(None, None, None)] * len(batch_tasks)
+
+    return [build_attributes_result(agg_bldg_oid, agg_bldg_coord, *costs)
+            for (agg_bldg_oid, agg_bldg_coord, _), costs in zip(batch_tasks, costs_list)]
+
+
+async def find_costs_by_table_batch_async(session, batch_tasks, shelter_coords_dict, osrm_url, route_cache=None):
+    """find_costs_by_table_batch の asyncio 版"""
+    costs_list, miss_positions = await run_cache_io(route_cache, resolve_costs_from_cache,
+                                                    batch_tasks, shelter_coords_dict, route_cache)
+    if not miss_positions:
+        return costs_list
+
+    miss_tasks = [batch_tasks[i] for i in miss_positions]
+    api_url, dest_index = build_table_batch_url(miss_tasks, shelter_coords_dict, osrm_url,
+                                                annotations="duration,distance")
+    if api_url is None:
+        for i in miss_positions:
+            costs_list[i] = (None, None, None)
+        return costs_list
+
+    try:
+        data = await osrm_client.get_json_async(session, api_url, "table", point=coord_point(miss_tasks[0][1]))
+    except aiohttp.ClientResponseError as e:
+        # 座標数の上限超過 (TooBig) などはフォールバックさせる
+        safe_print(f"OSRM Table API Error: {e}")
+        metrics.count("table_errors")
+        return None
+
+    return await run_cache_io(route_cache, apply_costs_table, data, costs_list, miss_positions, miss_tasks,
+                              shelter_coords_dict, dest_index, route_cache)
+
+
+async def find_closest_by_table_batch_async(session, batch_tasks, shelter_coords_dict, osrm_url,
+                                            route_cache=None):
+    """find_closest_by_table_batch の asyncio 版"""
+    closest_list, miss_positions = await run_cache_io(route_cache, resolve_closest_from_cache,
+                                                      batch_tasks, shelter_coords_dict, route_cache)
+    if not miss_positions:
+        return closest_list
+
+    miss_tasks = [batch_tasks[i] for i in miss_positions]
+    api_url, dest_index = build_table_batch_url(miss_tasks, shelter_coords_dict, osrm_url)
+    if api_url is None:
+        for i in miss_positions:
+            closest_list[i] = (None, None)
+        return closest_list
+
+    try:
+        data = await osrm_client.get_json_async(session, api_url, "table", point=coord_point(miss_tasks[0][1]))
+    except aiohttp.ClientResponseError as e:
+        # 座標数の上限超過 (TooBig) などはフォールバックさせる
+        safe_print(f"OSRM Table API Error: {e}")
+        metrics.count("table_errors")
+        return None
+
+    if data is None:
+        # 再試行しても応答がない（サーバー障害）。1建物ずつにフォールバックせず失敗として返す
+        for i in miss_positions:
+            closest_list[i] = (None, None)
+        return closest_list
+
+    if data['code'] != 'Ok' or not data.get('durations'):
+        safe_print(f"OSRM Table API Error: {data.get('message', 'No message')}")
+        metrics.count("table_errors")
+        return None
+
+    await run_cache_io(route_cache, store_table_in_cache, route_cache, data['durations'], miss_tasks, dest_index)
+    fetched = select_closest_from_table(data['durations'], miss_tasks, shelter_coords_dict, dest_index)
+    for i, closest in zip(miss_positions, fetched):
+        closest_list[i] = closest
+    return closest_list
+
+
+async def process_route_to_shelter_async(session, agg_bldg_oid, agg_bldg_coord, closest_shelter, osrm_url,
+                                         route_cache=None):
+    """process_route_to_shelter の asyncio 版"""
+    if closest_shelter is None:
         return {
             'agg_bldg_oid': agg_bldg_oid,
             'agg_bldg_coord': agg_bldg_coord,
             'success': False,
             'nearest_shltr': None,
             'route_info': None,
+            'error': 'OSRM Tableサービスが失敗しました'
+        }
+
+    try:
+        if route_cache is not None:
+            route_info = await run_cache_io(route_cache, route_cache.get_route, agg_bldg_coord, closest_shelter['oid'])
+            if route_info is not None:
+                return {
+                    'agg_bldg_oid': agg_bldg_oid,
+                    'agg_bldg_coord': agg_bldg_coord,
+                    'success': True,
+                    'nearest_shltr': closest_shelter,
+                    'route_info': route_geometry.simplify_route(route_info),
+                    'error': None
+                }
+
+        data = await osrm_client.get_json_async(session, build_route_url(agg_bldg_coord, closest_shelter, osrm_url),
+                                                "route", point=coord_point(agg_bldg_coord))
+        if not data or data['code'] != 'Ok' or not data.get('routes'):
+            if data:
+                safe_print(f"OSRM Route API Error: {data.get('message', 'No message')}")
+                metrics.count("route_errors")
+            return {
+                'agg_bldg_oid': agg_bldg_oid,
+                'agg_bldg_coord': agg_bldg_coord,
+                'success': False,
+                'nearest_shltr': closest_shelter,
+                'route_info': None,
+                'error': 'OSRM Routeサービスが失敗しました'
+            }
+
+        route_info = route_geometry.decode_route(data['routes'][0])
+        if route_cache is not None:
+            await run_cache_io(route_cache, route_cache.put_route, agg_bldg_coord, closest_shelter['oid'], route_info)
+
+        return {
+            'agg_bldg_oid': agg_bldg_oid,
+            'agg_bldg_coord': agg_bldg_coord,
+            'success': True,
+            'nearest_shltr': closest_shelter,
+            'route_info': route_geometry.simplify_route(route_info),
+            'error': None
+        }
+
+    except Exception as e:
+        return {
+            'agg_bldg_oid': agg_bldg_oid,
+            'agg_bldg_coord': agg_bldg_coord,
+            'success': False,
+            'nearest_shltr': closest_shelter,
+            'route_info': None,
             'error': str(e)
         }
 
@@ -632,8 +1786,13 @@ def process_single_route(agg_bldg_oid, agg_bldg_coord, nearby_shelter_oids, shel
 if __name__ == '__main__':
     # 実行には tqdm ライブラリが必要です
     # pip install tqdm
+    parser = argparse.ArgumentParser(description="建物ポイントから最寄り避難所へのルートをOSRMで検索します")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回のジャーナルを読み込み、ルート検索済みの集約建物をスキップして再開する")
+    args = parser.parse_args()
+
     start_time = time.time()
-    main()
+    main(resume=args.resume)
     end_time = time.time()
     elapsed = end_time - start_time
     minutes = int(elapsed // 60)
@@ -0,0 +1,712 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp  # asyncioエンジン使用時のみ必要 (pip install aiohttp)
+except ImportError:
+    aiohttp = None
+
+# 再試行する HTTP ステータス（過負荷・一時的な障害）。400 (TooBig, NoRoute など) は再試行しない
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 過負荷を示す HTTP ステータス（1件でも同時リクエスト数を減らす）
+OVERLOAD_STATUS = {429}
+
+# ヘルスチェックのリクエスト（担当範囲の中心から同じ地点へのルート。400 NoSegment でもサーバーは稼働中とみなす）
+HEALTH_CHECK_PATH = "/route/v1/walking/{lon},{lat};{lon},{lat}?overview=false"
+
+
+class AIMDLimiter:
+    """
+    AIMD (加算増加・乗算減少) による同時リクエスト数の制御
+
+    - 上限いっぱいまで使っている間は、成功ごとに上限を増やす（1ラウンド round_samples 件でおよそ +1）
+    - ラウンドの平均応答時間が基準の latency_tolerance 倍を超えたら上限を latency_backoff 倍に減らす
+    - 接続エラー・タイムアウト・429（過負荷）なら上限を error_backoff 倍に減らす
+    - それ以外の 5xx は、max(round_samples, 上限) 件の失敗率が error_rate_threshold を超えたときだけ
+      error_backoff 倍に減らす（過負荷と無関係な散発的なエラーは再試行とサーキットブレーカーに任せる）
+
+    応答時間は1件ごとのばらつき（ルートの長さ、Tableの座標数など）が大きいため、種類 (kind) ごとに
+    max(round_samples, 上限) 件の平均（ラウンド）で判定する。基準は上限を減らした後の最初のラウンドの平均で、
+    減らすまで更新しない（負荷とともに基準が上がって過負荷を見逃さないように）。減らした後は基準を測り直すまで
+    上限を増やさない。上限が処理能力を超えたままなら基準も過負荷の値になるが、次の判定でさらに
+    latency_tolerance × latency_backoff (< 1) 倍になるため、処理能力の付近まで下がる。
+    1回の過負荷で何度も減らさないよう、前回減らした時刻より前に送信したリクエストの結果では減らさない。
+    スレッドと asyncio のどちらからも使えるが、同時に両方から使うことは想定しない。
+    """
+
+    def __init__(self, initial: float = 8, min_limit: float = 1, max_limit: float = 64,
+                 latency_tolerance: float = 1.3, latency_backoff: float = 0.6, error_backoff: float = 0.5,
+                 error_rate_threshold: float = 0.1, round_samples: int = 32):
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max(max_limit, min_limit))
+        self.limit = min(max(float(initial), self.min_limit), self.max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.latency_backoff = latency_backoff
+        self.error_backoff = error_backoff
+        self.error_rate_threshold = error_rate_threshold
+        self.round_samples = round_samples
+        self.in_flight = 0
+        self.waiting = 0
+        self.decreases = 0
+        self._rounds = {}
+        self._window_requests = 0
+        self._window_failures = 0
+        self._window_start = None
+        self._last_decrease = 0.0
+        self._reference_pending = True
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_condition = None
+        self._async_loop = None
+
+    def _try_enter(self) -> bool:
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def try_acquire(self) -> Optional[float]:
+        """上限に空きがあれば送信時刻を返し、なければ待たずに None を返す"""
+        with self._lock:
+            if not self._try_enter():
+                return None
+        return time.monotonic()
+
+    def acquire(self) -> float:
+        """上限に空きができるまで待ち、送信時刻を返す（release に渡す）"""
+        with self._condition:
+            self.waiting += 1
+            while not self._try_enter():
+                self._condition.wait()
+            self.waiting -= 1
+        return time.monotonic()
+
+    async def acquire_async(self) -> float:
+        """acquire の asyncio 版"""
+        condition = self._get_async_condition()
+        # 最初の await より前に数える（送信先の選択が待ち行列の長さを見られるように）
+        with self._lock:
+            self.waiting += 1
+        async with condition:
+            while True:
+                with self._lock:
+                    if self._try_enter():
+                        self.waiting -= 1
+                        break
+                await condition.wait()
+        return time.monotonic()
+
+    def release(self, start: float, outcome: str, kind: str = "", latency: Optional[float] = None):
+        """
+        リクエストの完了を記録して上限を調整する
+
+        Args:
+            start: acquire が返した送信時刻
+            outcome: "success"（応答時間で調整） / "overload"（過負荷なので大きく減らす） /
+                "failure"（失敗率が高ければ大きく減らす） / "neutral"（調整しない）
+            kind: 応答時間の基準を分けるリクエストの種類（latency_kind）
+            latency: 応答時間（秒）
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if outcome in ("success", "failure"):
+                self._count_outcome(start, outcome == "failure")
+            if outcome == "success" and latency is not None:
+                self._on_success(start, kind, latency)
+            elif outcome == "overload":
+                self._decrease(start, self.error_backoff)
+            self._condition.notify_all()
+
+    async def release_async(self, start: float, outcome: str, kind: str = "", latency: Optional[float] = None):
+        """release の asyncio 版（待機中のコルーチンを起こす）"""
+        self.release(start, outcome, kind, latency)
+        condition = self._get_async_condition()
+        async with condition:
+            condition.notify_all()
+
+    def _count_outcome(self, start: float, failed: bool):
+        """成功・失敗の件数を数え、max(round_samples, 上限) 件ごとに失敗率で判定する"""
+        self._window_requests += 1
+        self._window_failures += failed
+        if self._window_start is None or start < self._window_start:
+            self._window_start = start
+        if self._window_requests < max(self.round_samples, int(self.limit)):
+            return
+
+        # 前回減らす前に送信したリクエストを含む区間は判定に使わない
+        if (self._window_start >= self._last_decrease
+                and self._window_failures > self.error_rate_threshold * self._window_requests):
+            self._decrease(start, self.error_backoff)
+        self._window_requests = 0
+        self._window_failures = 0
+        self._window_start = None
+
+    def _on_success(self, start: float, kind: str, latency: float):
+        latency_round = self._rounds.get(kind)
+        if latency_round is None:
+            latency_round = self._rounds[kind] = LatencyRound()
+        latency_round.add(start, latency)
+
+        if latency_round.count >= max(self.round_samples, int(self.limit)):
+            mean, first_start = latency_round.finish()
+            # 前回減らす前に送信したリクエストを含むラウンドは判定に使わない
+            if first_start >= self._last_decrease:
+                if latency_round.reference is None or latency_round.reference_time < self._last_decrease:
+                    latency_round.reference = mean
+                    latency_round.reference_time = time.monotonic()
+                    self._reference_pending = False
+                elif mean > latency_round.reference * self.latency_tolerance:
+                    self._decrease(start, self.latency_backoff)
+                    return
+
+        if not self._reference_pending and self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, self.round_samples))
+
+    def _decrease(self, start: float, factor: float):
+        if start < self._last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._last_decrease = time.monotonic()
+        self._reference_pending = True
+        self.decreases += 1
+
+    def _get_async_condition(self) -> asyncio.Condition:
+        # asyncio.Condition はイベントループに結び付くため、asyncio.run ごとに作り直す
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_condition = asyncio.Condition()
+            self._async_loop = loop
+        return self._async_condition
+
+
+def latency_kind(url: str, kind: str) -> str:
+    """
+    AIMDLimiter の応答時間の基準を分ける種類
+
+    Tableは座標数で応答時間が大きく変わるため、座標数が2倍違うごとに分ける（"table:7" は 64〜127 地点）。
+    """
+    if kind != "table":
+        return kind
+    coordinates = urlsplit(url).path.rsplit("/", 1)[-1].count(";") + 1
+    return f"{kind}:{coordinates.bit_length()}"
+
+
+class LatencyRound:
+    """AIMDLimiter のリクエストの種類ごとのラウンド（応答時間の合計・件数・最初の送信時刻）と基準"""
+
+    __slots__ = ("total", "count", "first_start", "reference", "reference_time")
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self.first_start = None
+        self.reference = None
+        self.reference_time = 0.0
+
+    def add(self, start: float, latency: float):
+        self.total += latency
+        self.count += 1
+        if self.first_start is None or start < self.first_start:
+            self.first_start = start
+
+    def finish(self) -> Tuple[float, float]:
+        """(平均応答時間, 最初の送信時刻) を返して次のラウンドを始める"""
+        result = (self.total / self.count, self.first_start)
+        self.total = 0.0
+        self.count = 0
+        self.first_start = None
+        return result
+
+
+class CircuitBreaker:
+    """
+    連続した失敗でリクエストを止めるサーキットブレーカー
+
+    - closed: 通常どおり送信。failure_threshold 回連続で失敗すると open
+    - open: reset_timeout 秒間は送信しない（呼び出し側は wait_time() だけ待つ）
+    - half_open: 1件だけ試しに送信し、成功なら closed、失敗なら待ち時間を2倍（最大 max_reset_timeout）にして open
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 2.0, max_reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def peek_wait_time(self) -> float:
+        """wait_time と同じ値を、状態を変えずに返す（送信先の選択用）"""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            if self.state == "open":
+                return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+            return min(1.0, self.reset_timeout) if self._probe_in_flight else 0.0
+
+    def wait_time(self) -> float:
+        """送信してよければ 0、そうでなければ再確認までの待ち時間（秒）"""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state = "half_open"
+                self._probe_in_flight = True
+                return 0.0
+            # half_open: 試しの1件の結果を待つ
+            if self._probe_in_flight:
+                return min(1.0, self.reset_timeout)
+            self._probe_in_flight = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.reset_timeout = self.base_reset_timeout
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """失敗を記録し、これによって open になった場合は True"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open":
+                self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2.0)
+            elif self.state == "open" or self.consecutive_failures < self.failure_threshold:
+                return False
+            return self._open()
+
+    def trip(self) -> bool:
+        """ヘルスチェックの失敗などで直ちに open にする（新たに open になった場合は True）"""
+        with self._lock:
+            if self.state == "open":
+                return False
+            return self._open()
+
+    def _open(self) -> bool:
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.times_opened += 1
+        return True
+
+
+Region = Tuple[float, float, float, float]
+
+
+class OSRMBackend:
+    """
+    OSRMサーバー1台分の同時リクエスト数の制御とサーキットブレーカー
+
+    region は担当範囲 (最小経度, 最小緯度, 最大経度, 最大緯度)。None は全域。
+    """
+
+    def __init__(self, base_url: str, limiter: AIMDLimiter, breaker: CircuitBreaker, region: Optional[Region] = None):
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter
+        self.breaker = breaker
+        self.region = tuple(region) if region is not None else None
+        self.requests = 0
+        self.healthy = None
+
+    def contains(self, lon: float, lat: float) -> bool:
+        if self.region is None:
+            return True
+        min_lon, min_lat, max_lon, max_lat = self.region
+        return min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
+
+    def url_for(self, url: str) -> str:
+        """url のパスとクエリをこのサーバー宛てにする"""
+        parts = urlsplit(url)
+        return self.base_url + url[len(f"{parts.scheme}://{parts.netloc}"):]
+
+    def health_check_url(self) -> str:
+        if self.region is None:
+            lon, lat = 0.0, 0.0
+        else:
+            lon, lat = (self.region[0] + self.region[2]) / 2, (self.region[1] + self.region[3]) / 2
+        return self.base_url + HEALTH_CHECK_PATH.format(lon=f"{lon:.6f}", lat=f"{lat:.6f}")
+
+
+class OSRMClient:
+    """
+    OSRMへのGETを適応的な同時実行数制御・再試行・タイムアウト・サーキットブレーカー付きで行う
+
+    サーバー (scheme://host:port) ごとに AIMDLimiter と CircuitBreaker を持つ。
+    接続エラー・タイムアウト・5xx・429 は指数バックオフ + フルジッターで待って再試行し、
+    max_attempts 回失敗したら None を返す（サーキットブレーカーで待った時間は試行回数に含めない）。
+    400 などの再試行しないエラーは requests.HTTPError / aiohttp.ClientResponseError を送出する。
+
+    backends を指定するとサーバーのプールを使う（URL の scheme://host:port はプールのサーバーに置き換える）。
+    リクエストごとに point (経度, 緯度) を担当範囲に含むサーバーの中から、サーキットブレーカーが閉じていて
+    処理中のリクエストが最も少ないサーバーを選ぶ（同じ範囲のサーバーを複数並べるとレプリカとして分散する）。
+    再試行のたびに選び直すため、1台が落ちても同じ範囲の他のサーバーで処理を続ける。
+
+    Args:
+        metrics: 計測先 (PipelineMetrics、None で計測しない)
+        initial_concurrency: 同時リクエスト数の初期値
+        max_concurrency: 同時リクエスト数の上限
+        connect_timeout, read_timeout: 接続・応答のタイムアウト（秒）
+        max_attempts: 1リクエストあたりの最大試行回数
+        base_delay, max_delay: 再試行の待ち時間の基準と上限（秒）
+        failure_threshold, reset_timeout: サーキットブレーカーの設定
+        backends: サーバーのプール [{'url': ..., 'region': (最小経度, 最小緯度, 最大経度, 最大緯度) or None}, ...]
+            （URL の文字列だけでもよい。None でリクエストの URL のサーバーをそのまま使う）
+        health_check_timeout: ヘルスチェックのタイムアウト（秒）
+
+    同時リクエスト数の上限 (max_concurrency) はサーバーごとに適用する。
+    """
+
+    SETTINGS = ("initial_concurrency", "max_concurrency", "connect_timeout", "read_timeout", "max_attempts",
+                "base_delay", "max_delay", "failure_threshold", "reset_timeout", "backends", "health_check_timeout")
+
+    def __init__(self, metrics=None, initial_concurrency: int = 8, max_concurrency: int = 64,
+                 connect_timeout: float = 5.0, read_timeout: float = 300.0, max_attempts: int = 10,
+                 base_delay: float = 0.2, max_delay: float = 30.0, failure_threshold: int = 5,
+                 reset_timeout: float = 2.0, backends: Optional[Sequence[Any]] = None,
+                 health_check_timeout: float = 10.0):
+        self.metrics = metrics
+        self._health_thread = None
+        self._health_stop = threading.Event()
+        self.configure(initial_concurrency=initial_concurrency, max_concurrency=max_concurrency,
+                       connect_timeout=connect_timeout, read_timeout=read_timeout, max_attempts=max_attempts,
+                       base_delay=base_delay, max_delay=max_delay, failure_threshold=failure_threshold,
+                       reset_timeout=reset_timeout, backends=backends, health_check_timeout=health_check_timeout)
+
+    def configure(self, **settings):
+        """設定を変更する（サーバーごとの状態と接続プールは作り直す）"""
+        for name, value in settings.items():
+            if name not in self.SETTINGS:
+                raise TypeError(f"不明な設定です: {name}")
+            setattr(self, name, value)
+
+        self._backends = {}
+        self._backends_lock = threading.Lock()
+        self._pool = [self._new_backend(spec['url'], spec.get('region')) if isinstance(spec, dict)
+                      else self._new_backend(spec) for spec in (self.backends or ())]
+        for backend in self._pool:
+            if backend.base_url in self._backends:
+                raise ValueError(f"サーバーが重複しています: {backend.base_url}")
+            self._backends[backend.base_url] = backend
+        # 担当範囲ごとのグループ（バッチを範囲の境界で分けるため）
+        self._regions = list(dict.fromkeys(backend.region for backend in self._pool))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(4, len(self._pool)),
+                              pool_maxsize=max(1, int(self.max_concurrency)))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _new_backend(self, base_url: str, region: Optional[Region] = None) -> OSRMBackend:
+        return OSRMBackend(
+            base_url,
+            AIMDLimiter(initial=self.initial_concurrency, max_limit=self.max_concurrency),
+            CircuitBreaker(failure_threshold=self.failure_threshold, reset_timeout=self.reset_timeout),
+            region,
+        )
+
+    def backend(self, url: str) -> OSRMBackend:
+        """URL のサーバーの状態（初めてのサーバーなら作成）"""
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        with self._backends_lock:
+            backend = self._backends.get(base_url)
+            if backend is None:
+                backend = self._new_backend(base_url)
+                self._backends[base_url] = backend
+        return backend
+
+    # MARK: サーバーの選択
+    def region_index(self, lon: float, lat: float) -> int:
+        """地点を担当する範囲のグループ番号（プールを使わない場合は 0、どの範囲にも含まれなければ -1）"""
+        if not self._pool:
+            return 0
+        for index, region in enumerate(self._regions):
+            if region is None:
+                return index
+            min_lon, min_lat, max_lon, max_lat = region
+            if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat:
+                return index
+        return -1
+
+    def _candidates(self, url: str, point: Optional[Tuple[float, float]]) -> List[OSRMBackend]:
+        if not self._pool:
+            return [self.backend(url)]
+        if point is None:
+            return list(self._pool)
+        return [backend for backend in self._pool if backend.contains(*point)]
+
+    def _select(self, candidates: List[OSRMBackend]) -> Tuple[Optional[OSRMBackend], float]:
+        """
+        送信先を選ぶ（サーキットブレーカーが閉じているサーバーのうち、上限に空きがあり、
+        処理中と枠の空き待ちの合計が最も少ないもの）
+
+        Returns:
+            (サーバー, 0) または 全サーバーが停止中なら (None, 最短の待ち時間)
+        """
+        available = [backend for backend in candidates if backend.breaker.peek_wait_time() <= 0]
+        if not available:
+            return None, min(backend.breaker.peek_wait_time() for backend in candidates)
+        backend = min(available, key=lambda b: (b.limiter.in_flight >= int(b.limiter.limit),
+                                                b.limiter.in_flight + b.limiter.waiting, random.random()))
+        return backend, 0.0
+
+    def _claim(self, candidates: List[OSRMBackend]) -> Tuple[Optional[OSRMBackend], float]:
+        """送信先を選んで送信の許可を得る（得られなければ (None, 待ち時間)）"""
+        backend, wait = self._select(candidates)
+        if backend is None:
+            return None, wait
+        # 選択から許可までの間に他のリクエストが half_open の試行を取った場合は選び直す
+        wait = backend.breaker.wait_time()
+        return (backend, 0.0) if wait <= 0 else (None, min(wait, 0.05))
+
+    def acquire_backend(self, url: str,
+                        point: Optional[Tuple[float, float]] = None) -> Tuple[Optional[OSRMBackend], float]:
+        """
+        送信先のサーバーを選び、同時リクエスト数の枠を確保する
+        （全サーバーが停止中なら再開まで、枠がなければ空くまで待つ）
+
+        Returns:
+            (サーバー, 送信時刻)。担当するサーバーがなければ (None, 0)
+        """
+        candidates = self._candidates(url, point)
+        if not candidates:
+            return None, 0.0
+        while True:
+            backend, wait = self._claim(candidates)
+            if backend is not None:
+                break
+            time.sleep(wait)
+        start = backend.limiter.try_acquire()
+        if start is None:
+            start = backend.limiter.acquire()
+        self._on_acquire(backend)
+        return backend, start
+
+    async def acquire_backend_async(self, url: str,
+                                    point: Optional[Tuple[float, float]] = None) -> Tuple[Optional[OSRMBackend], float]:
+        """acquire_backend の asyncio 版（選択から枠の確保までの間に他のコルーチンが割り込まないようにする）"""
+        candidates = self._candidates(url, point)
+        if not candidates:
+            return None, 0.0
+        while True:
+            backend, wait = self._claim(candidates)
+            if backend is not None:
+                break
+            await asyncio.sleep(wait)
+        start = backend.limiter.try_acquire()
+        if start is None:
+            start = await backend.limiter.acquire_async()
+        self._on_acquire(backend)
+        return backend, start
+
+    # MARK: ヘルスチェック
+    def check_health(self) -> Dict[str, bool]:
+        """
+        プールの全サーバーに軽いリクエストを送り、応答しないサーバーのサーキットブレーカーを開く
+        （応答したサーバーは閉じる）。プールを使わない場合は何もしない。
+
+        Returns:
+            {サーバーURL: 稼働中か}
+        """
+        results = {}
+        for backend in self._pool:
+            try:
+                response = self.session.get(backend.health_check_url(),
+                                            timeout=(self.connect_timeout, self.health_check_timeout))
+                healthy = response.status_code < 500
+            except requests.exceptions.RequestException:
+                healthy = False
+            backend.healthy = healthy
+            if healthy:
+                if backend.breaker.state != "closed":
+                    backend.breaker.record_success()
+            else:
+                self._count("osrm_health_check_failures")
+                if backend.breaker.trip():
+                    self._count("osrm_circuit_opened")
+            results[backend.base_url] = healthy
+        return results
+
+    def start_health_checks(self, interval: float):
+        """interval 秒ごとにバックグラウンドで check_health を実行する"""
+        self.stop_health_checks()
+        self._health_stop = threading.Event()
+
+        def run(stop):
+            while not stop.wait(interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=run, args=(self._health_stop,), daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        if self._health_thread is not None:
+            self._health_stop.set()
+            self._health_thread.join()
+            self._health_thread = None
+
+    def backoff_delay(self, attempt: int) -> float:
+        """attempt 回目 (0から) の失敗後の待ち時間（指数バックオフ + フルジッター）"""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """サーバーごとの現在の同時リクエスト数の上限とサーキットブレーカーの状態"""
+        with self._backends_lock:
+            backends = list(self._backends.values())
+        return {
+            backend.base_url: {
+                'region': backend.region,
+                'requests': backend.requests,
+                'healthy': backend.healthy,
+                'concurrency_limit': backend.limiter.limit,
+                'limit_decreases': backend.limiter.decreases,
+                'circuit_state': backend.breaker.state,
+                'circuit_opened': backend.breaker.times_opened,
+            }
+            for backend in backends
+        }
+
+    # MARK: 計測
+    def _count(self, name: str):
+        if self.metrics is not None:
+            self.metrics.count(name)
+
+    def _observe(self, name: str, value: float):
+        if self.metrics is not None:
+            self.metrics.observe(name, value)
+
+    def _parse_json(self, body: bytes, kind: str) -> Dict[str, Any]:
+        """応答の JSON を解析し、応答のサイズと解析時間を記録"""
+        start = time.perf_counter()
+        data = json.loads(body)
+        self._observe(f"{kind}_parse_seconds", time.perf_counter() - start)
+        self._observe(f"{kind}_response_bytes", len(body))
+        return data
+
+    def _on_acquire(self, backend: OSRMBackend):
+        backend.requests += 1
+        self._observe("osrm_in_flight", backend.limiter.in_flight)
+        self._observe("osrm_concurrency_limit", backend.limiter.limit)
+
+    def _on_failure(self, backend: OSRMBackend, kind: str, reason: str):
+        self._count(f"{kind}_retries")
+        self._count(f"osrm_{reason}")
+        if backend.breaker.record_failure():
+            self._count("osrm_circuit_opened")
+
+    # MARK: 同期版
+    def get_json(self, url: str, kind: str, point: Optional[Tuple[float, float]] = None) -> Optional[Dict[str, Any]]:
+        """
+        GETしてJSONを返す（再試行しても失敗した場合、担当するサーバーがない場合は None）
+
+        Args:
+            url: リクエストURL
+            kind: 計測と応答時間の基準に使う種類 ("table" / "route")
+            point: 送信先の選択に使う地点 (経度, 緯度)（プールを使う場合）
+
+        Raises:
+            requests.HTTPError: 再試行しない HTTP エラー（TooBig など）
+        """
+        for attempt in range(self.max_attempts):
+            backend, start = self.acquire_backend(url, point)
+            if backend is None:
+                self._count("osrm_out_of_region")
+                return None
+
+            outcome, latency = "failure", None
+            try:
+                try:
+                    response = self.session.get(backend.url_for(url),
+                                                timeout=(self.connect_timeout, self.read_timeout))
+                    latency = time.monotonic() - start
+                except requests.exceptions.Timeout:
+                    outcome = "overload"
+                    self._on_failure(backend, kind, "timeouts")
+                except requests.exceptions.ConnectionError:
+                    outcome = "overload"
+                    self._on_failure(backend, kind, "connection_errors")
+                else:
+                    self._observe(f"{kind}_seconds", latency)
+                    if response.status_code in RETRYABLE_STATUS:
+                        outcome = "overload" if response.status_code in OVERLOAD_STATUS else "failure"
+                        self._on_failure(backend, kind, "server_errors")
+                    else:
+                        # 400 などはサーバーが正常に応答しているため、同時数は調整しない
+                        outcome = "success" if response.ok else "neutral"
+                        backend.breaker.record_success()
+                        response.raise_for_status()
+                        return self._parse_json(response.content, kind)
+            finally:
+                backend.limiter.release(start, outcome, latency_kind(url, kind), latency)
+
+            time.sleep(self.backoff_delay(attempt))
+
+        self._count(f"{kind}_gave_up")
+        return None
+
+    # MARK: asyncio版
+    async def get_json_async(self, session, url: str, kind: str,
+                             point: Optional[Tuple[float, float]] = None) -> Optional[Dict[str, Any]]:
+        """
+        get_json の asyncio 版（aiohttp のセッションを使う）
+
+        Raises:
+            aiohttp.ClientResponseError: 再試行しない HTTP エラー（TooBig など）
+        """
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        for attempt in range(self.max_attempts):
+            backend, start = await self.acquire_backend_async(url, point)
+            if backend is None:
+                self._count("osrm_out_of_region")
+                return None
+
+            outcome, latency = "failure", None
+            try:
+                try:
+                    async with session.get(backend.url_for(url), timeout=timeout) as response:
+                        body = await response.read()
+                    latency = time.monotonic() - start
+                except asyncio.TimeoutError:
+                    outcome = "overload"
+                    self._on_failure(backend, kind, "timeouts")
+                except aiohttp.ClientConnectionError:
+                    outcome = "overload"
+                    self._on_failure(backend, kind, "connection_errors")
+                else:
+                    self._observe(f"{kind}_seconds", latency)
+                    if response.status in RETRYABLE_STATUS:
+                        outcome = "overload" if response.status in OVERLOAD_STATUS else "failure"
+                        self._on_failure(backend, kind, "server_errors")
+                    else:
+                        # 400 などはサーバーが正常に応答しているため、同時数は調整しない
+                        outcome = "success" if response.ok else "neutral"
+                        backend.breaker.record_success()
+                        response.raise_for_status()
+                        return self._parse_json(body, kind)
+            finally:
+                await backend.limiter.release_async(start, outcome, latency_kind(url, kind), latency)
+
+            await asyncio.sleep(self.backoff_delay(attempt))
+
+        self._count(f"{kind}_gave_up")
+        return None
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+
+class PipelineMetrics:
+    """
+    パイプラインの計測（ステージごとの処理時間、リクエストの所要時間の分布、再試行回数、キューの深さ）
+
+    - stage(name): 順に実行するステージの経過時間（同じ名前は合計する）
+    - add_stage_time(name, seconds): 並行して動くステージ（書き込みスレッドなど）の作業時間を加算
+    - observe(name, value): 所要時間やキューの深さなどの分布（p50/p95/p99 を求める）
+    - count(name): 再試行・エラーなどの回数
+
+    いずれも複数スレッドから呼び出せる。分布は全サンプルを float64 の配列で保持する（100万件で約8MB）。
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}
+        self.samples = {}
+        self.counters = {}
+
+    def reset(self):
+        """計測結果をすべて消去（負荷試験などで同じインスタンスを繰り返し使う場合）"""
+        with self._lock:
+            self.started_at = time.time()
+            self.stages.clear()
+            self.samples.clear()
+            self.counters.clear()
+
+    @contextmanager
+    def stage(self, name: str):
+        """with ブロックの経過時間をステージ name の処理時間に加算"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def observe(self, name: str, value: float):
+        """分布 name にサンプルを1件追加"""
+        with self._lock:
+            series = self.samples.get(name)
+            if series is None:
+                series = self.samples[name] = array('d')
+            series.append(value)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        計測結果を辞書にまとめる
+
+        Returns:
+            {'elapsed_seconds', 'stages': {name: 秒}, 'counters': {name: 回数},
+             'distributions': {name: {'count', 'mean', 'p50', 'p95', 'p99', 'max', 'total'}}}
+        """
+        with self._lock:
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+            samples = {name: np.frombuffer(series, dtype=np.float64).copy() for name, series in self.samples.items()}
+
+        distributions = {}
+        for name, values in sorted(samples.items()):
+            if not len(values):
+                continue
+            stats = {'count': int(len(values)), 'mean': float(values.mean())}
+            for p, value in zip(self.PERCENTILES, np.percentile(values, self.PERCENTILES)):
+                stats[f"p{p}"] = float(value)
+            stats['max'] = float(values.max())
+            stats['total'] = float(values.sum())
+            distributions[name] = stats
+
+        return {
+            'elapsed_seconds': time.time() - self.started_at,
+            'stages': stages,
+            'counters': counters,
+            'distributions': distributions,
+        }
+
+    def write_report(self, path: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        計測結果を JSON ファイルに書き出す（一時ファイルに書いてから置き換える）
+
+        Args:
+            path: 出力先
+            extra: レポートに追加する項目（実行条件、件数など）
+
+        Returns:
+            書き出した内容
+        """
+        report = self.summary()
+        report['finished_at'] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        if extra:
+            report.update(extra)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return report
+
+    def format_summary(self) -> str:
+        """コンソール表示用の要約"""
+        summary = self.summary()
+        lines = ["ステージごとの処理時間:"]
+        for name, seconds in summary['stages'].items():
+            lines.append(f"  {name}: {seconds:.2f}秒")
+        if summary['distributions']:
+            lines.append("分布:")
+        for name, stats in summary['distributions'].items():
+            # 所要時間はミリ秒、それ以外（キューの深さなど）はそのまま表示
+            if name.endswith("_seconds"):
+                label = name[:-len("_seconds")]
+                lines.append(f"  {label}: {stats['count']} 件, p50 {stats['p50'] * 1000:.1f}ms, "
+                             f"p95 {stats['p95'] * 1000:.1f}ms, p99 {stats['p99'] * 1000:.1f}ms, "
+                             f"最大 {stats['max'] * 1000:.1f}ms")
+            else:
+                lines.append(f"  {name}: 平均 {stats['mean']:.1f}, p95 {stats['p95']:.0f}, 最大 {stats['max']:.0f}")
+        if summary['counters']:
+            lines.append("回数:")
+            lines.append("  " + ", ".join(f"{name}: {value}" for name, value in summary['counters'].items()))
+        return "\n".join(lines)
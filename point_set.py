@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from typing import Any, Dict, Iterator, Union
+
+import numpy as np
+
+
+class PointSet:
+    """
+    ポイントの列指向の集合（OID: int64、経度・緯度: float64 の連続した配列）
+
+    1点あたり24バイトで、{oid: {'oid', 'lon', 'lat'}} 形式の辞書（1点あたり約300バイト）の代わりに
+    集約・近傍検索・C++集約クライアントへそのまま渡せる。OSRMへの問い合わせなど1点ずつ扱う処理には
+    coord / items で従来の辞書を作って渡す。
+    """
+
+    __slots__ = ("oid", "lon", "lat")
+
+    def __init__(self, oid, lon, lat):
+        self.oid = np.ascontiguousarray(oid, dtype=np.int64)
+        self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+        self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+        if not (len(self.oid) == len(self.lon) == len(self.lat)):
+            raise ValueError("OID・経度・緯度の件数が一致しません")
+
+    @classmethod
+    def from_dict(cls, points_dict: Dict[int, Dict[str, Any]]) -> "PointSet":
+        """{oid: {'oid', 'lon', 'lat'}} 形式の辞書から作成"""
+        points = points_dict.values()
+        count = len(points_dict)
+        return cls(
+            np.fromiter((p['oid'] for p in points), dtype=np.int64, count=count),
+            np.fromiter((p['lon'] for p in points), dtype=np.float64, count=count),
+            np.fromiter((p['lat'] for p in points), dtype=np.float64, count=count),
+        )
+
+    def __len__(self) -> int:
+        return len(self.oid)
+
+    @property
+    def nbytes(self) -> int:
+        return self.oid.nbytes + self.lon.nbytes + self.lat.nbytes
+
+    def lat_lon(self) -> np.ndarray:
+        """(N, 2) の (緯度, 経度) 配列（近傍検索用）"""
+        return np.column_stack([self.lat, self.lon])
+
+    def take(self, index) -> "PointSet":
+        """インデックスまたはブール配列で選んだ点の PointSet"""
+        return PointSet(self.oid[index], self.lon[index], self.lat[index])
+
+    def coord(self, i: int) -> Dict[str, Any]:
+        """i 番目の点を従来の {'oid', 'lon', 'lat'} 形式の辞書にする"""
+        return {'oid': int(self.oid[i]), 'lon': float(self.lon[i]), 'lat': float(self.lat[i])}
+
+    def items(self) -> Iterator:
+        """(oid, {'oid', 'lon', 'lat'}) を順に返す（辞書の items と同じ使い方）"""
+        for oid, lon, lat in zip(self.oid.tolist(), self.lon.tolist(), self.lat.tolist()):
+            yield oid, {'oid': oid, 'lon': lon, 'lat': lat}
+
+    def to_dict(self) -> Dict[int, Dict[str, Any]]:
+        """{oid: {'oid', 'lon', 'lat'}} 形式の辞書（件数の少ない避難所など）"""
+        return dict(self.items())
+
+
+Points = Union[PointSet, Dict[int, Dict[str, Any]]]
+
+
+def as_point_set(points: Points) -> PointSet:
+    """PointSet はそのまま、辞書は PointSet に変換"""
+    if isinstance(points, PointSet):
+        return points
+    return PointSet.from_dict(points)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Optional, Any, Tuple
+
+from route_geometry import geometry_to_json, geometry_from_json
+
+# 1行あたりのキー・数値列のおおよそのサイズ（バイト）
+ROW_OVERHEAD_BYTES = 64
+
+# 最終アクセス時刻の更新をこの件数までためてからまとめて書き込む
+TOUCH_FLUSH_ROWS = 10000
+
+
+class RouteCache:
+    """
+    OSRMのTable/Route結果を実行をまたいで保持するSQLiteキャッシュ
+
+    キーは (スナップした出発地座標, 避難所OID, OSRMプロファイル, データセットバージョン)。
+    Tableの所要時間（と距離）と、Routeの所要時間・距離・ジオメトリを1行にまとめて保存する。
+    合計サイズが max_bytes を超えると、最終アクセスが古い行から削除する。
+    読み込み時の最終アクセス時刻の更新はメモリにためておき、次の保存時か
+    TOUCH_FLUSH_ROWS 件たまった時点でまとめて書き込む（ヒットのたびにコミットしない）。
+
+    複数スレッドから同時に呼び出せるよう、接続は1つをロックで共有する。
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 profile: str = "walking",
+                 dataset_version: str = "",
+                 max_bytes: int = 2 * 1024 ** 3,
+                 coord_precision: int = 6):
+        """
+        Args:
+            db_path: キャッシュファイルのパス
+            profile: OSRMプロファイル名
+            dataset_version: OSRMデータセットのバージョン（データ再構築時に変更する）
+            max_bytes: キャッシュの最大サイズ（バイト）
+            coord_precision: 座標をスナップする小数点以下の桁数（6桁で約0.1m）
+        """
+        self.profile = profile
+        self.dataset_version = dataset_version
+        self.max_bytes = max_bytes
+        self._scale = 10 ** coord_precision
+        self._lock = threading.Lock()
+        self._touched = {}  # キー -> まだ書き込んでいない最終アクセス時刻
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS routes (
+                lon_key INTEGER NOT NULL,
+                lat_key INTEGER NOT NULL,
+                shelter_oid INTEGER NOT NULL,
+                profile TEXT NOT NULL,
+                dataset_version TEXT NOT NULL,
+                has_table INTEGER NOT NULL DEFAULT 0,
+                table_duration REAL,
+                has_table_distance INTEGER NOT NULL DEFAULT 0,
+                table_distance REAL,
+                duration REAL,
+                distance REAL,
+                geometry BLOB,
+                size INTEGER NOT NULL DEFAULT 0,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (lon_key, lat_key, shelter_oid, profile, dataset_version)
+            )
+        """)
+        # Tableの距離の列がない以前のキャッシュファイルには列を追加する
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(routes)")}
+        for name, definition in (("has_table_distance", "INTEGER NOT NULL DEFAULT 0"), ("table_distance", "REAL")):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE routes ADD COLUMN {name} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_routes_last_access ON routes (last_access)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM routes").fetchone()
+        self._total_bytes = row[0]
+
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, coord: Dict[str, Any], shelter_oid: int) -> tuple:
+        """座標をスナップしてキーを作成"""
+        return (
+            int(round(coord['lon'] * self._scale)),
+            int(round(coord['lat'] * self._scale)),
+            int(shelter_oid),
+            self.profile,
+            self.dataset_version,
+        )
+
+    def get_table_durations(self,
+                            coord: Dict[str, Any],
+                            shelter_oids: Iterable[int]) -> Optional[Dict[int, Optional[float]]]:
+        """
+        出発地から候補避難所への所要時間を取得
+
+        Returns:
+            {shelter_oid: duration} の辞書（到達不能は None）。1件でも未キャッシュなら None
+        """
+        shelter_oids = list(shelter_oids)
+        durations = {}
+        now = time.time()
+        with self._lock:
+            for shelter_oid in shelter_oids:
+                key = self._key(coord, shelter_oid)
+                row = self._conn.execute(
+                    "SELECT has_table, table_duration FROM routes "
+                    "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+                    key
+                ).fetchone()
+                if row is None or not row[0]:
+                    self.misses += 1
+                    return None
+                durations[shelter_oid] = row[1]
+
+            for shelter_oid in shelter_oids:
+                self._touch(self._key(coord, shelter_oid), now)
+
+        self.hits += 1
+        return durations
+
+    def get_table_costs(self,
+                        coord: Dict[str, Any],
+                        shelter_oids: Iterable[int]) -> Optional[Dict[int, Tuple[Optional[float], Optional[float]]]]:
+        """
+        出発地から候補避難所への所要時間と距離を取得
+
+        Returns:
+            {shelter_oid: (duration, distance)} の辞書（到達不能は None）。1件でも距離が未キャッシュなら None
+        """
+        shelter_oids = list(shelter_oids)
+        costs = {}
+        now = time.time()
+        with self._lock:
+            for shelter_oid in shelter_oids:
+                key = self._key(coord, shelter_oid)
+                row = self._conn.execute(
+                    "SELECT has_table, has_table_distance, table_duration, table_distance FROM routes "
+                    "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+                    key
+                ).fetchone()
+                if row is None or not row[0] or not row[1]:
+                    self.misses += 1
+                    return None
+                costs[shelter_oid] = (row[2], row[3])
+
+            for shelter_oid in shelter_oids:
+                self._touch(self._key(coord, shelter_oid), now)
+
+        self.hits += 1
+        return costs
+
+    def put_table_durations(self,
+                            coord: Dict[str, Any],
+                            durations: Dict[int, Optional[float]],
+                            distances: Optional[Dict[int, Optional[float]]] = None):
+        """出発地から各避難所への所要時間（distances を指定した場合は距離も）を保存"""
+        now = time.time()
+        with self._lock:
+            self._flush_touches()
+            for shelter_oid, duration in durations.items():
+                key = self._key(coord, shelter_oid)
+                has_distance = 1 if distances is not None else 0
+                distance = distances.get(shelter_oid) if distances is not None else None
+                cursor = self._conn.execute(
+                    "INSERT INTO routes (lon_key, lat_key, shelter_oid, profile, dataset_version, "
+                    "has_table, table_duration, has_table_distance, table_distance, size, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (lon_key, lat_key, shelter_oid, profile, dataset_version) "
+                    "DO NOTHING",
+                    key + (duration, has_distance, distance, ROW_OVERHEAD_BYTES, now)
+                )
+                if cursor.rowcount:
+                    self._total_bytes += ROW_OVERHEAD_BYTES
+                elif distances is not None:
+                    self._conn.execute(
+                        "UPDATE routes SET has_table=1, table_duration=?, has_table_distance=1, table_distance=?, "
+                        "last_access=? "
+                        "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+                        (duration, distance, now) + key
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE routes SET has_table=1, table_duration=?, last_access=? "
+                        "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+                        (duration, now) + key
+                    )
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def get_route(self, coord: Dict[str, Any], shelter_oid: int) -> Optional[Dict[str, Any]]:
+        """
+        出発地から避難所へのルートを取得
+
+        Returns:
+            OSRMのルートオブジェクトと同じキー ('duration', 'distance', 'geometry') を持つ辞書
+            （geometry は (N, 2) の座標配列）。未キャッシュなら None
+        """
+        key = self._key(coord, shelter_oid)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT duration, distance, geometry FROM routes "
+                "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+                key
+            ).fetchone()
+            if row is None or row[2] is None:
+                self.misses += 1
+                return None
+            self._touch(key, time.time())
+
+        self.hits += 1
+        return {
+            'duration': row[0],
+            'distance': row[1],
+            'geometry': geometry_from_json(json.loads(zlib.decompress(row[2]).decode('utf-8')))
+        }
+
+    def put_route(self, coord: Dict[str, Any], shelter_oid: int, route_info: Dict[str, Any]):
+        """OSRMのルートオブジェクトから所要時間・距離・ジオメトリを保存"""
+        key = self._key(coord, shelter_oid)
+        geometry = zlib.compress(
+            json.dumps(geometry_to_json(route_info['geometry']), separators=(',', ':')).encode('utf-8')
+        )
+        size = len(geometry) + ROW_OVERHEAD_BYTES
+        now = time.time()
+        with self._lock:
+            self._flush_touches()
+            old = self._conn.execute(
+                "SELECT size FROM routes "
+                "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+                key
+            ).fetchone()
+            self._conn.execute(
+                "INSERT INTO routes (lon_key, lat_key, shelter_oid, profile, dataset_version, "
+                "duration, distance, geometry, size, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (lon_key, lat_key, shelter_oid, profile, dataset_version) "
+                "DO UPDATE SET duration=excluded.duration, distance=excluded.distance, "
+                "geometry=excluded.geometry, size=excluded.size, last_access=excluded.last_access",
+                key + (route_info['duration'], route_info['distance'], geometry, size, now)
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _touch(self, key: tuple, now: float):
+        """最終アクセス時刻の更新を記録（ロック取得済みで呼び出すこと）"""
+        self._touched[key] = now
+        if len(self._touched) >= TOUCH_FLUSH_ROWS:
+            self._flush_touches()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        """たまっている最終アクセス時刻をまとめて書き込む（ロック取得済みで呼び出すこと）"""
+        if not self._touched:
+            return
+        self._conn.executemany(
+            "UPDATE routes SET last_access=? "
+            "WHERE lon_key=? AND lat_key=? AND shelter_oid=? AND profile=? AND dataset_version=?",
+            [(now,) + key for key, now in self._touched.items()]
+        )
+        self._touched.clear()
+
+    def _evict(self):
+        """最終アクセスが古い行から削除し、合計サイズを上限の9割まで減らす（ロック取得済みで呼び出すこと）"""
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT rowid, size FROM routes ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            freed = 0
+            delete_ids = []
+            for rowid, size in rows:
+                delete_ids.append((rowid,))
+                freed += size
+                if self._total_bytes - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM routes WHERE rowid=?", delete_ids)
+            self._total_bytes -= freed
+
+    def close(self):
+        """キャッシュファイルを閉じる"""
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+            self._conn.close()
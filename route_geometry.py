@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+
+# OSRMの geometries パラメータと、エンコード済みポリラインの精度（小数点以下の桁数）
+POLYLINE_PRECISION = {'polyline': 5, 'polyline6': 6}
+GEOMETRY_FORMATS = ("geojson",) + tuple(POLYLINE_PRECISION)
+
+# 緯度1度あたりの距離（メートル、平均地球半径）
+METERS_PER_DEGREE = 6371008.8 * math.pi / 180.0
+
+Geometry = Union[np.ndarray, Dict[str, Any]]
+
+
+# MARK: ポリライン
+def decode_polyline(encoded: str, precision: int = 6) -> np.ndarray:
+    """
+    エンコード済みポリライン (Google polyline / OSRM polyline6) を座標配列に復元
+
+    1文字ずつのループではなく、全文字を NumPy 配列にして区切り（0x20 ビットが立っていない文字）で
+    値ごとにまとめ、差分の累積和で座標に戻す。
+
+    Args:
+        encoded: エンコード済み文字列
+        precision: 小数点以下の桁数（polyline6 は 6、polyline は 5）
+
+    Returns:
+        (N, 2) の float64 配列（列は 経度, 緯度）
+
+    Raises:
+        ValueError: 文字列が途中で切れている場合
+    """
+    chars = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if chars.size == 0:
+        return np.empty((0, 2), dtype=np.float64)
+
+    is_last = (chars & 0x20) == 0
+    ends = np.flatnonzero(is_last)
+    if not is_last[-1] or len(ends) % 2:
+        raise ValueError("ポリラインの文字列が不正です（途中で切れています）")
+
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # 各文字が何番目の値に属し、その値の中で何番目の5ビットか
+    value_index = np.cumsum(is_last) - is_last
+    shift = 5 * (np.arange(chars.size) - starts[value_index])
+    values = np.add.reduceat((chars & 0x1f) << shift, starts)
+    # ジグザグ符号化を戻す
+    values = (values >> 1) ^ -(values & 1)
+
+    lat_lon = np.cumsum(values.reshape(-1, 2), axis=0) / 10.0 ** precision
+    return np.ascontiguousarray(lat_lon[:, ::-1])
+
+
+def encode_polyline(coords, precision: int = 6) -> str:
+    """
+    座標配列をエンコード済みポリラインにする（decode_polyline の逆）
+
+    Args:
+        coords: (N, 2) の座標（列は 経度, 緯度）
+        precision: 小数点以下の桁数
+
+    Returns:
+        エンコード済み文字列
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return ""
+
+    scaled = np.round(coords[:, ::-1] * 10.0 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = deltas << 1
+    values = np.where(deltas < 0, ~values, values)
+
+    # 値ごとの5ビット単位の文字数
+    num_chars = np.ones(len(values), dtype=np.int64)
+    rest = values >> 5
+    while rest.any():
+        num_chars += rest > 0
+        rest >>= 5
+
+    offsets = np.cumsum(num_chars) - num_chars
+    out = np.empty(int(num_chars.sum()), dtype=np.uint8)
+    for k in range(int(num_chars.max())):
+        mask = num_chars > k
+        chunk = (values[mask] >> (5 * k)) & 0x1f
+        chunk |= np.where(num_chars[mask] > k + 1, 0x20, 0)
+        out[offsets[mask] + k] = chunk + 63
+    return out.tobytes().decode('ascii')
+
+
+# MARK: 簡略化
+def simplify_line(coords: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker 法で線を簡略化（始点・終点は必ず残す）
+
+    経緯度は線の平均緯度での正距円筒図法でメートルに換算して距離を測る（ルート程度の範囲なら十分な精度）。
+
+    Args:
+        coords: (N, 2) の座標（列は 経度, 緯度）
+        tolerance_m: 許容誤差（メートル）。元の線からこれ以上離れる点だけを残す
+
+    Returns:
+        残した点の (M, 2) 配列
+    """
+    n = len(coords)
+    if n < 3 or not tolerance_m:
+        return coords
+
+    scale = np.array([METERS_PER_DEGREE * math.cos(math.radians(float(coords[:, 1].mean()))), METERS_PER_DEGREE])
+    xy = coords * scale
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = xy[first]
+        segment = xy[last] - start
+        points = xy[first + 1:last] - start
+        length_sq = float(segment @ segment)
+        if length_sq > 0.0:
+            t = np.clip(points @ segment / length_sq, 0.0, 1.0)
+            points = points - t[:, None] * segment
+        distances = np.hypot(points[:, 0], points[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return coords[keep]
+
+
+# MARK: 保存形式
+def geometry_to_json(geometry: Geometry) -> Any:
+    """ジャーナル・キャッシュに保存する形式（座標配列は polyline6 の文字列にして小さくする）"""
+    if isinstance(geometry, np.ndarray):
+        return {'polyline6': encode_polyline(geometry, 6)}
+    return geometry
+
+
+def geometry_from_json(value: Any) -> Geometry:
+    """geometry_to_json の逆（GeoJSON で保存した以前の結果も座標配列にする）"""
+    if isinstance(value, dict) and 'polyline6' in value:
+        return decode_polyline(value['polyline6'], 6)
+    if isinstance(value, dict) and 'coordinates' in value:
+        return np.asarray(value['coordinates'], dtype=np.float64).reshape(-1, 2)
+    return value
+
+
+def geometry_to_geojson(geometry: Geometry) -> Dict[str, Any]:
+    """arcpy.AsShape に渡す GeoJSON の LineString"""
+    if isinstance(geometry, np.ndarray):
+        return {'type': 'LineString', 'coordinates': geometry.tolist()}
+    return geometry
+
+
+# MARK: 設定
+class RouteGeometryCodec:
+    """
+    Routeサービスに要求するジオメトリ形式と、保存前の簡略化
+
+    - geojson: 従来どおり座標の配列を JSON で受け取る
+    - polyline6 / polyline: エンコード済み文字列で受け取り、decode_polyline で座標配列に復元する
+      （応答が数分の1になり、JSON の解析と保持するメモリも小さくなる）
+
+    どちらの形式でも、受け取ったジオメトリは (N, 2) の座標配列として保持する。
+
+    simplify_tolerance_m を指定すると、ジャーナル・フィーチャクラスに保存する前に Douglas-Peucker 法で簡略化する
+    （キャッシュには簡略化前のジオメトリを保存するため、許容誤差を変えてもキャッシュは使える）。
+    """
+
+    def __init__(self, geometries: str = "geojson", simplify_tolerance_m: Optional[float] = None, metrics=None):
+        self.metrics = metrics
+        self.configure(geometries=geometries, simplify_tolerance_m=simplify_tolerance_m)
+
+    def configure(self, geometries: str = "geojson", simplify_tolerance_m: Optional[float] = None):
+        if geometries not in GEOMETRY_FORMATS:
+            raise ValueError(f"不明なジオメトリ形式です: {geometries}（{', '.join(GEOMETRY_FORMATS)}）")
+        self.geometries = geometries
+        self.simplify_tolerance_m = simplify_tolerance_m
+
+    def url_params(self) -> str:
+        """Routeリクエストのクエリ（ジオメトリ以外の経路情報は要求しない）"""
+        return f"overview=full&geometries={self.geometries}"
+
+    def decode_route(self, route: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        OSRMのルートオブジェクトから所要時間・距離・ジオメトリだけを取り出す（legs などは保持しない）
+
+        ジオメトリは座標配列にする。
+        """
+        start = time.perf_counter()
+        geometry = route['geometry']
+        if isinstance(geometry, str):
+            geometry = decode_polyline(geometry, POLYLINE_PRECISION[self.geometries])
+        else:
+            geometry = geometry_from_json(geometry)
+        if self.metrics is not None:
+            self.metrics.observe("route_decode_seconds", time.perf_counter() - start)
+        return {'duration': route['duration'], 'distance': route['distance'], 'geometry': geometry}
+
+    def simplify_route(self, route_info: Dict[str, Any]) -> Dict[str, Any]:
+        """保存前の簡略化（許容誤差が未指定ならそのまま返す）"""
+        geometry = route_info['geometry']
+        if not self.simplify_tolerance_m or not isinstance(geometry, np.ndarray):
+            return route_info
+        simplified = simplify_line(geometry, self.simplify_tolerance_m)
+        if self.metrics is not None:
+            self.metrics.count("route_points_decoded", len(geometry))
+            self.metrics.count("route_points_stored", len(simplified))
+        return dict(route_info, geometry=simplified)
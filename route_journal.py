@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import os
+from typing import Dict, List, Any
+
+
+class RouteJournal:
+    """
+    ルート検索結果を追記専用のチャンクファイルとしてディスクに記録するジャーナル
+
+    結果は chunk_size 件ごとに1つの JSON Lines ファイル (chunk_000001.jsonl, ...) に書き出す。
+    各チャンクは一時ファイルに書いてから名前を変更するため、途中で異常終了しても
+    書きかけのチャンクが読み込まれることはない。meta.json には実行条件を保存し、
+    再開時に条件が一致するかを確認する（集約条件が変わると Agg_OID の意味が変わるため）。
+    """
+
+    META_FILE = "meta.json"
+    CHUNK_PATTERN = "chunk_*.jsonl"
+
+    def __init__(self, journal_dir: str, chunk_size: int = 1000):
+        """
+        Args:
+            journal_dir: ジャーナルを保存するディレクトリ
+            chunk_size: 1チャンクあたりの件数
+        """
+        self.journal_dir = journal_dir
+        self.chunk_size = chunk_size
+        self._buffer = []
+        self._next_chunk = 1
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def start(self, run_meta: Dict[str, Any]):
+        """
+        新規実行としてジャーナルを初期化（既存のチャンクは削除）
+
+        Args:
+            run_meta: 実行条件（再開時の整合性チェックに使用）
+        """
+        for path in self._chunk_paths():
+            os.remove(path)
+        self._write_atomic(os.path.join(self.journal_dir, self.META_FILE), json.dumps(run_meta, ensure_ascii=False))
+        self._buffer = []
+        self._next_chunk = 1
+
+    def load(self, run_meta: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        既存のジャーナルを読み込み、以降の追記を続きのチャンクとして書き出す
+
+        Args:
+            run_meta: 今回の実行条件
+
+        Returns:
+            記録済みの結果のリスト
+
+        Raises:
+            ValueError: ジャーナルの実行条件が今回と異なる場合
+        """
+        meta_path = os.path.join(self.journal_dir, self.META_FILE)
+        if not os.path.exists(meta_path):
+            # ジャーナルがなければ新規実行と同じ
+            self.start(run_meta)
+            return []
+
+        with open(meta_path, encoding="utf-8") as f:
+            saved_meta = json.load(f)
+        if saved_meta != run_meta:
+            raise ValueError(f"ジャーナルの実行条件が一致しません: 保存済み={saved_meta}, 今回={run_meta}")
+
+        records = []
+        chunk_paths = self._chunk_paths()
+        for path in chunk_paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+
+        self._buffer = []
+        self._next_chunk = len(chunk_paths) + 1
+        return records
+
+    def append(self, record: Dict[str, Any]):
+        """結果を1件追加し、chunk_size 件たまったらチャンクとして書き出す"""
+        self._buffer.append(record)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """バッファ中の結果を新しいチャンクとして書き出す"""
+        if not self._buffer:
+            return
+        path = os.path.join(self.journal_dir, f"chunk_{self._next_chunk:06d}.jsonl")
+        lines = "".join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n" for record in self._buffer)
+        self._write_atomic(path, lines)
+        self._next_chunk += 1
+        self._buffer = []
+
+    def _chunk_paths(self) -> List[str]:
+        """チャンクファイルを番号順に返す"""
+        return sorted(glob.glob(os.path.join(self.journal_dir, self.CHUNK_PATTERN)))
+
+    @staticmethod
+    def _write_atomic(path: str, content: str):
+        """一時ファイルに書いてから置き換える"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
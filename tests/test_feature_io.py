@@ -0,0 +1,102 @@
+import struct
+
+import numpy as np
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from feature_io import FeatureFileWriter, point_columns, read_points, write_points  # noqa: E402
+from point_set import PointSet  # noqa: E402
+
+
+def ewkb_point(lon, lat, srid=None, little=True):
+    order = "<" if little else ">"
+    geometry_type = 1 | (0x20000000 if srid is not None else 0)
+    header = struct.pack(order + "BI", 1 if little else 0, geometry_type)
+    if srid is not None:
+        header += struct.pack(order + "I", srid)
+    return header + struct.pack(order + "dd", lon, lat)
+
+
+def test_wkb_points_of_both_byte_orders_and_empty_rows():
+    column = pa.array([ewkb_point(135.5, 34.5), None, ewkb_point(139.7, 35.6, little=False), b""], pa.binary())
+    lon, lat, valid = point_columns(column)
+    assert valid.tolist() == [True, False, True, False]
+    assert lon[valid].tolist() == [135.5, 139.7]
+    assert lat[valid].tolist() == [34.5, 35.6]
+
+
+@pytest.mark.parametrize("little", [True, False])
+def test_ewkb_with_srid_reads_coordinates_after_srid(little):
+    column = pa.array([ewkb_point(135.5, 34.5, srid=4326, little=little), ewkb_point(139.7, 35.6)], pa.binary())
+    lon, lat, valid = point_columns(column)
+    assert valid.all()
+    assert lon.tolist() == [135.5, 139.7]
+    assert lat.tolist() == [34.5, 35.6]
+
+
+def test_ewkb_with_other_srid_is_rejected():
+    column = pa.array([ewkb_point(500000.0, 3800000.0, srid=6677)], pa.binary())
+    with pytest.raises(ValueError, match="6677"):
+        point_columns(column)
+
+
+def test_non_point_geometry_is_rejected():
+    line = struct.pack("<BII", 1, 2, 2) + np.array([[135.0, 34.0], [135.1, 34.1]]).tobytes()
+    with pytest.raises(ValueError):
+        point_columns(pa.array([line], pa.binary()))
+
+
+def test_geoparquet_points_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    points = PointSet(np.arange(10, 1010), rng.uniform(135, 136, 1000), rng.uniform(34, 35, 1000))
+    path = str(tmp_path / "buildings.parquet")
+    write_points(path, points)
+
+    loaded = read_points(path)
+    assert np.array_equal(loaded.oid, points.oid)
+    assert np.array_equal(loaded.lon, points.lon)
+    assert np.array_equal(loaded.lat, points.lat)
+
+
+def test_geoparquet_with_other_crs_is_rejected(tmp_path):
+    path = str(tmp_path / "projected.parquet")
+    geo = b'{"primary_column": "geometry", "columns": {"geometry": {"encoding": "WKB", ' \
+          b'"crs": {"id": {"authority": "EPSG", "code": 6677}}}}}'
+    table = pa.table({"geometry": pa.array([ewkb_point(1.0, 2.0)], pa.binary())}).replace_schema_metadata({b"geo": geo})
+    pq.write_table(table, path)
+    with pytest.raises(ValueError):
+        read_points(path)
+
+
+def test_feature_file_writer_flushes_lines_in_batches(tmp_path):
+    path = str(tmp_path / "routes.parquet")
+    writer = FeatureFileWriter(path, "LineString", [("Agg_OID", "int32"), ("Drtn_sec", "float64")], batch_size=3)
+    lines = [np.array([[135.0, 34.0], [135.0 + i, 34.5]]) for i in range(7)]
+    for i, line in enumerate(lines):
+        writer.insertRow([line, i, None if i == 2 else i * 1.5])
+    writer.close()
+
+    table = pq.read_table(path)
+    assert table.num_rows == 7
+    assert table["Agg_OID"].to_pylist() == list(range(7))
+    assert table["Drtn_sec"].to_pylist()[2] is None
+    wkb = table["geometry"][4].as_py()
+    assert struct.unpack("<BII", wkb[:9]) == (1, 2, 2)
+    assert np.array_equal(np.frombuffer(wkb[9:], "<f8").reshape(-1, 2), lines[4])
+
+
+def test_geoparquet_rows_without_geometry_are_skipped(tmp_path):
+    path = str(tmp_path / "with_empty.parquet")
+    geo = b'{"primary_column": "geometry", "columns": {"geometry": {"encoding": "WKB"}}}'
+    table = pa.table({
+        "OBJECTID": pa.array([5, 6, 7], pa.int32()),
+        "geometry": pa.array([ewkb_point(135.5, 34.5), None, ewkb_point(139.7, 35.6)], pa.binary()),
+    }).replace_schema_metadata({b"geo": geo})
+    pq.write_table(table, path)
+
+    points = read_points(path)
+    assert points.oid.tolist() == [5, 7]
+    assert points.lon.tolist() == [135.5, 139.7]
+    assert points.lat.tolist() == [34.5, 35.6]
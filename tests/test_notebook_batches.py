@@ -0,0 +1,64 @@
+import json
+import sqlite3
+
+import pytest
+
+import notebook
+
+SHELTERS = {
+    10: {'oid': 10, 'lon': 135.51, 'lat': 34.51},
+    11: {'oid': 11, 'lon': 135.49, 'lat': 34.49},
+}
+BATCH = [
+    (1, {'oid': 1, 'lon': 135.50, 'lat': 34.50}, [10, 11]),
+    (2, {'oid': 2, 'lon': 135.52, 'lat': 34.52}, [10]),
+]
+
+
+def raise_decode_error(*args, **kwargs):
+    raise json.JSONDecodeError("Expecting value", "<html>", 0)
+
+
+@pytest.fixture
+def malformed_osrm(monkeypatch):
+    monkeypatch.setattr(notebook.osrm_client, "get_json", raise_decode_error)
+
+
+def assert_batch_failed(results):
+    assert [result['agg_bldg_oid'] for result in results] == [1, 2]
+    assert not any(result['success'] for result in results)
+    assert all(result['route_info'] is None for result in results)
+
+
+def test_batch_routes_turn_unexpected_errors_into_failed_results(malformed_osrm):
+    assert_batch_failed(notebook.process_batch_routes(BATCH, SHELTERS, "http://osrm:5000"))
+
+
+def test_batch_attributes_turn_unexpected_errors_into_failed_results(malformed_osrm):
+    assert_batch_failed(notebook.process_batch_attributes(BATCH, SHELTERS, "http://osrm:5000"))
+
+
+class LockedCache:
+    def get_table_durations(self, coord, shelter_oids):
+        raise sqlite3.OperationalError("database is locked")
+
+    get_table_costs = get_table_durations
+
+
+def test_batch_attributes_survive_cache_errors():
+    assert_batch_failed(notebook.process_batch_attributes(BATCH, SHELTERS, "http://osrm:5000", LockedCache()))
+
+
+@pytest.mark.parametrize("attributes_only", [False, True])
+def test_async_batches_turn_unexpected_errors_into_failed_results(monkeypatch, attributes_only):
+    aiohttp = pytest.importorskip("aiohttp")
+
+    async def truncated_payload(*args, **kwargs):
+        raise aiohttp.ClientPayloadError("Response payload is not completed")
+
+    monkeypatch.setattr(notebook.osrm_client, "get_json_async", truncated_payload)
+    results = []
+    notebook.asyncio.run(notebook.run_batch_routes_async([BATCH, BATCH], SHELTERS, "http://osrm:5000", 4, 4,
+                                                         results.extend, attributes_only=attributes_only))
+    assert len(results) == 4
+    assert not any(result['success'] for result in results)
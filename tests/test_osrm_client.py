@@ -0,0 +1,127 @@
+import heapq
+import math
+import random
+
+import pytest
+
+import osrm_client
+from osrm_client import AIMDLimiter, latency_kind
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(limiter, capacity, service_time, completions=40000, seed=0, kind="route", error_rate=0.0):
+    """
+    同時に capacity 件まで処理し、それを超えた分は待ち行列に入るサーバーに、上限いっぱいまで送り続ける
+
+    error_rate の割合の応答は、負荷と無関係な 5xx（"failure"）にする。
+
+    Returns:
+        後半の上限の平均
+    """
+    rng = random.Random(seed)
+    clock = osrm_client.time.monotonic
+    events = []
+    waiting = []
+    busy = 0
+    sequence = 0
+    limits = []
+
+    def serve(start):
+        nonlocal busy, sequence
+        busy += 1
+        sequence += 1
+        heapq.heappush(events, (clock() + service_time(rng), sequence, start))
+
+    for done in range(completions):
+        while True:
+            start = limiter.try_acquire()
+            if start is None:
+                break
+            if busy < capacity:
+                serve(start)
+            else:
+                waiting.append(start)
+
+        finished_at, _, start = heapq.heappop(events)
+        clock.now = finished_at
+        busy -= 1
+        if waiting:
+            serve(waiting.pop(0))
+        if rng.random() < error_rate:
+            limiter.release(start, "failure", kind)
+        else:
+            limiter.release(start, "success", kind, finished_at - start)
+        if done >= completions // 2:
+            limits.append(limiter.limit)
+
+    return sum(limits) / len(limits)
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(osrm_client.time, "monotonic", clock)
+    return clock
+
+
+SERVICE_TIMES = {
+    "constant": lambda rng: 0.010,
+    "uniform": lambda rng: rng.uniform(0.005, 0.015),
+    "lognormal": lambda rng: rng.lognormvariate(math.log(0.010), 0.6),
+}
+
+
+@pytest.mark.parametrize("capacity", [4, 32])
+@pytest.mark.parametrize("distribution", sorted(SERVICE_TIMES))
+def test_limit_converges_near_capacity_with_noisy_latency(fake_clock, distribution, capacity):
+    limiter = AIMDLimiter(initial=8, max_limit=256)
+    mean_limit = simulate(limiter, capacity, SERVICE_TIMES[distribution])
+    assert 0.7 * capacity <= mean_limit <= 1.6 * capacity
+
+
+def test_limit_grows_to_max_when_server_has_spare_capacity(fake_clock):
+    limiter = AIMDLimiter(initial=8, max_limit=64)
+    simulate(limiter, 1000, SERVICE_TIMES["lognormal"], completions=20000)
+    assert limiter.limit == pytest.approx(64)
+
+
+@pytest.mark.parametrize("error_rate", [0.01, 0.03])
+def test_sporadic_server_errors_do_not_collapse_limit(fake_clock, error_rate):
+    limiter = AIMDLimiter(initial=8, max_limit=64)
+    mean_limit = simulate(limiter, 1000, SERVICE_TIMES["lognormal"], completions=20000, error_rate=error_rate)
+    assert mean_limit >= 0.8 * 64
+
+
+def test_high_server_error_rate_decreases_limit(fake_clock):
+    limiter = AIMDLimiter(initial=32, max_limit=64, error_rate_threshold=0.1)
+    starts = [limiter.acquire() for _ in range(32)]
+    fake_clock.now = 1.0
+    for i, start in enumerate(starts):
+        limiter.release(start, "failure" if i % 4 == 0 else "success", "route", 0.01)
+    assert limiter.limit < 32
+    assert limiter.decreases == 1
+
+
+def test_overload_decreases_limit_once_per_overload(fake_clock):
+    limiter = AIMDLimiter(initial=32, max_limit=64, error_backoff=0.5)
+    starts = [limiter.acquire() for _ in range(4)]
+    fake_clock.now = 1.0
+    for start in starts:
+        limiter.release(start, "overload")
+    # 同じ過負荷で送信したリクエストの失敗では1回だけ減らす
+    assert limiter.limit == pytest.approx(16)
+    assert limiter.decreases == 1
+
+
+def test_latency_kind_separates_table_sizes():
+    small = "http://osrm:5000/table/v1/walking/" + ";".join(["135.0,34.0"] * 10) + "?sources=0"
+    large = "http://osrm:5000/table/v1/walking/" + ";".join(["135.0,34.0"] * 100) + "?sources=0"
+    assert latency_kind(small, "table") != latency_kind(large, "table")
+    assert latency_kind("http://osrm:5000/route/v1/walking/135.0,34.0;135.1,34.1", "route") == "route"
@@ -0,0 +1,69 @@
+import sqlite3
+
+import numpy as np
+
+import route_cache
+from route_cache import RouteCache
+
+COORD = {'lon': 135.5, 'lat': 34.5}
+
+
+def last_access(db_path, shelter_oid):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT last_access FROM routes WHERE shelter_oid=?", (shelter_oid,)).fetchone()[0]
+
+
+def route(duration):
+    return {'duration': duration, 'distance': duration * 1.2, 'geometry': np.array([[135.5, 34.5], [135.6, 34.6]])}
+
+
+def test_hit_defers_access_time_until_next_write(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "cache.sqlite")
+    now = [100.0]
+    monkeypatch.setattr(route_cache.time, "time", lambda: now[0])
+    cache = RouteCache(db_path)
+    cache.put_table_durations(COORD, {1: 60.0, 2: 90.0})
+
+    now[0] = 200.0
+    assert cache.get_table_durations(COORD, [1, 2]) == {1: 60.0, 2: 90.0}
+    # 読み込みではコミットしない
+    assert last_access(db_path, 1) == 100.0
+
+    now[0] = 300.0
+    cache.put_table_durations({'lon': 139.7, 'lat': 35.6}, {3: 30.0})
+    assert last_access(db_path, 1) == 200.0
+    assert cache.hits == 1
+    cache.close()
+
+
+def test_deferred_access_time_is_written_on_close(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "cache.sqlite")
+    now = [100.0]
+    monkeypatch.setattr(route_cache.time, "time", lambda: now[0])
+    cache = RouteCache(db_path)
+    cache.put_route(COORD, 1, route(60.0))
+
+    now[0] = 200.0
+    assert cache.get_route(COORD, 1)['duration'] == 60.0
+    cache.close()
+    assert last_access(db_path, 1) == 200.0
+
+
+def test_eviction_keeps_recently_read_rows(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "cache.sqlite")
+    now = [0.0]
+    monkeypatch.setattr(route_cache.time, "time", lambda: now[0])
+    cache = RouteCache(db_path, max_bytes=10 * route_cache.ROW_OVERHEAD_BYTES)
+    for shelter_oid in range(1, 11):
+        now[0] = float(shelter_oid)
+        cache.put_table_durations(COORD, {shelter_oid: 60.0})
+
+    # 最も古い行を読むと、次の保存で押し出されるのは読んでいない古い行になる
+    now[0] = 20.0
+    assert cache.get_table_durations(COORD, [1]) == {1: 60.0}
+    now[0] = 30.0
+    cache.put_table_durations(COORD, {11: 60.0})
+
+    assert cache.get_table_durations(COORD, [1]) is not None
+    assert cache.get_table_durations(COORD, [2]) is None
+    cache.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from route_geometry import decode_polyline, encode_polyline, simplify_line
+
+# ポリラインの仕様の例（緯度, 経度 = (38.5, -120.2), (40.7, -120.95), (43.252, -126.453)）
+SPEC_COORDS = np.array([[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]])
+SPEC_ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_decode_spec_example_at_precision_5():
+    assert np.allclose(decode_polyline(SPEC_ENCODED, precision=5), SPEC_COORDS, atol=1e-9)
+
+
+def test_encode_spec_example_at_precision_5():
+    assert encode_polyline(SPEC_COORDS, precision=5) == SPEC_ENCODED
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_spec_example_round_trip(precision):
+    encoded = encode_polyline(SPEC_COORDS, precision=precision)
+    assert np.allclose(decode_polyline(encoded, precision=precision), SPEC_COORDS, atol=0.5 / 10 ** precision)
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_round_trip_with_negative_and_zero_deltas(precision):
+    coords = np.array([
+        [139.7, 35.6],
+        [139.7, 35.6],        # 差分 0
+        [139.69, 35.61],      # 経度は負、緯度は正の差分
+        [139.69, 35.59],      # 経度は 0、緯度は負の差分
+        [-0.00001, -0.00001],  # 符号をまたぐ大きな差分
+        [0.0, 0.0],
+    ])
+    encoded = encode_polyline(coords, precision=precision)
+    assert np.allclose(decode_polyline(encoded, precision=precision), coords, atol=0.5 / 10 ** precision)
+
+
+def test_round_trip_of_random_route_at_precision_6():
+    rng = np.random.default_rng(0)
+    steps = rng.integers(-5000, 5000, size=(500, 2)) / 1e6
+    coords = np.round(np.array([135.5, 34.5]) + np.cumsum(steps, axis=0), 6)
+    assert np.allclose(decode_polyline(encode_polyline(coords)), coords, atol=5e-7)
+
+
+def test_empty_input():
+    assert encode_polyline(np.empty((0, 2))) == ""
+    decoded = decode_polyline("")
+    assert decoded.shape == (0, 2)
+
+
+def test_truncated_string_is_rejected():
+    with pytest.raises(ValueError):
+        decode_polyline(SPEC_ENCODED[:-1], precision=5)
+
+
+def test_simplify_keeps_endpoints_and_drops_nearly_collinear_points():
+    lon = np.linspace(135.0, 135.01, 50)
+    lat = 34.5 + 1e-7 * np.sin(np.arange(50))  # 約1cmの揺れ
+    coords = np.column_stack([lon, lat])
+    simplified = simplify_line(coords, tolerance_m=1.0)
+    assert len(simplified) == 2
+    assert np.array_equal(simplified[0], coords[0])
+    assert np.array_equal(simplified[-1], coords[-1])
+
+
+def test_simplify_keeps_corner_beyond_tolerance():
+    coords = np.array([[135.0, 34.5], [135.0005, 34.5], [135.001, 34.5], [135.001, 34.5005], [135.001, 34.501]])
+    simplified = simplify_line(coords, tolerance_m=5.0)
+    assert simplified.tolist() == [[135.0, 34.5], [135.001, 34.5], [135.001, 34.501]]
+
+
+def test_simplify_leaves_short_lines_and_zero_tolerance_unchanged():
+    coords = np.array([[135.0, 34.5], [135.1, 34.6]])
+    assert np.array_equal(simplify_line(coords, 10.0), coords)
+    zigzag = np.array([[135.0, 34.5], [135.0001, 34.50001], [135.0002, 34.5]])
+    assert np.array_equal(simplify_line(zigzag, 0), zigzag)